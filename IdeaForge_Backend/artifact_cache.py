@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import metrics
+
+# Maps a hash of the generated source files to the APK a previous successful build
+# produced from them, so identical generations skip git, Cloud Build and the build wait.
+
+ARTIFACT_CACHE_PATH = os.getenv("ARTIFACT_CACHE_PATH")  # Optional JSON index that survives restarts
+SIGNED_URL_EXPIRATION_SECONDS = 3600
+
+
+def normalize_generated_source(content: str) -> str:
+    """Ignores differences that cannot change the build: line endings and trailing whitespace."""
+    lines = content.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip("\n")
+
+
+def hash_generated_files(files: dict) -> str:
+    normalized = [[filename, normalize_generated_source(files[filename])] for filename in sorted(files)]
+    canonical = json.dumps(normalized, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """Thread-safe source-hash -> APK metadata index, optionally persisted to a JSON file."""
+
+    def __init__(self, path: str = None):
+        self._path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error loading artifact cache from {path}: {e}")
+
+    def get(self, source_hash: str):
+        with self._lock:
+            entry = self._entries.get(source_hash)
+            self._stats["hits" if entry else "misses"] += 1
+            return dict(entry) if entry else None
+
+    def put(self, source_hash: str, bucket_name: str, blob_name: str, build_id: str, log_url: str = None):
+        with self._lock:
+            self._entries[source_hash] = {
+                "bucket": bucket_name,
+                "blob_name": blob_name,
+                "build_id": build_id,
+                "log_url": log_url,
+                "created_at": time.time(),
+            }
+            self._stats["stores"] += 1
+            self._save_locked()
+
+    def invalidate(self, source_hash: str):
+        with self._lock:
+            if self._entries.pop(source_hash, None) is not None:
+                self._stats["invalidations"] += 1
+                self._save_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            return stats
+
+    def _save_locked(self):
+        if not self._path:
+            return
+        tmp_path = f"{self._path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            print(f"Error saving artifact cache to {self._path}: {e}")
+
+
+def resolve_cached_artifact(cache: ArtifactCache, source_hash: str, storage_client):
+    """
+    Returns the cache entry with a freshly signed download_url, or None on a miss.
+    Entries whose APK object no longer exists are dropped.
+    """
+    entry = cache.get(source_hash)
+    if not entry:
+        return None
+    try:
+        blob = storage_client.bucket(entry["bucket"]).blob(entry["blob_name"])
+        if not blob.exists():
+            print(f"Cached APK {entry['blob_name']} no longer exists; rebuilding")
+            cache.invalidate(source_hash)
+            return None
+        entry["download_url"] = blob.generate_signed_url(version="v4", expiration=SIGNED_URL_EXPIRATION_SECONDS)
+    except Exception as e:
+        print(f"Error signing cached APK {entry['blob_name']}: {e}")
+        return None
+    print(f"Artifact cache hit for source {source_hash[:12]}: build {entry['build_id']}")
+    return entry
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_artifact_cache() -> ArtifactCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ArtifactCache(ARTIFACT_CACHE_PATH)
+                metrics.register_stats("ideaforge_artifact_cache", _cache.stats,
+                                       counters=("hits", "misses", "stores", "invalidations"))
+    return _cache
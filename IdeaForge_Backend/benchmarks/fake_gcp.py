@@ -0,0 +1,294 @@
+"""
+Local stand-ins for the Cloud Build and Cloud Storage clients used by live_backend_real_build.
+
+FakeCloudBuildClient answers create_build / get_build with the attributes the backend
+reads, moves each build through QUEUED, WORKING and SUCCESS (or FAILURE) on a timeline,
+and pushes every status change to the backend's webhook in Pub/Sub push format. When
+given the bare git repository that stands in for GitHub, a build fails unless the commit
+it was asked to build was actually pushed there. A successful build uploads its APK to a
+FakeStorageClient bucket, which lists blobs and hands out fake signed URLs, under the
+same names as cloudbuild.yaml: ideaforge-builds/${SHORT_SHA}_app-release.apk from the
+copy step, and ideaforge-builds/app-release.apk from artifacts:, which every build
+overwrites.
+
+Install them behind the real code paths with gcp_clients.set_clients(); see load_harness.py.
+"""
+import base64
+import hashlib
+import heapq
+import itertools
+import json
+import random
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import requests
+
+# google.cloud.devtools.cloudbuild_v1.types.Build.Status values
+BUILD_STATUS_CODES = {
+    "STATUS_UNKNOWN": 0, "QUEUED": 1, "WORKING": 2, "SUCCESS": 3, "FAILURE": 4,
+    "INTERNAL_ERROR": 5, "TIMEOUT": 6, "CANCELLED": 7, "EXPIRED": 9, "PENDING": 10,
+}
+APK_PATH = "build/app/outputs/flutter-apk/app-release.apk"
+APK_PREFIX = "ideaforge-builds/"
+SHORT_SHA_LENGTH = 7
+
+
+class FakeCredentials:
+    """Truthy placeholder; the fake clients never look at it."""
+
+
+class FakeBlob:
+    def __init__(self, storage, bucket_name: str, name: str):
+        self._storage = storage
+        self.bucket_name = bucket_name
+        self.name = name
+
+    def exists(self) -> bool:
+        self._storage.simulate_latency()
+        return self._storage.has_object(self.bucket_name, self.name)
+
+    def generate_signed_url(self, version: str = "v4", expiration: int = 3600) -> str:
+        # Signing is local computation in the real SDK too, so no simulated latency
+        signature = hashlib.sha256(f"{self.bucket_name}/{self.name}/{expiration}".encode("utf-8")).hexdigest()
+        return (f"https://storage.googleapis.com/{self.bucket_name}/{self.name}"
+                f"?X-Goog-Algorithm=GOOG4-RSA-SHA256&X-Goog-Expires={expiration}&X-Goog-Signature={signature}")
+
+
+class FakeBucket:
+    def __init__(self, storage, name: str):
+        self._storage = storage
+        self.name = name
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self._storage, self.name, name)
+
+    def list_blobs(self, prefix: str = ""):
+        self._storage.simulate_latency()
+        return [FakeBlob(self._storage, self.name, name) for name in self._storage.object_names(self.name, prefix)]
+
+
+class FakeStorageClient:
+    def __init__(self, latency_ms: float = 0):
+        self.latency_ms = latency_ms
+        self._objects = {}  # bucket name -> {blob name: id of the build that last wrote it}
+        self._lock = threading.Lock()
+
+    def simulate_latency(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(self, name)
+
+    def put_object(self, bucket_name: str, name: str, writer: str = None):
+        with self._lock:
+            self._objects.setdefault(bucket_name, {})[name] = writer
+
+    def object_writer(self, bucket_name: str, name: str):
+        with self._lock:
+            return self._objects.get(bucket_name, {}).get(name)
+
+    def has_object(self, bucket_name: str, name: str) -> bool:
+        with self._lock:
+            return name in self._objects.get(bucket_name, {})
+
+    def object_names(self, bucket_name: str, prefix: str = "") -> list:
+        with self._lock:
+            return sorted(name for name in self._objects.get(bucket_name, {}) if name.startswith(prefix))
+
+
+class FakeCloudBuildClient:
+    """
+    Builds take queue_seconds to start and build_seconds to finish (each +/- jitter), and
+    fail with failure_rate. Notifications are redelivered with redelivery_rate, as Pub/Sub
+    may. on_notification(seconds, status_code) is called after every delivery attempt.
+    """
+
+    def __init__(self, storage: FakeStorageClient, bucket_name: str, webhook_url: str = None, git_dir: str = None,
+                 queue_seconds: float = 2, build_seconds: float = 30, jitter: float = 0.2, failure_rate: float = 0,
+                 api_latency_ms: float = 0, redelivery_rate: float = 0, webhook_workers: int = 4,
+                 on_notification=None):
+        self.storage = storage
+        self.bucket_name = bucket_name
+        self.webhook_url = webhook_url
+        self.git_dir = git_dir
+        self.queue_seconds = queue_seconds
+        self.build_seconds = build_seconds
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.api_latency_ms = api_latency_ms
+        self.redelivery_rate = redelivery_rate
+        self.on_notification = on_notification
+        self._builds = {}
+        self._events = []  # heap of (due, sequence, build_id, status)
+        self._sequence = itertools.count()
+        self._lock = threading.Condition()
+        self._stopped = False
+        self._local = threading.local()
+        self._stats = {"builds": 0, "notifications": 0, "redeliveries": 0, "delivery_errors": 0,
+                       "missing_commits": 0}
+        self._notifier = ThreadPoolExecutor(max_workers=webhook_workers, thread_name_prefix="fake-cloud-build-webhook")
+        threading.Thread(target=self._run_timeline, name="fake-cloud-build", daemon=True).start()
+
+    def _simulate_latency(self):
+        if self.api_latency_ms:
+            time.sleep(self.api_latency_ms / 1000)
+
+    def _duration(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    # --- CloudBuildClient surface ---
+    def create_build(self, project_id: str, build):
+        self._simulate_latency()
+        repo_source = build.source.repo_source
+        build_id = str(uuid.uuid4())
+        now = time.monotonic()
+        with self._lock:
+            self._builds[build_id] = {
+                "id": build_id,
+                "project_id": project_id,
+                "status": "QUEUED",
+                "commit_sha": getattr(repo_source, "commit_sha", "") or "",
+                "branch_name": getattr(repo_source, "branch_name", "") or "",
+                "log_url": f"https://console.cloud.google.com/cloud-build/builds/{build_id}?project={project_id}",
+            }
+            self._stats["builds"] += 1
+            started = now + self._duration(self.queue_seconds)
+            self._schedule(started, build_id, "WORKING")
+            self._schedule(started + self._duration(self.build_seconds), build_id, None)
+        self._notify(build_id)
+        return SimpleNamespace(name=f"projects/{project_id}/operations/{uuid.uuid4()}",
+                               metadata=SimpleNamespace(build=SimpleNamespace(id=build_id)))
+
+    def get_build(self, project_id: str, id: str):
+        self._simulate_latency()
+        with self._lock:
+            build = dict(self._builds[id])
+        return SimpleNamespace(
+            id=id, status=BUILD_STATUS_CODES[build["status"]], log_url=build["log_url"],
+            source=SimpleNamespace(repo_source=SimpleNamespace(commit_sha=build["commit_sha"],
+                                                               branch_name=build["branch_name"])),
+            substitutions=self._substitutions(build),
+            artifacts=SimpleNamespace(objects=SimpleNamespace(location=self._artifacts_location(), paths=[APK_PATH])),
+        )
+
+    # --- Timeline ---
+    def _schedule(self, due: float, build_id: str, status):
+        heapq.heappush(self._events, (due, next(self._sequence), build_id, status))
+        self._lock.notify()
+
+    def _run_timeline(self):
+        while True:
+            with self._lock:
+                while not self._stopped and (not self._events or self._events[0][0] > time.monotonic()):
+                    self._lock.wait(self._events[0][0] - time.monotonic() if self._events else None)
+                if self._stopped:
+                    return
+                _, _, build_id, status = heapq.heappop(self._events)
+                build = self._builds[build_id]
+                if build["status"] in ("FAILURE", "SUCCESS"):
+                    continue
+            if status == "WORKING" and not self._source_exists(build):
+                status = "FAILURE"
+            elif status is None:
+                status = "FAILURE" if random.random() < self.failure_rate else "SUCCESS"
+            if status == "SUCCESS":
+                # cloudbuild.yaml's copy step, then its artifacts: upload
+                self.storage.put_object(self.bucket_name, self._apk_blob_name(build), build_id)
+                self.storage.put_object(self.bucket_name, APK_PREFIX + APK_PATH.rsplit("/", 1)[-1], build_id)
+            with self._lock:
+                build["status"] = status
+            self._notify(build_id)
+
+    def _source_exists(self, build: dict) -> bool:
+        """Like Cloud Build fetching the source: the commit (or branch) must be in the remote."""
+        if not self.git_dir:
+            return True
+        ref = build["commit_sha"] + "^{commit}" if build["commit_sha"] else "refs/heads/" + build["branch_name"]
+        result = subprocess.run(["git", "--git-dir", self.git_dir, "cat-file", "-e", ref], capture_output=True)
+        if result.returncode != 0:
+            with self._lock:
+                self._stats["missing_commits"] += 1
+            return False
+        return True
+
+    def _substitutions(self, build: dict) -> dict:
+        if not build["commit_sha"]:
+            return {}
+        return {"COMMIT_SHA": build["commit_sha"], "SHORT_SHA": build["commit_sha"][:SHORT_SHA_LENGTH]}
+
+    def _apk_blob_name(self, build: dict) -> str:
+        # Builds of a branch with no commit SHA have an empty $SHORT_SHA, as in Cloud Build
+        return f"{APK_PREFIX}{build['commit_sha'][:SHORT_SHA_LENGTH]}_app-release.apk"
+
+    def _artifacts_location(self) -> str:
+        return f"gs://{self.bucket_name}/{APK_PREFIX}"
+
+    # --- Pub/Sub push notifications ---
+    def _notification(self, build_id: str) -> dict:
+        with self._lock:
+            build = dict(self._builds[build_id])
+        resource = {
+            "id": build_id,
+            "projectId": build["project_id"],
+            "status": build["status"],
+            "logUrl": build["log_url"],
+            "source": {"repoSource": {"commitSha": build["commit_sha"], "branchName": build["branch_name"]}},
+            "substitutions": self._substitutions(build),
+            "artifacts": {"objects": {"location": self._artifacts_location(), "paths": [APK_PATH]}},
+        }
+        return {
+            "message": {
+                "data": base64.b64encode(json.dumps(resource).encode("utf-8")).decode("ascii"),
+                "attributes": {"buildId": build_id, "status": build["status"]},
+                "messageId": str(uuid.uuid4()),
+            },
+            "subscription": f"projects/{build['project_id']}/subscriptions/cloud-builds",
+        }
+
+    def _notify(self, build_id: str):
+        if not self.webhook_url:
+            return
+        payload = self._notification(build_id)
+        self._notifier.submit(self._deliver, payload)
+        if random.random() < self.redelivery_rate:
+            with self._lock:
+                self._stats["redeliveries"] += 1
+            self._notifier.submit(self._deliver, payload)
+
+    def _deliver(self, payload: dict):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        started = time.perf_counter()
+        status_code = None
+        try:
+            status_code = session.post(self.webhook_url, json=payload, timeout=30).status_code
+        except requests.RequestException as e:
+            print(f"Fake Cloud Build: webhook delivery failed: {e}")
+        with self._lock:
+            self._stats["notifications"] += 1
+            if status_code is None or status_code >= 400:
+                self._stats["delivery_errors"] += 1
+        if self.on_notification:
+            self.on_notification(time.perf_counter() - started, status_code)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            statuses = {}
+            for build in self._builds.values():
+                statuses[build["status"]] = statuses.get(build["status"], 0) + 1
+        stats["statuses"] = statuses
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+        self._notifier.shutdown(wait=True)
@@ -0,0 +1,297 @@
+"""
+Local stand-in for the Anthropic Messages API.
+
+Answers POST /v1/messages with a small generated Flutter app, as JSON or as an SSE
+stream, and emulates prompt caching: prefixes ending at a cache_control breakpoint are
+remembered for five minutes, and usage reports cache_creation_input_tokens and
+cache_read_input_tokens the way the real API does (tokens estimated as chars / 4).
+Latency, per-chunk streaming delay and injected 429/529 responses are configurable.
+With unique replies each response's main.dart differs by a comment line, so response,
+artifact and build coalescing caches downstream do not collapse a load test into one build.
+
+    python benchmarks/fake_messages_api.py --port 8787 --latency-ms 800 --error-rate 0.1
+    ANTHROPIC_API_URL=http://127.0.0.1:8787/v1/messages ANTHROPIC_API_KEY=test python live_backend_real_build.py
+
+Import start_fake_messages_api() to run it in-process from a harness.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_TTL_SECONDS = 300
+MIN_CACHEABLE_TOKENS = 1024
+# Like the real API, a breakpoint also hits a prefix cached at any of the preceding blocks
+CACHE_LOOKBACK_BLOCKS = 20
+STREAM_CHUNK_CHARS = 40
+
+DEFAULT_REPLY = """FILENAME: main.dart
+```dart
+import 'package:flutter/material.dart';
+
+void main() => runApp(const CounterApp());
+
+class CounterApp extends StatelessWidget {
+  const CounterApp({super.key});
+
+  @override
+  Widget build(BuildContext context) {
+    return const MaterialApp(home: CounterPage());
+  }
+}
+
+class CounterPage extends StatefulWidget {
+  const CounterPage({super.key});
+
+  @override
+  State<CounterPage> createState() => _CounterPageState();
+}
+
+class _CounterPageState extends State<CounterPage> {
+  int _count = 0;
+
+  @override
+  Widget build(BuildContext context) {
+    return Scaffold(
+      appBar: AppBar(title: const Text('Counter')),
+      body: Center(child: Text('$_count', style: const TextStyle(fontSize: 48))),
+      floatingActionButton: FloatingActionButton(
+        onPressed: () => setState(() => _count++),
+        child: const Icon(Icons.add),
+      ),
+    );
+  }
+}
+```
+
+FILENAME: pubspec.yaml
+```yaml
+name: generated_app
+description: Generated by Idea Forge.
+version: 1.0.0+1
+environment:
+  sdk: '>=3.0.0 <4.0.0'
+dependencies:
+  flutter:
+    sdk: flutter
+flutter:
+  uses-material-design: true
+```"""
+
+
+def estimate_tokens(value) -> int:
+    return max(1, len(json.dumps(value, sort_keys=True)) // 4)
+
+
+def _blocks(content):
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return content or []
+
+
+def prompt_blocks(payload: dict) -> tuple:
+    """Returns (blocks, breakpoint_indexes): every system/message block in order, and which carry cache_control."""
+    blocks = []
+    breakpoints = []
+    sources = [("system", payload.get("system") or [])]
+    sources += [(m.get("role"), m.get("content")) for m in payload.get("messages", [])]
+    for role, content in sources:
+        for block in _blocks(content):
+            blocks.append((role, block.get("text", "")))
+            if block.get("cache_control"):
+                breakpoints.append(len(blocks))
+    return blocks, breakpoints
+
+
+def _prefix_key(blocks) -> str:
+    return hashlib.sha256(json.dumps(blocks).encode("utf-8")).hexdigest()
+
+
+class PromptCache:
+    def __init__(self, ttl_seconds: float = CACHE_TTL_SECONDS, min_tokens: int = MIN_CACHEABLE_TOKENS):
+        self._entries = {}
+        self._ttl = ttl_seconds
+        self._min_tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def usage(self, payload: dict) -> dict:
+        blocks, breakpoints = prompt_blocks(payload)
+        total = estimate_tokens(blocks)
+        read = cached_to = 0
+        now = time.monotonic()
+        with self._lock:
+            for end in breakpoints:
+                if estimate_tokens(blocks[:end]) < self._min_tokens:
+                    continue
+                # Longest cached prefix ending at or shortly before this breakpoint
+                for length in range(end, max(cached_to, end - CACHE_LOOKBACK_BLOCKS), -1):
+                    if self._entries.get(_prefix_key(blocks[:length]), 0) > now:
+                        if length > cached_to:
+                            read = estimate_tokens(blocks[:length])
+                        break
+                cached_to = end
+                # Writes and reads both (re)start the entry's lifetime, as in the real API
+                self._entries[_prefix_key(blocks[:end])] = now + self._ttl
+        written = estimate_tokens(blocks[:cached_to]) - read if cached_to else 0
+        return {
+            "input_tokens": max(1, total - read - written),
+            "cache_creation_input_tokens": written,
+            "cache_read_input_tokens": read,
+        }
+
+
+class FakeMessagesAPI:
+    def __init__(self, reply: str = DEFAULT_REPLY, latency_ms: float = 0, chunk_delay_ms: float = 0,
+                 error_rate: float = 0, error_status: int = 429, retry_after: float = 1,
+                 min_cache_tokens: int = MIN_CACHEABLE_TOKENS, unique_replies: bool = False):
+        self.reply = reply
+        self.unique_replies = unique_replies
+        self.latency_ms = latency_ms
+        self.chunk_delay_ms = chunk_delay_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.prompt_cache = PromptCache(min_tokens=min_cache_tokens)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def reply_text(self, number: int) -> str:
+        if not self.unique_replies:
+            return self.reply
+        # Appended to the first Dart block; the backend rejects a main.dart that does not start with its imports
+        start = self.reply.find("```dart\n")
+        end = self.reply.find("\n```", start + 1) if start >= 0 else -1
+        if end < 0:
+            return self.reply
+        return f"{self.reply[:end]}\n// Reply {number}{self.reply[end:]}"
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("content-length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("content-length", 0)))
+                payload = json.loads(body or b"{}")
+                with api.lock:
+                    api.requests += 1
+                    number = api.requests
+                    fail = random.random() < api.error_rate
+                    if fail:
+                        api.errors += 1
+                if api.latency_ms:
+                    time.sleep(api.latency_ms / 1000)
+                if fail:
+                    return self._json(api.error_status, {
+                        "type": "error",
+                        "error": {"type": "rate_limit_error" if api.error_status == 429 else "overloaded_error",
+                                  "message": "Injected by fake_messages_api"},
+                    }, {"retry-after": str(api.retry_after)})
+                reply = api.reply_text(number)
+                usage = api.prompt_cache.usage(payload)
+                usage["output_tokens"] = estimate_tokens(reply)
+                if payload.get("stream"):
+                    return self._stream(payload, usage, reply)
+                self._json(200, {
+                    "id": f"msg_fake_{number}",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": payload.get("model"),
+                    "content": [{"type": "text", "text": reply}],
+                    "stop_reason": "end_turn",
+                    "usage": usage,
+                })
+
+            def _json(self, status, data, headers=None):
+                encoded = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(encoded)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def _event(self, event, data):
+                chunk = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+
+            def _stream(self, payload, usage, reply):
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("transfer-encoding", "chunked")
+                self.end_headers()
+                start_usage = dict(usage, output_tokens=1)
+                self._event("message_start", {"type": "message_start", "message": {
+                    "id": "msg_fake", "type": "message", "role": "assistant",
+                    "model": payload.get("model"), "content": [], "usage": start_usage}})
+                self._event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                    "content_block": {"type": "text", "text": ""}})
+                for i in range(0, len(reply), STREAM_CHUNK_CHARS):
+                    if api.chunk_delay_ms:
+                        time.sleep(api.chunk_delay_ms / 1000)
+                    self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                        "delta": {"type": "text_delta",
+                                                                  "text": reply[i:i + STREAM_CHUNK_CHARS]}})
+                self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+                self._event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                              "usage": {"output_tokens": usage["output_tokens"]}})
+                self._event("message_stop", {"type": "message_stop"})
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def start_fake_messages_api(port: int = 0, **options):
+    """Starts the stand-in on a daemon thread; returns (server, api, messages_url)."""
+    api = FakeMessagesAPI(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), api.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, api, f"http://127.0.0.1:{server.server_address[1]}/v1/messages"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before the response starts")
+    parser.add_argument("--chunk-delay-ms", type=float, default=0, help="Delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--reply-file", help="Reply text to return instead of the built-in app")
+    parser.add_argument("--unique-replies", action="store_true", help="Make every reply's main.dart distinct")
+    args = parser.parse_args()
+
+    reply = DEFAULT_REPLY
+    if args.reply_file:
+        with open(args.reply_file, "r", encoding="utf-8") as f:
+            reply = f.read()
+    server, _, url = start_fake_messages_api(
+        args.port, reply=reply, latency_ms=args.latency_ms, chunk_delay_ms=args.chunk_delay_ms,
+        error_rate=args.error_rate, error_status=args.error_status, retry_after=args.retry_after,
+        unique_replies=args.unique_replies,
+    )
+    print(f"Fake Messages API listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Concurrency check for git_mirror against a local bare repository.
+
+Runs many commit_files() calls at once, each to its own per-job branch, the way
+concurrent generation requests push, then the same with commit_files_async() on an
+event loop while threads force fetches and delete branches on the same mirror, as the
+async server's background cleanup does. Verifies that every call succeeded and that
+every branch holds exactly the content it was given. Exits with status 1 on any failure.
+
+    python benchmarks/git_mirror_concurrency_check.py --jobs 16 --rounds 3
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from git_mirror import GitMirror, build_branch_name  # noqa: E402
+
+
+def create_bare_remote(work_dir: str) -> str:
+    remote = os.path.join(work_dir, "remote.git")
+    seed = os.path.join(work_dir, "seed")
+    subprocess.run(["git", "init", "-q", "--bare", remote], check=True)
+    subprocess.run(["git", "init", "-q", seed], check=True)
+    with open(os.path.join(seed, "pubspec.yaml"), "w") as f:
+        f.write("name: generated_app\n")
+    identity = ["-c", "user.name=Idea Forge", "-c", "user.email=ideaforge@localhost"]
+    subprocess.run(["git", "-C", seed, "add", "."], check=True)
+    subprocess.run(["git", "-C", seed] + identity + ["commit", "-q", "-m", "Template"], check=True)
+    subprocess.run(["git", "-C", seed, "push", "-q", remote, "HEAD:refs/heads/main"], check=True)
+    subprocess.run(["git", "--git-dir", remote, "symbolic-ref", "HEAD", "refs/heads/main"], check=True)
+    shutil.rmtree(seed)
+    return remote
+
+
+def job_files(round_number: int, job: int) -> dict:
+    return {"lib/main.dart": f"// round {round_number}, job {job}\nvoid main() {{}}\n"}
+
+
+def verify(remote: str, branch: str, files: dict) -> str:
+    """Returns an error message, or None when branch holds files."""
+    for path, content in files.items():
+        result = subprocess.run(["git", "--git-dir", remote, "show", f"refs/heads/{branch}:{path}"],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return f"{branch}: {path} missing ({result.stderr.strip()})"
+        if result.stdout != content:
+            return f"{branch}: {path} has another job's content"
+    return None
+
+
+def run_threaded(mirror: GitMirror, remote: str, round_number: int, jobs: int) -> list:
+    errors = []
+    lock = threading.Lock()
+
+    def push(job):
+        branch = build_branch_name(f"check-{round_number}-{job}")
+        files = job_files(round_number, job)
+        try:
+            mirror.commit_files(files, f"Job {job}", branch)
+            error = verify(remote, branch, files)
+        except subprocess.CalledProcessError as e:
+            error = f"{branch}: {e.stderr.strip() if isinstance(e.stderr, str) else e}"
+        except Exception as e:
+            error = f"{branch}: {e}"
+        if error:
+            with lock:
+                errors.append(error)
+
+    threads = [threading.Thread(target=push, args=(job,)) for job in range(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def run_async(mirror: GitMirror, remote: str, round_number: int, jobs: int) -> list:
+    stop = threading.Event()
+    background_errors = []
+
+    def background():
+        # Threaded fetches and deletions of the previous round's branches, racing the event loop's pushes
+        deleted = 0
+        while not stop.is_set():
+            try:
+                mirror.fetch(force=True)
+                if deleted < jobs:
+                    mirror.delete_branches([build_branch_name(f"check-{round_number - 1}-{deleted}")])
+                    deleted += 1
+            except Exception as e:
+                background_errors.append(f"background fetch: {e}")
+
+    async def push(job):
+        branch = build_branch_name(f"check-{round_number}-{job}")
+        files = job_files(round_number, job)
+        try:
+            await mirror.commit_files_async(files, f"Job {job}", branch)
+            return verify(remote, branch, files)
+        except subprocess.CalledProcessError as e:
+            return f"{branch}: {e.stderr.strip() if isinstance(e.stderr, str) else e}"
+        except Exception as e:
+            return f"{branch}: {e}"
+
+    async def push_all():
+        return await asyncio.gather(*(push(job) for job in range(jobs)))
+
+    thread = threading.Thread(target=background)
+    thread.start()
+    try:
+        errors = [error for error in asyncio.run(push_all()) if error]
+    finally:
+        stop.set()
+        thread.join()
+    return errors + background_errors
+
+
+def leftover_staging_refs(mirror: GitMirror) -> list:
+    output = subprocess.run(["git", "for-each-ref", "--format=%(refname)", "refs/ideaforge/"],
+                            cwd=mirror.mirror_dir, capture_output=True, text=True, check=True).stdout
+    return output.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=16, help="Concurrent commit_files calls per round")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="ideaforge_git_check_")
+    failures = []
+    try:
+        remote = create_bare_remote(work_dir)
+        mirror = GitMirror(remote, os.path.join(work_dir, "cache"))
+        for round_number in range(args.rounds):
+            errors = run_threaded(mirror, remote, round_number, args.jobs)
+            print(f"round {round_number + 1}: {args.jobs - len(errors)} of {args.jobs} threaded pushes ok")
+            failures += errors
+        for round_number in range(args.rounds, 2 * args.rounds):
+            errors = run_async(mirror, remote, round_number, args.jobs)
+            print(f"round {round_number + 1}: {args.jobs - len(errors)} of {args.jobs} async pushes ok")
+            failures += errors
+        leftover = leftover_staging_refs(mirror)
+        if leftover:
+            failures.append(f"staging refs left behind: {leftover}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failures:
+        print(f"FAIL: {len(failures)} problem(s)")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
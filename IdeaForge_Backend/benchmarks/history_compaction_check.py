@@ -0,0 +1,57 @@
+"""
+Checks that compact history keeps code blocks without a file name whole, both in
+replies that only hold such blocks and in replies that mix them with generated files,
+whether the reply becomes a reference or carries the latest file set.
+Exits with status 1 on any failure.
+
+    python benchmarks/history_compaction_check.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_compaction import compact_messages, stable_prefix_length  # noqa: E402
+
+BASH_BLOCK = "```bash\nflutter pub get\n```"
+SQL_BLOCK = "```sql\nSELECT 1;\n```"
+
+
+def code_reply(body: str, snippet: str) -> str:
+    return f"Here is the app.\n\nFILENAME: main.dart\n```dart\n{body}\n```\n\nThen run:\n{snippet}\n"
+
+
+def main():
+    messages = [
+        {"role": "user", "content": "Build a todo app"},
+        {"role": "assistant", "content": code_reply("void main() {}", BASH_BLOCK)},
+        {"role": "user", "content": "How do I query it?"},
+        {"role": "assistant", "content": f"Use this:\n{SQL_BLOCK}"},
+        {"role": "user", "content": "Add dark mode"},
+        {"role": "assistant", "content": code_reply("void main() { dark(); }", BASH_BLOCK.replace("get", "upgrade"))},
+        {"role": "user", "content": "Make it blue"},
+    ]
+    compacted = compact_messages(messages, mode="compact")
+
+    failures = []
+    older, snippet_only, latest = compacted[1]["content"], compacted[3]["content"], compacted[5]["content"]
+    if not older.startswith("[Code for main.dart omitted") or BASH_BLOCK not in older:
+        failures.append(f"older mixed reply lost its unnamed block:\n{older}")
+    if "void main() {}" in older:
+        failures.append(f"older mixed reply still carries superseded code:\n{older}")
+    if SQL_BLOCK not in snippet_only:
+        failures.append(f"reply with only an unnamed block was changed:\n{snippet_only}")
+    if "void main() { dark(); }" not in latest or "flutter pub upgrade" not in latest:
+        failures.append(f"latest mixed reply lost its files or its unnamed block:\n{latest}")
+    if stable_prefix_length(compacted, mode="compact") != 5:
+        failures.append("latest code reply is no longer recognised as the end of the stable prefix")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("ok: unnamed code blocks kept in every compacted reply")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+Offline end-to-end load test for live_backend_real_build.
+
+Runs the real Flask app in-process, over real HTTP, against local stand-ins:
+
+    Messages API    fake_messages_api.py (latency, injected 429/529s, unique replies)
+    GitHub          a bare git repository in a temp dir, pushed to through the git mirror
+    Cloud Build     fake_gcp.FakeCloudBuildClient, posting Pub/Sub notifications to the webhook
+    Cloud Storage   fake_gcp.FakeStorageClient
+
+Each simulated user generates an app, follows its build with long-polls (or plain polls
+with --poll-interval) until the APK link or a failure, and repeats until --duration is
+over. The report gives per-endpoint throughput and p50/p95/p99 latency, webhook delivery
+latency as seen by Cloud Build, and prompt-to-APK time per flow. A flow whose APK link
+points at an object last written by another build counts as "wrong_apk".
+
+    python benchmarks/load_harness.py --users 20 --duration 60
+    python benchmarks/load_harness.py --users 50 --claude-latency-ms 20000 --claude-error-rate 0.1 \\
+        --build-seconds 120 --duration 600 --json results.json
+
+Server settings (BUILD_MAX_CONCURRENCY, CLAUDE_MAX_CONCURRENCY, IDEAFORGE_WORKTREE_POOL_SIZE, ...)
+are read from the environment as in production. No tokens or build minutes are spent.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from fake_gcp import FakeCloudBuildClient, FakeCredentials, FakeStorageClient  # noqa: E402
+from fake_messages_api import start_fake_messages_api  # noqa: E402
+
+GCP_PROJECT_ID = "ideaforge-offline"
+GCS_BUCKET_NAME = "ideaforge-offline-apks"
+# Never read: gcp_clients.set_clients() installs the fakes under this key path
+SERVICE_ACCOUNT_KEY_PATH = "offline-service-account.json"
+FINAL_STATUSES = ("success", "FAILURE", "INTERNAL_ERROR", "TIMEOUT", "CANCELLED", "EXPIRED")
+PERCENTILES = (0.50, 0.95, 0.99)
+
+GENERATE = "POST /api/v1/generate-app-real-build"
+BUILD_STATUS = "GET /api/build-status/<build_id>"
+LIST_APKS = "GET /api/list-apks"
+WEBHOOK = "POST /api/cloud-build-webhook"
+
+TEMPLATE_FILES = {
+    "pubspec.yaml": "name: generated_app\nversion: 1.0.0+1\nenvironment:\n  sdk: '>=3.0.0 <4.0.0'\n",
+    "lib/main.dart": "import 'package:flutter/material.dart';\n\nvoid main() => runApp(const MaterialApp());\n",
+    "android/app/build.gradle": "// Flutter Android template\n",
+}
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values), max(1, math.ceil(fraction * len(sorted_values)))) - 1]
+
+
+class Recorder:
+    """Thread-safe latency samples per endpoint, plus one record per generate-to-APK flow."""
+
+    def __init__(self):
+        self._samples = {}
+        self._flows = []
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self._lock:
+            self._samples.setdefault(endpoint, []).append((seconds, ok))
+
+    def record_flow(self, seconds: float, outcome: str):
+        with self._lock:
+            self._flows.append((seconds, outcome))
+
+    def summary(self, elapsed: float) -> dict:
+        with self._lock:
+            samples = {endpoint: list(values) for endpoint, values in self._samples.items()}
+            flows = list(self._flows)
+        endpoints = {}
+        for endpoint, values in sorted(samples.items()):
+            latencies = sorted(seconds for seconds, _ in values)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": sum(1 for _, ok in values if not ok),
+                "per_second": len(values) / elapsed if elapsed else 0.0,
+                "max": latencies[-1],
+            }
+            for fraction in PERCENTILES:
+                endpoints[endpoint][f"p{int(fraction * 100)}"] = percentile(latencies, fraction)
+        outcomes = {}
+        for _, outcome in flows:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        flow_seconds = sorted(seconds for seconds, outcome in flows if outcome == "success")
+        flow_summary = {"completed": len(flows), "outcomes": outcomes,
+                        "per_minute": len(flows) * 60 / elapsed if elapsed else 0.0}
+        for fraction in PERCENTILES:
+            flow_summary[f"p{int(fraction * 100)}"] = percentile(flow_seconds, fraction)
+        return {"elapsed_seconds": elapsed, "endpoints": endpoints, "flows": flow_summary}
+
+
+def create_bare_remote(work_dir: str) -> str:
+    """A bare repository with one commit of a Flutter project skeleton on main, standing in for GitHub."""
+    remote = os.path.join(work_dir, "remote.git")
+    seed = os.path.join(work_dir, "seed")
+    subprocess.run(["git", "init", "-q", "--bare", remote], check=True)
+    subprocess.run(["git", "init", "-q", seed], check=True)
+    for path, content in TEMPLATE_FILES.items():
+        os.makedirs(os.path.dirname(os.path.join(seed, path)) or seed, exist_ok=True)
+        with open(os.path.join(seed, path), "w") as f:
+            f.write(content)
+    identity = ["-c", "user.name=Idea Forge", "-c", "user.email=ideaforge@localhost"]
+    subprocess.run(["git", "-C", seed, "add", "."], check=True)
+    subprocess.run(["git", "-C", seed] + identity + ["commit", "-q", "-m", "Flutter template"], check=True)
+    subprocess.run(["git", "-C", seed, "push", "-q", remote, "HEAD:refs/heads/main"], check=True)
+    subprocess.run(["git", "--git-dir", remote, "symbolic-ref", "HEAD", "refs/heads/main"], check=True)
+    shutil.rmtree(seed)
+    return remote
+
+
+def configure_environment(work_dir: str, remote: str, messages_url: str):
+    """Points the backend at the stand-ins; must run before live_backend_real_build is imported."""
+    os.environ.update({
+        "ANTHROPIC_API_URL": messages_url,
+        "ANTHROPIC_API_KEY": "offline",
+        "GITHUB_REPO_URL": remote,
+        "GITHUB_PAT": "offline",
+        "GCP_PROJECT_ID": GCP_PROJECT_ID,
+        "GCS_BUCKET_NAME": GCS_BUCKET_NAME,
+        "GCP_SERVICE_ACCOUNT_KEY_PATH": SERVICE_ACCOUNT_KEY_PATH,
+        "IDEAFORGE_GIT_CACHE_DIR": os.path.join(work_dir, "git"),
+        "BUILD_STATUS_DB_PATH": os.path.join(work_dir, "build_status.db"),
+        "SESSION_DB_PATH": os.path.join(work_dir, "sessions.db"),
+    })
+    # Persistent caches would carry results over from earlier runs
+    for name in ("CLAUDE_CACHE_DIR", "ARTIFACT_CACHE_PATH"):
+        os.environ.pop(name, None)
+
+
+def start_server(app):
+    """Serves app on a threaded WSGI server on a daemon thread; returns (server, base_url)."""
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+class User:
+    """One client: generate, follow the build to a final status, repeat until the deadline."""
+
+    def __init__(self, number: int, base_url: str, recorder: Recorder, storage: FakeStorageClient, args):
+        self.number = number
+        self.base_url = base_url
+        self.recorder = recorder
+        self.storage = storage
+        self.args = args
+        self.session = requests.Session()
+
+    def request(self, endpoint: str, method: str, path: str, ok_statuses=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.args.request_timeout, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(endpoint, time.perf_counter() - started, False)
+            return None
+        self.recorder.record(endpoint, time.perf_counter() - started, response.status_code in ok_statuses)
+        return response
+
+    def run(self, deadline: float):
+        iteration = 0
+        while time.monotonic() < deadline:
+            self.run_flow(iteration)
+            iteration += 1
+            if self.args.list_apks_every and iteration % self.args.list_apks_every == 0:
+                self.request(LIST_APKS, "GET", "/api/list-apks")
+            if self.args.think_ms:
+                time.sleep(self.args.think_ms / 1000)
+
+    def run_flow(self, iteration: int):
+        started = time.monotonic()
+        priority = "batch" if (self.number + iteration) % 100 < self.args.batch_percent else "interactive"
+        response = self.request(GENERATE, "POST", "/api/v1/generate-app-real-build", ok_statuses=(200, 202), json={
+            "prompt": f"Build a counter app with a reset button (load user {self.number}, run {iteration})",
+            "user_id": f"load-user-{self.number}",
+            "priority": priority,
+        })
+        if response is None or response.status_code not in (200, 202):
+            self.recorder.record_flow(time.monotonic() - started, "generate_error")
+            return
+        body = response.json()
+        if body.get("download_url"):
+            self.recorder.record_flow(time.monotonic() - started, self.apk_outcome(body))
+            return
+        outcome = self.follow_build(body.get("build_id") or body.get("job_id"), started + self.args.flow_timeout)
+        self.recorder.record_flow(time.monotonic() - started, outcome)
+
+    def follow_build(self, status_id: str, deadline: float) -> str:
+        """Polls the build status until it is final; returns the flow outcome."""
+        etag = None
+        while time.monotonic() < deadline:
+            if self.args.poll_interval:
+                response = self.request(BUILD_STATUS, "GET", f"/api/build-status/{status_id}")
+            else:
+                headers = {"If-None-Match": etag} if etag else {}
+                response = self.request(BUILD_STATUS, "GET", f"/api/build-status/{status_id}",
+                                        ok_statuses=(200, 304), headers=headers,
+                                        params={"wait": self.args.long_poll_wait})
+            if response is None or response.status_code not in (200, 304):
+                time.sleep(1)
+                continue
+            if response.status_code == 200:
+                etag = response.headers.get("ETag")
+                body = response.json()
+                if body["status"] in FINAL_STATUSES:
+                    return self.apk_outcome(body) if body.get("download_url") else body["status"]
+                if body["status"] == "SUCCESS" and body.get("error"):
+                    return "apk_missing"
+            if self.args.poll_interval:
+                time.sleep(self.args.poll_interval)
+        return "timeout"
+
+    def apk_outcome(self, body: dict) -> str:
+        """"success" if the APK link is the object the reported build wrote, else "wrong_apk"."""
+        _, bucket_name, blob_name = unquote(urlparse(body["download_url"]).path).split("/", 2)
+        if self.storage.object_writer(bucket_name, blob_name) != body.get("build_id"):
+            return "wrong_apk"
+        return "success"
+
+
+def print_report(summary: dict, extra: dict, out=None):
+    out = out or sys.stdout
+    print(f"\n{'endpoint':<42} {'requests':>8} {'errors':>6} {'req/s':>8} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}", file=out)
+    for endpoint, row in summary["endpoints"].items():
+        print(f"{endpoint:<42} {row['requests']:>8} {row['errors']:>6} {row['per_second']:>8.2f} "
+              f"{row['p50'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f} "
+              f"{row['max'] * 1000:>9.1f}", file=out)
+    flows = summary["flows"]
+    print(f"\nFlows: {flows['completed']} in {summary['elapsed_seconds']:.1f}s ({flows['per_minute']:.1f}/min), "
+          f"outcomes {flows['outcomes']}", file=out)
+    print(f"Prompt to APK link: p50 {flows['p50']:.2f}s, p95 {flows['p95']:.2f}s, p99 {flows['p99']:.2f}s", file=out)
+    for name, stats in extra.items():
+        print(f"{name}: {stats}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds during which users start new flows")
+    parser.add_argument("--think-ms", type=float, default=0, help="Pause between a user's flows")
+    parser.add_argument("--batch-percent", type=int, default=0, help="Share of generations sent with priority=batch")
+    parser.add_argument("--list-apks-every", type=int, default=5, help="GET /api/list-apks after every N flows (0: never)")
+    parser.add_argument("--long-poll-wait", type=float, default=25, help="?wait= for build-status long-polls")
+    parser.add_argument("--poll-interval", type=float, default=0, help="Plain polling every N seconds instead")
+    parser.add_argument("--flow-timeout", type=float, default=600)
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--claude-latency-ms", type=float, default=2000)
+    parser.add_argument("--claude-error-rate", type=float, default=0)
+    parser.add_argument("--claude-error-status", type=int, default=429)
+    parser.add_argument("--claude-retry-after", type=float, default=1)
+    parser.add_argument("--repeat-source", action="store_true",
+                        help="Same reply every time, so artifact cache and build coalescing kick in")
+    parser.add_argument("--queue-seconds", type=float, default=2, help="Cloud Build queueing time")
+    parser.add_argument("--build-seconds", type=float, default=20, help="Cloud Build run time")
+    parser.add_argument("--build-failure-rate", type=float, default=0)
+    parser.add_argument("--gcp-latency-ms", type=float, default=50, help="Latency of Cloud Build and GCS API calls")
+    parser.add_argument("--redelivery-rate", type=float, default=0.05, help="Share of notifications delivered twice")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+    parser.add_argument("--metrics", metavar="PATH", help="Save the server's /metrics at the end of the run")
+    parser.add_argument("--server-logs", action="store_true", help="Show the backend's output")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="ideaforge_load_")
+    report_out = sys.stdout
+    recorder = Recorder()
+    messages_server, messages_api, messages_url = start_fake_messages_api(
+        latency_ms=args.claude_latency_ms, error_rate=args.claude_error_rate,
+        error_status=args.claude_error_status, retry_after=args.claude_retry_after,
+        unique_replies=not args.repeat_source)
+    remote = create_bare_remote(work_dir)
+    configure_environment(work_dir, remote, messages_url)
+
+    logs = contextlib.nullcontext() if args.server_logs else contextlib.redirect_stdout(open(os.devnull, "w"))
+    if not args.server_logs:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    with logs:
+        import gcp_clients
+        import live_backend_real_build
+
+        storage = FakeStorageClient(latency_ms=args.gcp_latency_ms)
+        cloud_build = FakeCloudBuildClient(
+            storage, GCS_BUCKET_NAME, git_dir=remote, queue_seconds=args.queue_seconds,
+            build_seconds=args.build_seconds, failure_rate=args.build_failure_rate,
+            api_latency_ms=args.gcp_latency_ms, redelivery_rate=args.redelivery_rate,
+            on_notification=lambda seconds, status: recorder.record(WEBHOOK, seconds, status == 200))
+        gcp_clients.set_clients(SERVICE_ACCOUNT_KEY_PATH, FakeCredentials(), cloud_build, storage)
+        server, base_url = start_server(live_backend_real_build.create_app(warm_up_on_start=False))
+        cloud_build.webhook_url = base_url + "/api/cloud-build-webhook"
+        print(f"Backend on {base_url}, {args.users} users for {args.duration:.0f}s, work dir {work_dir}",
+              file=report_out)
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        users = [User(number, base_url, recorder, storage, args) for number in range(args.users)]
+        threads = [threading.Thread(target=user.run, args=(deadline,), daemon=True) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        if args.metrics:
+            with open(args.metrics, "w") as f:
+                f.write(requests.get(base_url + "/metrics", timeout=30).text)
+        summary = recorder.summary(elapsed)
+        extra = {
+            "Fake Messages API": {"requests": messages_api.requests, "injected_errors": messages_api.errors},
+            "Fake Cloud Build": cloud_build.stats(),
+        }
+        server.shutdown()
+        cloud_build.shutdown()
+        messages_server.shutdown()
+
+    print_report(summary, extra, report_out)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(summary, stand_ins=extra, settings=vars(args)), f, indent=2)
+    if not args.keep_workdir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
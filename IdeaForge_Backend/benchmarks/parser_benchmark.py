@@ -0,0 +1,307 @@
+"""
+Microbenchmarks for the per-response parsing and validation hot path:
+
+    real_build.parse           live_backend_real_build.parse_generated_code
+    real_build.validate        live_backend_real_build.validate_and_fix_dart_null_safety
+    live_backend.parse         live_backend.parse_generated_code
+    live_backend.extract       live_backend.extract_and_write_flutter_code (writes into a temp project)
+    code_stream.incremental    code_stream.IncrementalCodeParser fed in 40-character chunks
+
+Every function runs on every case of the response corpus (see response_corpus.py).
+Output is checked against benchmarks/corpus/expected.json, and the script reports
+throughput (calls/s, MB/s) and tracemalloc peak allocation per call.
+
+    python benchmarks/parser_benchmark.py                         # check outputs, report speed
+    python benchmarks/parser_benchmark.py --save-baseline base.json
+    python benchmarks/parser_benchmark.py --baseline base.json --max-slowdown 0.25 --max-alloc-growth 0.10
+    python benchmarks/parser_benchmark.py --update-expected       # accept intended output changes
+
+Exits with status 1 when a selected subject cannot be imported (e.g. the backend's
+dependencies are missing), when an output differs from expected.json, when a subject's time
+over the corpus grows by more than --max-slowdown (every case's with --per-case), or
+when a case's peak allocation grows by more than --max-alloc-growth. Save the baseline
+on the same machine (e.g. from the main branch) before measuring a change.
+"""
+import argparse
+import contextlib
+import gc
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from response_corpus import CORPUS_DIR, load_corpus  # noqa: E402
+
+EXPECTED_PATH = os.path.join(CORPUS_DIR, "expected.json")
+STREAM_CHUNK_CHARS = 40
+# Allocation growth below this many bytes is noise, whatever the ratio
+MIN_ALLOC_DELTA_BYTES = 4096
+
+
+def digest(content: str) -> str:
+    return f"{len(content)}:{hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]}"
+
+
+def digest_files(files: dict) -> dict:
+    return {name: digest(content) for name, content in sorted(files.items())}
+
+
+def dart_source(text: str) -> str:
+    """The main.dart block of a response as the streaming parser sees it, else the whole text."""
+    from code_stream import IncrementalCodeParser
+    parser = IncrementalCodeParser()
+    parser.feed(text)
+    parser.close()
+    return parser.files.get("main.dart", text)
+
+
+class Subject:
+    """A function under test: prepare(case) builds its input once, run(input) is timed, summarize(result) is checked."""
+
+    def __init__(self, name: str, prepare, run, summarize, cleanup=None):
+        self.name = name
+        self.prepare = prepare
+        self.run = run
+        self.summarize = summarize
+        self.cleanup = cleanup
+
+
+def build_subjects() -> tuple:
+    """Returns (subjects, unavailable): unavailable maps each subject that failed to import to the error."""
+    subjects, unavailable = [], {}
+    try:
+        import live_backend_real_build as real_build
+    except Exception as e:
+        for name in ("real_build.parse", "real_build.validate"):
+            unavailable[name] = f"cannot import live_backend_real_build ({e})"
+    else:
+        subjects.append(Subject(
+            "real_build.parse", lambda case: case.text, real_build.parse_generated_code,
+            lambda files: {"error": files["error"]} if "error" in files else {"files": digest_files(files)}))
+
+        def summarize_validate(result):
+            success, fixed_content, error_message = result
+            return {"ok": success, "content": digest(fixed_content),
+                    "error": error_message.split("\n", 1)[0] if error_message else None,
+                    "error_lines": error_message.count("\n") if error_message else 0}
+        subjects.append(Subject(
+            "real_build.validate", lambda case: dart_source(case.text), real_build.validate_and_fix_dart_null_safety,
+            summarize_validate))
+
+    try:
+        import live_backend
+    except Exception as e:
+        for name in ("live_backend.parse", "live_backend.extract"):
+            unavailable[name] = f"cannot import live_backend ({e})"
+    else:
+        subjects.append(Subject(
+            "live_backend.parse", lambda case: case.text, live_backend.parse_generated_code,
+            lambda files: {"files": digest_files(files)}))
+
+        def prepare_extract(case):
+            # android/ and ios/ already exist, so the function never shells out to flutter create
+            project = tempfile.mkdtemp(prefix="ideaforge_bench_")
+            os.makedirs(os.path.join(project, "android"))
+            os.makedirs(os.path.join(project, "ios"))
+            return case.text, project
+
+        def summarize_extract(result):
+            success, message = result
+            return {"ok": success, "message": message}
+        subjects.append(Subject(
+            "live_backend.extract", prepare_extract, lambda args: live_backend.extract_and_write_flutter_code(*args),
+            summarize_extract, cleanup=lambda args: shutil.rmtree(args[1], ignore_errors=True)))
+
+    from code_stream import IncrementalCodeParser
+
+    def stream_parse(text):
+        parser = IncrementalCodeParser()
+        for start in range(0, len(text), STREAM_CHUNK_CHARS):
+            parser.feed(text[start:start + STREAM_CHUNK_CHARS])
+        parser.close()
+        return parser.files
+    subjects.append(Subject("code_stream.incremental", lambda case: case.text, stream_parse,
+                            lambda files: {"files": digest_files(files)}))
+    return subjects, unavailable
+
+
+def time_call(fn, arg, min_time: float, repeat: int) -> float:
+    """Best-of-repeat seconds per call, each repeat running enough calls to last min_time."""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn(arg)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn(arg)
+        best = min(best, (time.perf_counter() - started) / loops)
+    return best
+
+
+def peak_allocation(fn, arg) -> int:
+    """Peak bytes allocated during one call, as seen by tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(arg)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(subjects: list, cases: list, min_time: float, repeat: int) -> tuple:
+    """Returns (results, outputs): {subject: {case: {...}}} measurements and summarized outputs."""
+    results, outputs = {}, {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for subject in subjects:
+            results[subject.name], outputs[subject.name] = {}, {}
+            for case in cases:
+                arg = subject.prepare(case)
+                try:
+                    outputs[subject.name][case.name] = subject.summarize(subject.run(arg))
+                    seconds = time_call(subject.run, arg, min_time, repeat)
+                    peak = peak_allocation(subject.run, arg)
+                finally:
+                    if subject.cleanup:
+                        subject.cleanup(arg)
+                results[subject.name][case.name] = {"seconds": seconds, "peak_bytes": peak, "input_bytes": case.size}
+    return results, outputs
+
+
+def report(results: dict, verbose: bool):
+    print(f"{'subject':<26} {'calls/s':>10} {'MB/s':>8} {'peak KiB':>9} {'worst case':>24}")
+    for subject, by_case in results.items():
+        total_seconds = sum(r["seconds"] for r in by_case.values())
+        total_bytes = sum(r["input_bytes"] for r in by_case.values())
+        worst = max(by_case, key=lambda name: by_case[name]["seconds"])
+        print(f"{subject:<26} {len(by_case) / total_seconds:>10.0f} {total_bytes / total_seconds / 1e6:>8.1f} "
+              f"{max(r['peak_bytes'] for r in by_case.values()) / 1024:>9.1f} {worst:>24}")
+        if verbose:
+            for name, r in by_case.items():
+                print(f"    {name:<34} {r['seconds'] * 1e6:>10.1f} us {r['input_bytes'] / r['seconds'] / 1e6:>8.1f} MB/s "
+                      f"{r['peak_bytes'] / 1024:>9.1f} KiB")
+
+
+def check_outputs(outputs: dict, expected: dict) -> list:
+    failures = []
+    for subject, by_case in outputs.items():
+        for case, summary in by_case.items():
+            want = expected.get(subject, {}).get(case)
+            if want is None:
+                failures.append(f"{subject} / {case}: no expected output recorded (run with --update-expected)")
+            elif want != summary:
+                failures.append(f"{subject} / {case}: output changed\n      expected {json.dumps(want)}\n"
+                                f"      actual   {json.dumps(summary)}")
+    return failures
+
+
+def check_regressions(results: dict, baseline: dict, max_slowdown: float, max_alloc_growth: float,
+                      per_case: bool = False) -> list:
+    """
+    Time is compared on each subject's total over the cases both runs share (per case with
+    per_case=True, which needs a quiet machine); peak allocation is compared per case.
+    """
+    failures = []
+    for subject, by_case in results.items():
+        shared = [case for case in by_case if case in baseline.get(subject, {})]
+        if shared and not per_case:
+            before = sum(baseline[subject][case]["seconds"] for case in shared)
+            after = sum(by_case[case]["seconds"] for case in shared)
+            if after / before - 1 > max_slowdown:
+                failures.append(f"{subject}: {after / before - 1:+.0%} time over {len(shared)} cases "
+                                f"({before * 1e3:.2f} -> {after * 1e3:.2f} ms)")
+        for case in shared:
+            r, base = by_case[case], baseline[subject][case]
+            slowdown = r["seconds"] / base["seconds"] - 1
+            if per_case and slowdown > max_slowdown:
+                failures.append(f"{subject} / {case}: {slowdown:+.0%} time per call "
+                                f"({base['seconds'] * 1e6:.1f} -> {r['seconds'] * 1e6:.1f} us)")
+            growth = r["peak_bytes"] - base["peak_bytes"]
+            if growth > MIN_ALLOC_DELTA_BYTES and growth > max_alloc_growth * base["peak_bytes"]:
+                failures.append(f"{subject} / {case}: peak allocation {base['peak_bytes']} -> {r['peak_bytes']} bytes")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subject", action="append", help="Only run subjects whose name contains this (repeatable)")
+    parser.add_argument("--case", action="append", help="Only run cases whose name contains this (repeatable)")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Seconds per timing repeat")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="Write this run's measurements as a baseline")
+    parser.add_argument("--max-slowdown", type=float, default=0.25, help="Allowed time-per-call increase (0.25 = 25%%)")
+    parser.add_argument("--max-alloc-growth", type=float, default=0.10, help="Allowed peak allocation increase")
+    parser.add_argument("--per-case", action="store_true", help="Apply --max-slowdown to every case, not per subject")
+    parser.add_argument("--update-expected", action="store_true", help="Record current outputs as expected")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Per-case numbers")
+    args = parser.parse_args()
+
+    def selected(name):
+        return not args.subject or any(part in name for part in args.subject)
+
+    cases = [case for case in load_corpus() if not args.case or any(part in case.name for part in args.case)]
+    subjects, unavailable = build_subjects()
+    subjects = [subject for subject in subjects if selected(subject.name)]
+    # A subject that cannot run must fail the check, not quietly drop out of it
+    failures = [f"{name}: {error}" for name, error in unavailable.items() if selected(name)]
+    for failure in failures:
+        print(f"Cannot run {failure}")
+    print(f"{len(subjects)} subjects x {len(cases)} cases ({sum(case.size for case in cases) / 1024:.0f} KiB), "
+          f"Python {platform.python_version()}\n")
+    results, outputs = run_benchmarks(subjects, cases, args.min_time, args.repeat)
+    report(results, args.verbose)
+
+    if args.update_expected:
+        expected = {}
+        if os.path.exists(EXPECTED_PATH):
+            with open(EXPECTED_PATH, "r", encoding="utf-8") as f:
+                expected = json.load(f)
+        for subject, by_case in outputs.items():
+            expected.setdefault(subject, {}).update(by_case)
+        with open(EXPECTED_PATH, "w", encoding="utf-8") as f:
+            json.dump(expected, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nRecorded expected outputs in {EXPECTED_PATH}")
+    elif os.path.exists(EXPECTED_PATH):
+        with open(EXPECTED_PATH, "r", encoding="utf-8") as f:
+            failures += check_outputs(outputs, json.load(f))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            failures += check_regressions(results, json.load(f)["results"], args.max_slowdown, args.max_alloc_growth,
+                                          args.per_case)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results},
+                      f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if failures:
+        print(f"\nFAIL: {len(failures)} problem(s)")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
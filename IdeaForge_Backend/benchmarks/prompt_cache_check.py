@@ -0,0 +1,60 @@
+"""
+Runs a multi-turn refinement session against the local Messages API stand-in and
+reports per-turn token usage, to confirm the system prompt and history prefix are
+read from the prompt cache instead of being billed as fresh input.
+
+    python benchmarks/prompt_cache_check.py --turns 4
+    python benchmarks/prompt_cache_check.py --history-mode compact --min-cache-tokens 256
+
+Prefixes shorter than the model's minimum cacheable length (1024 tokens for Sonnet)
+are never cached, so with compact history and the small built-in reply, only a
+lowered --min-cache-tokens exercises the history breakpoint.
+Exits with status 1 if no turn after the first reads from the cache.
+"""
+import argparse
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fake_messages_api import start_fake_messages_api  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--history-mode", default="full", choices=["compact", "full"])
+    parser.add_argument("--min-cache-tokens", type=int, default=1024)
+    args = parser.parse_args()
+
+    server, _, url = start_fake_messages_api(min_cache_tokens=args.min_cache_tokens)
+    os.environ["ANTHROPIC_API_URL"] = url
+    os.environ["ANTHROPIC_API_KEY"] = "test-key"
+    os.environ["CLAUDE_HISTORY_MODE"] = args.history_mode
+
+    import claude_client
+    import live_backend_real_build as backend
+
+    cache_reads = []
+    for turn in range(1, args.turns + 1):
+        before = claude_client.get_stats()
+        _, status_code, _ = backend.call_claude_api(f"Refinement {turn}: change the accent colour",
+                                                    "prompt-cache-check", use_cache=False)
+        after = claude_client.get_stats()
+        if status_code != 200:
+            print(f"turn {turn}: request failed with {status_code}")
+            sys.exit(1)
+        usage = {field: after[field] - before[field] for field in claude_client.USAGE_FIELDS}
+        cache_reads.append(usage["cache_read_input_tokens"])
+        print(f"turn {turn}: input {usage['input_tokens']}, cache write {usage['cache_creation_input_tokens']}, "
+              f"cache read {usage['cache_read_input_tokens']}, output {usage['output_tokens']}")
+    server.shutdown()
+
+    if args.turns > 1 and not any(cache_reads[1:]):
+        print("FAIL: no prompt cache reads after the first turn")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
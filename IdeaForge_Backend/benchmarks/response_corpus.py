@@ -0,0 +1,200 @@
+"""
+Corpus of Claude responses for the parsing and validation benchmarks.
+
+Recorded responses live in benchmarks/corpus/*.txt, one response text per file. They
+are written in the format the production system prompt asks for, plus the ways
+real replies drift from it. Synthetic cases are generated deterministically on load:
+large files, many blocks, malformed fences, prose-wrapped code, CRLF line endings.
+
+Real traffic can be added from the on-disk response cache (CLAUDE_CACHE_DIR):
+
+    python benchmarks/response_corpus.py --import-cache /var/cache/ideaforge --limit 20
+    python benchmarks/response_corpus.py --list
+"""
+import argparse
+import glob
+import json
+import os
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+PUBSPEC = """name: generated_app
+description: Generated by Idea Forge.
+publish_to: 'none'
+version: 1.0.0+1
+
+environment:
+  sdk: '>=3.0.0 <4.0.0'
+
+dependencies:
+  flutter:
+    sdk: flutter
+
+flutter:
+  uses-material-design: true"""
+
+MAIN_HEADER = """import 'package:flutter/material.dart';
+
+void main() => runApp(const GeneratedApp());
+
+class GeneratedApp extends StatelessWidget {
+  const GeneratedApp({super.key});
+
+  @override
+  Widget build(BuildContext context) {
+    return const MaterialApp(home: Page0());
+  }
+}
+"""
+
+PROSE = ("This screen keeps its state in a StatefulWidget so the counter survives rebuilds, "
+         "and every handler calls setState so the framework knows to repaint. ")
+
+
+class CorpusCase:
+    __slots__ = ("name", "kind", "text")
+
+    def __init__(self, name: str, kind: str, text: str):
+        self.name = name
+        self.kind = kind  # "recorded" or "synthetic"
+        self.text = text
+
+    @property
+    def size(self) -> int:
+        return len(self.text.encode("utf-8"))
+
+
+def widget_source(index: int) -> str:
+    """One stateful page with initialized fields, a few handlers and a list view."""
+    return f"""
+class Page{index} extends StatefulWidget {{
+  const Page{index}({{super.key}});
+
+  @override
+  State<Page{index}> createState() => _Page{index}State();
+}}
+
+class _Page{index}State extends State<Page{index}> {{
+  int _count = {index};
+  String _label = 'Page {index}';
+  final List<String> _items = List.generate(20, (i) => 'Item $i');
+  bool? _expanded;
+
+  void _increment() => setState(() => _count++);
+
+  @override
+  Widget build(BuildContext context) {{
+    // Page {index}: counter, label and a list of items
+    return Scaffold(
+      appBar: AppBar(title: Text(_label)),
+      body: ListView.builder(
+        itemCount: _items.length,
+        itemBuilder: (context, i) => ListTile(
+          title: Text(_items[i]),
+          subtitle: Text('$_count'),
+          selected: _expanded ?? false,
+        ),
+      ),
+      floatingActionButton: FloatingActionButton(onPressed: _increment, child: const Icon(Icons.add)),
+    );
+  }}
+}}
+"""
+
+
+def main_dart(pages: int) -> str:
+    return MAIN_HEADER + "".join(widget_source(i) for i in range(pages))
+
+
+def block(filename: str, language: str, content: str, fence: str = "```") -> str:
+    return f"FILENAME: {filename}\n{fence}{language}\n{content}\n{fence}\n"
+
+
+def synthetic_cases() -> list:
+    small = main_dart(2)
+    cases = [
+        # ~200 KB main.dart, well past what one max_tokens=4096 response can hold
+        ("large_main_dart", block("main.dart", "dart", main_dart(220)) + "\n" + block("pubspec.yaml", "yaml", PUBSPEC)),
+        # Many labelled blocks: one main.dart, a pubspec and 150 asset files
+        ("many_blocks", block("main.dart", "dart", small) + "\n" + block("pubspec.yaml", "yaml", PUBSPEC) + "\n" +
+         "\n".join(block(f"assets/data/item_{i}.json", "json", json.dumps({"id": i, "name": f"item {i}"}, indent=2))
+                   for i in range(150))),
+        # Prose paragraphs around and between the blocks
+        ("prose_wrapped", PROSE * 30 + "\n\n" + block("main.dart", "dart", small) + "\n" + PROSE * 20 + "\n\n" +
+         block("pubspec.yaml", "yaml", PUBSPEC) + "\n" + PROSE * 30),
+        # Closing fence missing on the last block
+        ("unclosed_fence", block("pubspec.yaml", "yaml", PUBSPEC) + "\nFILENAME: main.dart\n```dart\n" + small),
+        # Four-backtick opening fence closed by three backticks, then a stray fence
+        ("mismatched_fences", "FILENAME: main.dart\n````dart\n" + small + "\n```\n\nFILENAME: pubspec.yaml\n```yaml\n" +
+         PUBSPEC + "\n```\n```\n"),
+        # Fences indented as if inside a markdown list
+        ("indented_fences", "1. The app:\n\n   FILENAME: main.dart\n   ```dart\n" +
+         "\n".join("   " + line for line in small.split("\n")) + "\n   ```\n\n2. The pubspec:\n\n   FILENAME: pubspec.yaml\n"
+         "   ```yaml\n" + "\n".join("   " + line for line in PUBSPEC.split("\n")) + "\n   ```\n"),
+        # FILENAME labels with no fences at all
+        ("unfenced_labels", "FILENAME: main.dart\n" + small + "\n\nFILENAME: pubspec.yaml\n" + PUBSPEC + "\n"),
+        # Bare code, no labels or fences
+        ("bare_code", small),
+        # A fence marker inside a Dart string literal
+        ("fence_in_string", block("main.dart", "dart", small.replace("'Page 0'", "'```markdown```'")) + "\n" +
+         block("pubspec.yaml", "yaml", PUBSPEC)),
+        # Windows line endings throughout
+        ("crlf_line_endings", (block("main.dart", "dart", small) + "\n" + block("pubspec.yaml", "yaml", PUBSPEC))
+         .replace("\n", "\r\n")),
+    ]
+    return [CorpusCase(name, "synthetic", text) for name, text in cases]
+
+
+def recorded_cases(corpus_dir: str = CORPUS_DIR) -> list:
+    cases = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.txt"))):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            cases.append(CorpusCase(os.path.splitext(os.path.basename(path))[0], "recorded", f.read()))
+    return cases
+
+
+def load_corpus(corpus_dir: str = CORPUS_DIR, include_synthetic: bool = True) -> list:
+    cases = recorded_cases(corpus_dir)
+    if include_synthetic:
+        cases += synthetic_cases()
+    return cases
+
+
+def response_text(response_json: dict) -> str:
+    return "".join(block.get("text", "") for block in response_json.get("content", []) if block.get("type") == "text")
+
+
+def import_response_cache(cache_dir: str, corpus_dir: str = CORPUS_DIR, limit: int = None) -> list:
+    """Copies the text of cached Messages API responses into the corpus; returns the new case names."""
+    imported = []
+    for path in sorted(glob.glob(os.path.join(cache_dir, "*", "*.json"))):
+        if limit is not None and len(imported) >= limit:
+            break
+        with open(path, "r", encoding="utf-8") as f:
+            text = response_text(json.load(f))
+        if not text:
+            continue
+        name = "cache_" + os.path.basename(path)[:12]
+        with open(os.path.join(corpus_dir, name + ".txt"), "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        imported.append(name)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-cache", metavar="DIR", help="Add responses from a CLAUDE_CACHE_DIR")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--list", action="store_true", help="List the corpus")
+    args = parser.parse_args()
+
+    if args.import_cache:
+        names = import_response_cache(args.import_cache, limit=args.limit)
+        print(f"Imported {len(names)} responses into {CORPUS_DIR}")
+    if args.list or not args.import_cache:
+        for case in load_corpus():
+            print(f"{case.kind:<10} {case.name:<36} {case.size:>9} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Cold-start benchmark for live_backend_real_build.
+
+Imports the module in fresh interpreters, the way Cloud Run starts a new instance,
+and reports how long it takes until the Flask app object exists. Exits with status 1
+when the median exceeds --max-seconds, so it can gate a deploy.
+
+    python benchmarks/startup_benchmark.py --runs 5 --max-seconds 1.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prints the in-process import time so interpreter startup can be reported separately
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); "
+    "import {module}; {module}.create_app(warm_up_on_start=False); "
+    "print(time.perf_counter() - started)"
+)
+
+
+def measure_once(module: str):
+    """Returns (total_seconds, import_seconds) for one fresh interpreter."""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    total = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    import_seconds = float(result.stdout.strip().splitlines()[-1])
+    return total, import_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="live_backend_real_build")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if the median total exceeds this")
+    args = parser.parse_args()
+
+    totals, imports = [], []
+    for run in range(args.runs):
+        total, import_seconds = measure_once(args.module)
+        totals.append(total)
+        imports.append(import_seconds)
+        print(f"run {run + 1}: total {total:.3f}s, import {import_seconds:.3f}s")
+
+    median_total = statistics.median(totals)
+    print(f"\n{args.module}: median total {median_total:.3f}s (max {max(totals):.3f}s), "
+          f"median import {statistics.median(imports):.3f}s")
+    if args.max_seconds is not None and median_total > args.max_seconds:
+        print(f"FAIL: median startup {median_total:.3f}s exceeds {args.max_seconds:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Helpers for Cloud Build Pub/Sub notifications. Pub/Sub delivers at least once and
+# redelivers anything not acked quickly, so the webhook acks first and uses these to
+# drop repeats and to read the APK location straight from the notification.
+
+SEEN_MESSAGE_IDS_MAX = int(os.getenv("WEBHOOK_SEEN_MESSAGE_IDS_MAX", "10000"))
+# cloudbuild.yaml copies every APK to a name carrying the commit. Its artifacts: upload
+# goes to ideaforge-builds/app-release.apk, which each build overwrites, so it is never
+# signed or cached: it may already hold another build's APK.
+BUILD_APK_OBJECT_TEMPLATE = os.getenv("BUILD_APK_OBJECT_TEMPLATE", "ideaforge-builds/{short_sha}_app-release.apk")
+SHORT_SHA_LENGTH = 7  # Cloud Build's $SHORT_SHA
+
+
+class SeenMessages:
+    """Bounded, thread-safe set of recently processed Pub/Sub message IDs (oldest evicted first)."""
+
+    def __init__(self, max_entries: int = SEEN_MESSAGE_IDS_MAX):
+        self._ids = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def __contains__(self, message_id) -> bool:
+        with self._lock:
+            return message_id in self._ids
+
+    def add(self, message_id: str) -> bool:
+        """Records message_id; returns False if it was already seen."""
+        if not message_id:
+            return True
+        with self._lock:
+            if message_id in self._ids:
+                self._ids.move_to_end(message_id)
+                return False
+            self._ids[message_id] = True
+            if len(self._ids) > self._max_entries:
+                self._ids.popitem(last=False)
+            return True
+
+
+def pubsub_message_id(payload: dict):
+    message = payload.get("message") or {}
+    return message.get("messageId") or message.get("message_id")
+
+
+def apk_blob_for_commit(commit_sha: str):
+    """The build-unique APK object for a commit, as uploaded by cloudbuild.yaml's copy step."""
+    if not commit_sha:
+        return None
+    return BUILD_APK_OBJECT_TEMPLATE.format(short_sha=commit_sha[:SHORT_SHA_LENGTH])
+
+
+def apk_blob_from_build(build_data: dict):
+    """
+    Returns the blob name of the APK this build uploaded, from the build resource in a
+    notification, or None when it does not say which commit was built.
+    """
+    short_sha = (build_data.get("substitutions") or {}).get("SHORT_SHA")
+    if short_sha:
+        return apk_blob_for_commit(short_sha)
+    resolved = (build_data.get("sourceProvenance") or {}).get("resolvedRepoSource") or {}
+    repo_source = (build_data.get("source") or {}).get("repoSource") or {}
+    return apk_blob_for_commit(resolved.get("commitSha") or repo_source.get("commitSha"))
+
+
+def apk_blob_from_build_resource(build):
+    """apk_blob_from_build() for a Build returned by the Cloud Build client."""
+    substitutions = getattr(build, "substitutions", None) or {}
+    if substitutions.get("SHORT_SHA"):
+        return apk_blob_for_commit(substitutions["SHORT_SHA"])
+    provenance = getattr(build, "source_provenance", None)
+    resolved = getattr(provenance, "resolved_repo_source", None)
+    repo_source = getattr(getattr(build, "source", None), "repo_source", None)
+    return apk_blob_for_commit(getattr(resolved, "commit_sha", None) or getattr(repo_source, "commit_sha", None))
@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+import tracing
+
+# Owns every Cloud Build create_build call made by this instance. At most
+# BUILD_MAX_CONCURRENCY builds run at once (a slot is held from create_build until
+# the build reaches a terminal status); further requests wait in per-user FIFOs that
+# are served round-robin, interactive requests ahead of batch ones. Batch builds may
+# only use part of the capacity so an interactive request never waits behind a
+# backlog of batch work. The cap is per instance: size it as quota / instances.
+
+BUILD_MAX_CONCURRENCY = int(os.getenv("BUILD_MAX_CONCURRENCY", "10"))
+BUILD_BATCH_MAX_CONCURRENCY = int(os.getenv("BUILD_BATCH_MAX_CONCURRENCY", str(max(1, BUILD_MAX_CONCURRENCY // 2))))
+# A slot whose build never reported a terminal status (e.g. a lost webhook) is reclaimed after this
+BUILD_SLOT_TIMEOUT_SECONDS = int(os.getenv("BUILD_SLOT_TIMEOUT_SECONDS", "3600"))
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)  # served in this order
+ANONYMOUS_USER = "anonymous"
+
+
+def normalize_priority(priority: str) -> str:
+    return priority if priority in PRIORITY_CLASSES else PRIORITY_INTERACTIVE
+
+
+class BuildRequest:
+    """
+    One queued create_build. start(request) triggers the build and returns
+    (build_id, error_message); once done is set, build_id and error hold its result.
+    """
+    __slots__ = ("job_id", "user_id", "queue_key", "priority", "start", "queued", "enqueued_at", "waited", "build_id",
+                 "error", "done", "trace_parent")
+
+    def __init__(self, job_id: str, user_id: str, priority: str, start):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.queue_key = user_id or ANONYMOUS_USER
+        self.priority = normalize_priority(priority)
+        self.start = start
+        self.queued = False  # True when the request could not start as soon as it was submitted
+        self.enqueued_at = time.monotonic()
+        self.waited = 0.0
+        self.build_id = None
+        self.error = None
+        self.done = threading.Event()
+        self.trace_parent = tracing.current_span()  # the start runs in this trace, whichever thread starts it
+
+
+class BuildScheduler:
+    def __init__(self, max_concurrency: int = BUILD_MAX_CONCURRENCY,
+                 batch_max_concurrency: int = BUILD_BATCH_MAX_CONCURRENCY,
+                 slot_timeout_seconds: int = BUILD_SLOT_TIMEOUT_SECONDS):
+        self._max_concurrency = max_concurrency
+        self._batch_max_concurrency = min(batch_max_concurrency, max_concurrency)
+        self._slot_timeout = slot_timeout_seconds
+        # priority -> OrderedDict of user_id -> deque of requests; the first user is served next
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_CLASSES}
+        self._running = {}  # build_id -> (priority, started_at)
+        self._starting = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._lock = threading.Lock()
+        self._timer = None  # fires when the oldest running slot expires while requests wait
+        self._stats = {"started": 0, "queued": 0, "failed": 0, "reclaimed": 0, "wait_seconds": 0.0}
+
+    def submit(self, job_id: str, user_id: str, start, priority: str = PRIORITY_INTERACTIVE) -> BuildRequest:
+        """
+        Queues a build. If capacity is free it is started in the calling thread and the returned
+        request is already done; otherwise request.queued is True and it starts in the background.
+        """
+        request = BuildRequest(job_id, user_id, priority, start)
+        with self._lock:
+            self._queues[request.priority].setdefault(request.queue_key, deque()).append(request)
+            granted = self._dispatch_locked()
+            if request not in granted:
+                request.queued = True
+                self._stats["queued"] += 1
+        for other in granted:
+            if other is not request:
+                threading.Thread(target=self._start, args=(other,), daemon=True).start()
+        if not request.queued:
+            self._start(request)
+        return request
+
+    def release(self, build_id: str):
+        """Frees the slot of a build that reached a terminal status; unknown build ids are ignored."""
+        with self._lock:
+            if self._running.pop(build_id, None) is None:
+                return
+            granted = self._dispatch_locked()
+        self._start_all(granted)
+
+    def position(self, job_id: str):
+        """1-based place of a waiting request in dispatch order, or None if it is not waiting."""
+        with self._lock:
+            for i, request in enumerate(self._dispatch_order_locked()):
+                if request.job_id == job_id:
+                    return i + 1
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["running"] = len(self._running) + sum(self._starting.values())
+            stats["waiting"] = {priority: sum(len(queue) for queue in users.values())
+                                for priority, users in self._queues.items()}
+            return stats
+
+    def _start(self, request: BuildRequest):
+        with tracing.activate(request.trace_parent), tracing.span(
+                "build.start", job_id=request.job_id, priority=request.priority, queued=request.queued,
+                queue_wait_seconds=round(request.waited, 3)) as span:
+            try:
+                build_id, error = request.start(request)
+            except Exception as e:
+                build_id, error = None, f"Error triggering Cloud Build: {e}"
+            if span is not None:
+                span.set_attribute("build_id", build_id)
+                if error:
+                    span.record_error(error)
+        with self._lock:
+            self._starting[request.priority] -= 1
+            if build_id:
+                self._running[build_id] = (request.priority, time.monotonic())
+            else:
+                self._stats["failed"] += 1
+            granted = self._dispatch_locked()
+        request.build_id, request.error = build_id, error
+        request.done.set()
+        self._start_all(granted)
+
+    def _start_all(self, requests):
+        for request in requests:
+            threading.Thread(target=self._start, args=(request,), daemon=True).start()
+
+    def _in_use_locked(self, priority: str = None) -> int:
+        if priority is None:
+            return len(self._running) + sum(self._starting.values())
+        return sum(1 for p, _ in self._running.values() if p == priority) + self._starting[priority]
+
+    def _reclaim_expired_locked(self):
+        now = time.monotonic()
+        for build_id, (_, started_at) in list(self._running.items()):
+            if now - started_at > self._slot_timeout:
+                print(f"Build scheduler: reclaiming slot of {build_id}, no terminal status after {self._slot_timeout}s")
+                del self._running[build_id]
+                self._stats["reclaimed"] += 1
+
+    def _dispatch_locked(self) -> list:
+        """Grants free slots to waiting requests; the caller starts the returned requests outside the lock."""
+        self._reclaim_expired_locked()
+        granted = []
+        for priority in PRIORITY_CLASSES:
+            users = self._queues[priority]
+            while users and self._in_use_locked() < self._max_concurrency:
+                if priority == PRIORITY_BATCH and self._in_use_locked(PRIORITY_BATCH) >= self._batch_max_concurrency:
+                    break
+                user_id, queue = next(iter(users.items()))
+                request = queue.popleft()
+                if queue:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                self._starting[priority] += 1
+                self._stats["started"] += 1
+                waited = request.waited = time.monotonic() - request.enqueued_at
+                self._stats["wait_seconds"] += waited
+                metrics.observe_stage("build_queue_wait", waited)
+                granted.append(request)
+        if self._running and any(self._queues.values()):
+            # Waiting requests must not depend on a later submit() or release() to reclaim a lost slot
+            oldest_start = min(started_at for _, started_at in self._running.values())
+            self._schedule_reclaim_locked(oldest_start + self._slot_timeout - time.monotonic())
+        return granted
+
+    def _schedule_reclaim_locked(self, delay: float):
+        if self._timer is not None:
+            return
+
+        def redispatch():
+            with self._lock:
+                self._timer = None
+                granted = self._dispatch_locked()
+            self._start_all(granted)
+
+        # A little past the expiry, so the slot is over the timeout when the timer runs
+        self._timer = threading.Timer(max(delay, 0) + 0.01, redispatch)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _dispatch_order_locked(self) -> list:
+        """Waiting requests in the order they would be granted: round-robin per user, by priority class."""
+        order = []
+        for priority in PRIORITY_CLASSES:
+            queues = [list(queue) for queue in self._queues[priority].values()]
+            for turn in range(max((len(queue) for queue in queues), default=0)):
+                order.extend(queue[turn] for queue in queues if turn < len(queue))
+        return order
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_build_scheduler() -> BuildScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = BuildScheduler()
+                metrics.register_stats("ideaforge_build_scheduler", _scheduler.stats,
+                                       counters=("started", "queued", "failed", "reclaimed", "wait_seconds"),
+                                       label="priority")
+    return _scheduler
@@ -0,0 +1,451 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Durable record of every Cloud Build we triggered or reused, keyed by build_id.
+# BUILD_STATUS_BACKEND selects where it lives:
+#   sqlite     A SQLite file in WAL mode (the default). Readers never block the webhook
+#              writer and rows survive restarts, but WAL relies on shared memory on one
+#              host: only processes on the same machine share statuses, never separate
+#              Cloud Run instances or a network filesystem.
+#   firestore  A Firestore collection that every instance reads and writes, so a status
+#              the webhook stored on one instance is served by any other. Use it whenever
+#              more than one instance takes traffic.
+#   memory     Process-local, for development.
+# Other backends only need to implement BuildStatusStore.
+
+BUILD_STATUS_BACKEND = os.getenv("BUILD_STATUS_BACKEND", "sqlite")  # "sqlite", "firestore" or "memory"
+BUILD_STATUS_DB_PATH = os.getenv("BUILD_STATUS_DB_PATH", "/tmp/ideaforge_build_status.db")
+BUILD_STATUS_FIRESTORE_COLLECTION = os.getenv("BUILD_STATUS_FIRESTORE_COLLECTION", "ideaforge_build_status")
+# Records untouched for this long are compacted away
+BUILD_STATUS_TTL_SECONDS = int(os.getenv("BUILD_STATUS_TTL_SECONDS", str(7 * 24 * 3600)))
+BUILD_STATUS_COMPACT_INTERVAL_SECONDS = int(os.getenv("BUILD_STATUS_COMPACT_INTERVAL_SECONDS", "600"))
+# Waiters are woken immediately by writes in this process; this re-check interval
+# picks up writes made by other processes or instances sharing the store
+BUILD_STATUS_WAIT_POLL_SECONDS = float(os.getenv("BUILD_STATUS_WAIT_POLL_SECONDS", "2"))
+
+TERMINAL_BUILD_STATUSES = ("SUCCESS", "FAILURE", "INTERNAL_ERROR", "TIMEOUT", "CANCELLED", "EXPIRED")
+
+# Cloud Build status order; Pub/Sub can deliver notifications out of order, and an
+# older status must never overwrite a newer one. SCHEDULED is ours: the build is
+# waiting in build_scheduler and has no Cloud Build id yet.
+_STATUS_RANK = {"STATUS_UNKNOWN": 0, "SCHEDULED": 0, "PENDING": 1, "QUEUED": 2, "WORKING": 3}
+_TERMINAL_RANK = 4
+
+
+def status_rank(status: str) -> int:
+    if status in TERMINAL_BUILD_STATUSES:
+        return _TERMINAL_RANK
+    return _STATUS_RANK.get(status, 0)
+
+
+def apply_transition(record: dict, status: str, fields: dict = None, drop_fields=()):
+    """
+    Returns (changed, new_record) for moving record to status with fields merged in.
+    Moves to a lower-ranked status, or away from a terminal status, are rejected.
+    record is None for a build the store has not seen yet.
+    """
+    now = time.time()
+    if record is None:
+        record = {"status": status, "version": 0, "created_at": now}
+    else:
+        current = record["status"]
+        if status != current and status_rank(status) <= status_rank(current):
+            return False, record
+    new_record = dict(record)
+    new_record["status"] = status
+    new_record.update(fields or {})
+    for field in drop_fields:
+        new_record.pop(field, None)
+    if new_record == record and record["version"]:
+        return False, record
+    new_record["version"] = record["version"] + 1
+    new_record["updated_at"] = now
+    return True, new_record
+
+
+class BuildStatusStore:
+    """
+    Interface for build status backends. Records are dicts with at least build_id,
+    status, version, created_at and updated_at; user_id and any extra fields are optional.
+    Backends call _notify(build_id) after every committed change so wait_for_change() returns promptly.
+    """
+
+    def __init__(self):
+        self._waiters = {}  # build_id -> [Condition, waiter count]
+        self._async_waiters = {}  # build_id -> set of (event loop, asyncio.Event)
+        self._waiters_lock = threading.Lock()
+
+    def get(self, build_id: str):
+        raise NotImplementedError
+
+    def transition(self, build_id: str, status: str, fields: dict = None, drop_fields=(), user_id: str = None):
+        """Atomically applies apply_transition() and returns (changed, record)."""
+        raise NotImplementedError
+
+    def list_for_user(self, user_id: str, status: str = None, limit: int = 50) -> list:
+        raise NotImplementedError
+
+    def compact(self, ttl_seconds: int = BUILD_STATUS_TTL_SECONDS) -> int:
+        """Deletes records not updated within ttl_seconds; returns how many were removed."""
+        raise NotImplementedError
+
+    def wait_for_change(self, build_id: str, version, timeout: float):
+        """
+        Blocks until the record's version differs from version or timeout expires,
+        then returns the current record (None if the build is unknown).
+        """
+        deadline = time.monotonic() + timeout
+        with self._waiters_lock:
+            entry = self._waiters.get(build_id)
+            if entry is None:
+                entry = self._waiters[build_id] = [threading.Condition(), 0]
+            entry[1] += 1
+        condition = entry[0]
+        try:
+            with condition:
+                while True:
+                    # Read while holding the condition so a notify cannot slip in before wait()
+                    record = self.get(build_id)
+                    remaining = deadline - time.monotonic()
+                    if (record["version"] if record else None) != version or remaining <= 0:
+                        return record
+                    condition.wait(min(remaining, BUILD_STATUS_WAIT_POLL_SECONDS))
+        finally:
+            with self._waiters_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._waiters.pop(build_id, None)
+
+    async def wait_for_change_async(self, build_id: str, version, timeout: float):
+        """wait_for_change() for asyncio callers; an idle waiter holds no thread."""
+        deadline = time.monotonic() + timeout
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._waiters_lock:
+            self._async_waiters.setdefault(build_id, set()).add(waiter)
+        try:
+            while True:
+                # Registered before reading, so a change committed after this read still sets the event
+                waiter[1].clear()
+                record = await asyncio.to_thread(self.get, build_id)
+                remaining = deadline - time.monotonic()
+                if (record["version"] if record else None) != version or remaining <= 0:
+                    return record
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), min(remaining, BUILD_STATUS_WAIT_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._waiters_lock:
+                waiters = self._async_waiters.get(build_id)
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._async_waiters[build_id]
+
+    def _notify(self, build_id: str):
+        with self._waiters_lock:
+            entry = self._waiters.get(build_id)
+            async_waiters = list(self._async_waiters.get(build_id, ()))
+        if entry:
+            with entry[0]:
+                entry[0].notify_all()
+        for loop, event in async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+
+class MemoryBuildStatusStore(BuildStatusStore):
+    """Process-local backend for development; statuses are lost on restart."""
+
+    def __init__(self):
+        super().__init__()
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, build_id: str):
+        with self._lock:
+            record = self._records.get(build_id)
+            return dict(record) if record else None
+
+    def transition(self, build_id: str, status: str, fields: dict = None, drop_fields=(), user_id: str = None):
+        with self._lock:
+            changed, record = apply_transition(self._records.get(build_id), status, fields, drop_fields)
+            if changed:
+                record["build_id"] = build_id
+                if user_id:
+                    record["user_id"] = user_id
+                self._records[build_id] = record
+        if changed:
+            self._notify(build_id)
+        return changed, dict(record)
+
+    def list_for_user(self, user_id: str, status: str = None, limit: int = 50) -> list:
+        with self._lock:
+            records = [dict(r) for r in self._records.values()
+                       if r.get("user_id") == user_id and (status is None or r["status"] == status)]
+        return sorted(records, key=lambda r: r["updated_at"], reverse=True)[:limit]
+
+    def compact(self, ttl_seconds: int = BUILD_STATUS_TTL_SECONDS) -> int:
+        cutoff = time.time() - ttl_seconds
+        with self._lock:
+            expired = [build_id for build_id, r in self._records.items() if r["updated_at"] < cutoff]
+            for build_id in expired:
+                del self._records[build_id]
+        return len(expired)
+
+
+class SQLiteBuildStatusStore(BuildStatusStore):
+    """
+    SQLite backend. Indexed columns hold what is queried (build_id, user_id, status,
+    updated_at); everything else lives in a JSON data column. Each thread keeps its own
+    connection, and transitions run inside BEGIN IMMEDIATE so concurrent webhook
+    deliveries for one build cannot interleave.
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS build_status ("
+        " build_id TEXT PRIMARY KEY,"
+        " user_id TEXT,"
+        " status TEXT NOT NULL,"
+        " version INTEGER NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " data TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_build_status_user ON build_status (user_id, updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_build_status_status ON build_status (status, updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_build_status_updated ON build_status (updated_at)",
+    )
+    _COLUMNS = "build_id, user_id, status, version, created_at, updated_at, data"
+
+    def __init__(self, path: str = BUILD_STATUS_DB_PATH, compact_interval_seconds: int = BUILD_STATUS_COMPACT_INTERVAL_SECONDS):
+        super().__init__()
+        self._path = path
+        self._local = threading.local()
+        self._compact_interval = compact_interval_seconds
+        self._last_compact = 0.0
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self._SCHEMA:
+            conn.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly where atomicity matters
+            conn = sqlite3.connect(self._path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_record(row):
+        if row is None:
+            return None
+        build_id, user_id, status, version, created_at, updated_at, data = row
+        record = json.loads(data)
+        record.update({
+            "build_id": build_id,
+            "status": status,
+            "version": version,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        })
+        if user_id:
+            record["user_id"] = user_id
+        return record
+
+    def get(self, build_id: str):
+        row = self._connection().execute(
+            f"SELECT {self._COLUMNS} FROM build_status WHERE build_id = ?", (build_id,)
+        ).fetchone()
+        return self._to_record(row)
+
+    def transition(self, build_id: str, status: str, fields: dict = None, drop_fields=(), user_id: str = None):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT {self._COLUMNS} FROM build_status WHERE build_id = ?", (build_id,)
+            ).fetchone()
+            changed, record = apply_transition(self._to_record(row), status, fields, drop_fields)
+            if changed:
+                record["build_id"] = build_id
+                if user_id:
+                    record["user_id"] = user_id
+                data = {k: v for k, v in record.items()
+                        if k not in ("build_id", "user_id", "status", "version", "created_at", "updated_at")}
+                conn.execute(
+                    f"INSERT OR REPLACE INTO build_status ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (build_id, record.get("user_id"), record["status"], record["version"],
+                     record["created_at"], record["updated_at"], json.dumps(data)),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if changed:
+            self._notify(build_id)
+            self._maybe_compact()
+        return changed, record
+
+    def list_for_user(self, user_id: str, status: str = None, limit: int = 50) -> list:
+        query = f"SELECT {self._COLUMNS} FROM build_status WHERE user_id = ?"
+        params = [user_id]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY updated_at DESC LIMIT ?"
+        params.append(limit)
+        return [self._to_record(row) for row in self._connection().execute(query, params)]
+
+    def compact(self, ttl_seconds: int = BUILD_STATUS_TTL_SECONDS) -> int:
+        cursor = self._connection().execute(
+            "DELETE FROM build_status WHERE updated_at < ?", (time.time() - ttl_seconds,)
+        )
+        return cursor.rowcount
+
+    def _maybe_compact(self):
+        now = time.monotonic()
+        if now - self._last_compact < self._compact_interval:
+            return
+        self._last_compact = now
+        try:
+            removed = self.compact()
+            if removed:
+                print(f"Compacted {removed} expired build status records")
+        except sqlite3.Error as e:
+            print(f"Error compacting build status store: {e}")
+
+
+class FirestoreBuildStatusStore(BuildStatusStore):
+    """
+    Firestore backend, shared by all instances: one document per build_id with the same
+    fields as the SQLite columns. transition() runs in a Firestore transaction, which is
+    retried when another instance changes the same build concurrently. list_for_user()
+    needs composite indexes on (user_id, updated_at desc) and (user_id, status, updated_at desc).
+    """
+
+    _COMPACT_BATCH_SIZE = 500  # Firestore's limit on writes per batch
+
+    def __init__(self, client, collection: str = BUILD_STATUS_FIRESTORE_COLLECTION,
+                 compact_interval_seconds: int = BUILD_STATUS_COMPACT_INTERVAL_SECONDS):
+        super().__init__()
+        from google.cloud import firestore
+        self._firestore = firestore
+        self._client = client
+        self._collection = client.collection(collection)
+        self._compact_interval = compact_interval_seconds
+        self._last_compact = 0.0
+
+    @staticmethod
+    def _to_record(snapshot):
+        if not snapshot.exists:
+            return None
+        document = snapshot.to_dict()
+        record = json.loads(document["data"])
+        record.update({
+            "build_id": snapshot.id,
+            "status": document["status"],
+            "version": document["version"],
+            "created_at": document["created_at"],
+            "updated_at": document["updated_at"],
+        })
+        if document.get("user_id"):
+            record["user_id"] = document["user_id"]
+        return record
+
+    @staticmethod
+    def _to_document(record: dict) -> dict:
+        data = {k: v for k, v in record.items()
+                if k not in ("build_id", "user_id", "status", "version", "created_at", "updated_at")}
+        return {
+            "user_id": record.get("user_id"),
+            "status": record["status"],
+            "version": record["version"],
+            "created_at": record["created_at"],
+            "updated_at": record["updated_at"],
+            "data": json.dumps(data),
+        }
+
+    def get(self, build_id: str):
+        return self._to_record(self._collection.document(build_id).get())
+
+    def transition(self, build_id: str, status: str, fields: dict = None, drop_fields=(), user_id: str = None):
+        reference = self._collection.document(build_id)
+
+        @self._firestore.transactional
+        def apply(transaction):
+            changed, record = apply_transition(self._to_record(reference.get(transaction=transaction)),
+                                               status, fields, drop_fields)
+            if changed:
+                record["build_id"] = build_id
+                if user_id:
+                    record["user_id"] = user_id
+                transaction.set(reference, self._to_document(record))
+            return changed, record
+
+        changed, record = apply(self._client.transaction())
+        if changed:
+            self._notify(build_id)
+            self._maybe_compact()
+        return changed, record
+
+    def list_for_user(self, user_id: str, status: str = None, limit: int = 50) -> list:
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        query = self._collection.where(filter=FieldFilter("user_id", "==", user_id))
+        if status is not None:
+            query = query.where(filter=FieldFilter("status", "==", status))
+        query = query.order_by("updated_at", direction=self._firestore.Query.DESCENDING).limit(limit)
+        return [self._to_record(snapshot) for snapshot in query.stream()]
+
+    def compact(self, ttl_seconds: int = BUILD_STATUS_TTL_SECONDS) -> int:
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        query = self._collection.where(filter=FieldFilter("updated_at", "<", time.time() - ttl_seconds))
+        removed = 0
+        while True:
+            snapshots = list(query.limit(self._COMPACT_BATCH_SIZE).stream())
+            if not snapshots:
+                return removed
+            batch = self._client.batch()
+            for snapshot in snapshots:
+                batch.delete(snapshot.reference)
+            batch.commit()
+            removed += len(snapshots)
+
+    def _maybe_compact(self):
+        now = time.monotonic()
+        if now - self._last_compact < self._compact_interval:
+            return
+        self._last_compact = now
+        try:
+            removed = self.compact()
+            if removed:
+                print(f"Compacted {removed} expired build status records")
+        except Exception as e:
+            print(f"Error compacting build status store: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_build_status_store() -> BuildStatusStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if BUILD_STATUS_BACKEND == "memory":
+                    _store = MemoryBuildStatusStore()
+                elif BUILD_STATUS_BACKEND == "firestore":
+                    import gcp_clients
+                    # Same project and key as the Cloud Build and GCS clients
+                    client = gcp_clients.get_firestore_client(os.getenv("GCP_SERVICE_ACCOUNT_KEY_PATH"),
+                                                              os.getenv("GCP_PROJECT_ID"))
+                    if client is None:
+                        raise RuntimeError("BUILD_STATUS_BACKEND=firestore, but GCP credentials could not be loaded")
+                    _store = FirestoreBuildStatusStore(client)
+                else:
+                    _store = SQLiteBuildStatusStore(BUILD_STATUS_DB_PATH)
+    return _store
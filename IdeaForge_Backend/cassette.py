@@ -0,0 +1,176 @@
+import atexit
+import functools
+import gzip
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+import tracing
+
+# Record/replay of calls to external services (Claude, Cloud Build, GCS), for reproducing
+# incidents and comparing pipeline versions offline. In record mode every call to a
+# function decorated with @recorded appends one JSON line to the cassette: the call name,
+# a hash of its arguments, its wall-clock latency and its return value. In replay mode the
+# function is not run; the recorded value is returned after the recorded latency times
+# IDEAFORGE_CASSETTE_LATENCY_SCALE (0 replays instantly). Identical calls are answered in
+# recorded order, the last answer repeating once they run out; a call the cassette has
+# never seen gets the function's on_miss value.
+#
+# A path ending in .gz is gzip-compressed. "{pid}" in the path is replaced by the process
+# id, so several workers can record at once. Entries are flushed as they are written.
+
+CASSETTE_MODE = os.getenv("IDEAFORGE_CASSETTE_MODE", "off")  # "off", "record" or "replay"
+CASSETTE_PATH = os.getenv("IDEAFORGE_CASSETTE_PATH", "/tmp/ideaforge_cassette.jsonl.gz")
+CASSETTE_LATENCY_SCALE = float(os.getenv("IDEAFORGE_CASSETTE_LATENCY_SCALE", "1"))
+
+# Calls made from inside a recorded call (e.g. the bucket listing behind a build lookup) belong to it
+_depth = threading.local()
+
+
+def call_key(fn, args, kwargs, key_args=None) -> str:
+    """Hash of the call's arguments (only key_args when given), defaults filled in."""
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = bound.arguments
+    if key_args is not None:
+        arguments = {name: arguments[name] for name in key_args}
+    canonical = json.dumps(arguments, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:24]
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    def __init__(self, mode: str, path: str, latency_scale: float = 1.0):
+        self.mode = mode
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.latency_scale = latency_scale
+        self._entries = {}  # (call, key) -> deque of entries still to replay, the last one kept
+        self._file = None
+        self._lock = threading.Lock()
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        if mode == "replay":
+            self._load()
+        elif mode == "record":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = _open(self.path, "a")
+        print(f"Cassette: {mode} {self.path}")
+
+    def _load(self):
+        count = 0
+        with _open(self.path, "r") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault((entry["call"], entry["key"]), deque()).append(entry)
+                        count += 1
+            except (EOFError, ValueError) as e:
+                # A recording process that died mid-write leaves a truncated last entry
+                print(f"Cassette: stopped reading {self.path} at a truncated entry: {e}")
+        print(f"Cassette: loaded {count} calls from {self.path}")
+
+    def record(self, call: str, key: str, seconds: float, result):
+        entry = {"call": call, "key": key, "ms": round(seconds * 1000, 1), "result": result}
+        if isinstance(result, tuple):
+            entry["tuple"] = True
+        line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            self._stats["recorded"] += 1
+
+    def next_entry(self, call: str, key: str):
+        """The next recorded entry for this call, or None if it was never recorded."""
+        with self._lock:
+            entries = self._entries.get((call, key))
+            if not entries:
+                self._stats["misses"] += 1
+                return None
+            self._stats["replayed"] += 1
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+    def replay(self, entry: dict):
+        delay = entry["ms"] / 1000 * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+        result = entry["result"]
+        return tuple(result) if entry.get("tuple") else result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def recorded(call: str, key_args=None, on_miss=None, on_replay=None):
+    """
+    Records or replays the decorated function according to CASSETTE_MODE; a no-op when off.
+    key_args limits which arguments identify a call (leave out per-run values such as job ids).
+    on_miss(*args, **kwargs) gives the value for a call missing from the cassette, and
+    on_replay(result, *args, **kwargs) repeats local side effects of the skipped function.
+    """
+    def decorator(fn):
+        if CASSETTE_MODE not in ("record", "replay"):
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(_depth, "value", 0):
+                return fn(*args, **kwargs)
+            cassette = get_cassette()
+            key = call_key(fn, args, kwargs, key_args)
+            if cassette.mode == "replay":
+                entry = cassette.next_entry(call, key)
+                tracing.set_attributes(cassette="replay" if entry else "miss")
+                if entry is None:
+                    print(f"Cassette: no recording of {call} {key}")
+                    return on_miss(*args, **kwargs) if on_miss else None
+                result = cassette.replay(entry)
+                if on_replay:
+                    on_replay(result, *args, **kwargs)
+                return result
+
+            _depth.value = getattr(_depth, "value", 0) + 1
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                _depth.value -= 1
+            cassette.record(call, key, time.perf_counter() - started, result)
+            return result
+        return wrapper
+    return decorator
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Cassette:
+    global _cassette
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette(CASSETTE_MODE, CASSETTE_PATH, CASSETTE_LATENCY_SCALE)
+                metrics.register_stats("ideaforge_cassette", _cassette.stats,
+                                       counters=("recorded", "replayed", "misses"))
+                # Completes the gzip stream of a recording
+                atexit.register(_cassette.close)
+    return _cassette
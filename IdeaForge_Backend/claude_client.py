@@ -0,0 +1,291 @@
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import tracing
+from claude_scheduler import SchedulerTimeout, get_scheduler  # noqa: F401 (SchedulerTimeout re-exported for callers)
+from response_cache import get_response_cache, make_cache_key
+
+# Shared, pooled HTTP client for Anthropic Messages API calls.
+# Every backend goes through post_messages() so TCP/TLS connections are reused
+# across generations and transient overloads (429/529) are retried instead of failing the request.
+
+POOL_SIZE = int(os.getenv("CLAUDE_HTTP_POOL_SIZE", "16"))
+MAX_ATTEMPTS = int(os.getenv("CLAUDE_MAX_ATTEMPTS", "4"))
+BACKOFF_BASE_SECONDS = float(os.getenv("CLAUDE_BACKOFF_BASE_SECONDS", "1.0"))
+BACKOFF_MAX_SECONDS = float(os.getenv("CLAUDE_BACKOFF_MAX_SECONDS", "30.0"))
+# Overall budget for one logical call, including retries and backoff sleeps
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("CLAUDE_DEADLINE_SECONDS", "240"))
+# Lower bound on an attempt's timeout, for when a backoff sleep overshoots the deadline
+MIN_ATTEMPT_TIMEOUT_SECONDS = 1.0
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504, 529}
+
+# Prompt caching: the system prompt and the stable part of the history are marked with
+# cache_control so follow-up requests read them from Anthropic's prompt cache
+PROMPT_CACHING = os.getenv("CLAUDE_PROMPT_CACHING", "1") == "1"
+CACHE_CONTROL = {"type": "ephemeral"}
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0}
+_stats.update({field: 0 for field in USAGE_FIELDS})
+# Every entry only ever grows; token usage is exported as ideaforge_claude_<field>_total
+STAT_COUNTERS = tuple(_stats)
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide keep-alive session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are handled in post_messages so they can honour retry-after and the deadline
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def warm_up(url: str, timeout: float = 5.0):
+    """Opens a pooled connection to url (DNS, TCP and TLS) ahead of the first real call; errors are ignored."""
+    try:
+        get_session().head(url, timeout=timeout).close()
+    except requests.exceptions.RequestException as e:
+        print(f"Claude API warm-up failed (first call will connect instead): {e}")
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _bump(**counts):
+    with _stats_lock:
+        for key, value in counts.items():
+            _stats[key] += value
+
+
+def record_usage(usage: dict):
+    """Adds a response's token usage, including prompt cache reads and writes, to the stats."""
+    counts = {field: int(usage.get(field) or 0) for field in USAGE_FIELDS}
+    _bump(**counts)
+    print(f"Claude usage: input {counts['input_tokens']}, output {counts['output_tokens']}, "
+          f"cache read {counts['cache_read_input_tokens']}, cache write {counts['cache_creation_input_tokens']}")
+
+
+def apply_prompt_caching(payload: dict, stable_messages: int) -> dict:
+    """
+    Marks payload's system prompt, and the first stable_messages messages (the history
+    prefix that will be resent unchanged next turn), as cacheable. Returns payload.
+    """
+    if not PROMPT_CACHING:
+        return payload
+    system = payload.get("system")
+    if isinstance(system, str) and system:
+        payload["system"] = [{"type": "text", "text": system, "cache_control": CACHE_CONTROL}]
+    if stable_messages > 0:
+        message = payload["messages"][stable_messages - 1]
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}] if content else []
+        else:
+            content = [dict(block) for block in content]
+        if content:
+            content[-1]["cache_control"] = CACHE_CONTROL
+            payload["messages"][stable_messages - 1] = {"role": message["role"], "content": content}
+    return payload
+
+
+def _retry_after_seconds(response):
+    """Parses a retry-after header given either as seconds or as an HTTP date."""
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_seconds(attempt: int, response) -> float:
+    # Full jitter keeps concurrent callers from retrying in lockstep
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    retry_after = _retry_after_seconds(response)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def post_messages(url: str, headers: dict, payload: dict, timeout: float = 180,
+                  deadline_seconds: float = DEFAULT_DEADLINE_SECONDS, stream: bool = False) -> requests.Response:
+    """
+    POSTs payload to the Messages API through the shared session.
+    Retries connection errors and retryable statuses with jittered exponential backoff,
+    honouring retry-after, until MAX_ATTEMPTS or the overall deadline is reached.
+    Returns the final response; callers still call raise_for_status() on it.
+    With stream=True the body is left unread for iter_text_deltas().
+    """
+    session = get_session()
+    deadline = time.monotonic() + deadline_seconds
+    _bump(calls=1)
+
+    attempt = 0
+    while True:
+        attempt_timeout = max(min(timeout, deadline - time.monotonic()), MIN_ATTEMPT_TIMEOUT_SECONDS)
+        response = None
+        error = None
+        started = time.monotonic()
+        with tracing.span("claude.attempt", attempt=attempt + 1) as span:
+            try:
+                response = session.post(url, headers=headers, json=payload, timeout=attempt_timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            outcome = response.status_code if response is not None else type(error).__name__
+            if span is not None:
+                span.set_attribute("outcome", outcome)
+                if error is not None or response.status_code >= 400:
+                    span.record_error(error if error is not None else f"HTTP {outcome}")
+        latency_ms = (time.monotonic() - started) * 1000
+        _bump(attempts=1)
+        print(f"Claude API attempt {attempt + 1}/{MAX_ATTEMPTS}: {outcome} in {latency_ms:.0f} ms")
+
+        retryable = error is not None or response.status_code in RETRYABLE_STATUS_CODES
+        if not retryable:
+            return response
+        if response is not None:
+            # Release the pooled connection before sleeping (matters for unread streaming bodies)
+            response.close()
+
+        delay = _backoff_seconds(attempt, response)
+        attempt += 1
+        if attempt >= MAX_ATTEMPTS or time.monotonic() + delay >= deadline:
+            _bump(failures=1)
+            if error is not None:
+                raise error
+            return response
+
+        _bump(retries=1)
+        print(f"Retrying Claude API call in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def create_message(url: str, headers: dict, payload: dict, timeout: float = 180, use_cache: bool = True,
+                   user_id: str = None) -> dict:
+    """
+    Returns the Messages API response JSON for payload, served from the response
+    cache when an identical request was answered before. use_cache=False bypasses
+    the lookup but still stores the fresh response. API calls are admitted by the
+    scheduler under user_id's fair share. Raises requests exceptions or SchedulerTimeout.
+    """
+    cache = get_response_cache()
+    cache_key = make_cache_key(payload)
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"Claude response cache hit: {cache_key[:12]}")
+            tracing.set_attributes(claude_cache="hit")
+            return cached
+
+    scheduler = get_scheduler()
+    with tracing.span("claude.queue_wait"):
+        ticket = scheduler.acquire(user_id, payload)
+    usage = None
+    try:
+        with metrics.stage_timer("claude_call"), tracing.span("claude.messages", model=payload.get("model")) as span:
+            response = post_messages(url, headers, payload, timeout=timeout)
+            response.raise_for_status()
+            api_response_json = response.json()
+            usage = api_response_json.get("usage") or {}
+            if span is not None:
+                span.set_attributes(**{f"usage.{field}": usage.get(field) for field in USAGE_FIELDS})
+    finally:
+        scheduler.release(ticket, usage)
+    record_usage(usage)
+    if api_response_json.get("content"):
+        cache.put(cache_key, api_response_json)
+    return api_response_json
+
+
+def stream_message(url: str, headers: dict, payload: dict, timeout: float = 180, user_id: str = None,
+                   usage: dict = None):
+    """
+    Streaming counterpart of create_message: yields text deltas, holding a scheduler
+    slot until the stream ends. Raises requests exceptions or SchedulerTimeout.
+    """
+    scheduler = get_scheduler()
+    with tracing.span("claude.queue_wait"):
+        ticket = scheduler.acquire(user_id, payload)
+    stream_usage = {}
+    try:
+        with metrics.stage_timer("claude_stream"):
+            response = post_messages(url, headers, dict(payload, stream=True), timeout=timeout, stream=True)
+            response.raise_for_status()
+            yield from iter_text_deltas(response, stream_usage)
+    finally:
+        scheduler.release(ticket, stream_usage)
+        if usage is not None:
+            usage.update(stream_usage)
+
+
+def iter_text_deltas(response: requests.Response, usage: dict = None):
+    """
+    Reads an Anthropic Messages API SSE stream and yields text deltas as they arrive.
+    Token usage from message_start/message_delta events is merged into usage if given,
+    and recorded in the stats once the stream ends.
+    Raises RuntimeError if the stream reports an error event.
+    """
+    stream_usage = {}
+    event_type = None
+    # SSE is always UTF-8; without this iter_lines() may yield bytes
+    response.encoding = "utf-8"
+    try:
+        for raw_line in response.iter_lines(decode_unicode=True):
+            if not raw_line:
+                event_type = None
+                continue
+            if raw_line.startswith("event:"):
+                event_type = raw_line[len("event:"):].strip()
+                continue
+            if not raw_line.startswith("data:"):
+                continue
+            data = json.loads(raw_line[len("data:"):].strip())
+            event_type = data.get("type", event_type)
+            if event_type == "content_block_delta":
+                delta = data.get("delta", {})
+                if delta.get("type") == "text_delta":
+                    yield delta.get("text", "")
+            elif event_type == "message_start":
+                stream_usage.update(data.get("message", {}).get("usage", {}))
+            elif event_type == "message_delta":
+                stream_usage.update(data.get("usage", {}))
+            elif event_type == "message_stop":
+                break
+            elif event_type == "error":
+                raise RuntimeError(f"Claude stream error: {data.get('error')}")
+    finally:
+        response.close()
+        if usage is not None:
+            usage.update(stream_usage)
+        if stream_usage:
+            record_usage(stream_usage)
+
+
+metrics.register_stats("ideaforge_claude", get_stats, counters=STAT_COUNTERS)
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import aiohttp
+
+import claude_client
+import metrics
+import tracing
+from claude_scheduler import get_scheduler
+from response_cache import get_response_cache, make_cache_key
+
+# asyncio counterpart of claude_client for live_backend_async.py. Same retry policy,
+# response cache, fair scheduler and usage accounting, but a call waiting on the
+# API, a backoff or a scheduler slot is a suspended coroutine, not a blocked thread.
+# Sessions are bound to an event loop: create one per loop with create_session().
+
+
+class ClaudeAPIError(Exception):
+    """Non-retryable (or finally failed) HTTP status from the Messages API."""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"Claude API returned {status_code}: {body[:500]}")
+        self.status_code = status_code
+        self.body = body
+
+
+def create_session() -> aiohttp.ClientSession:
+    """Keep-alive session for Messages API calls; close it when the loop shuts down."""
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=claude_client.POOL_SIZE))
+
+
+async def post_messages(session: aiohttp.ClientSession, url: str, headers: dict, payload: dict, timeout: float = 180,
+                        deadline_seconds: float = claude_client.DEFAULT_DEADLINE_SECONDS):
+    """
+    post_messages() for asyncio: retries connection errors and retryable statuses with
+    jittered backoff honouring retry-after. Returns the final response with its body read.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    claude_client._bump(calls=1)
+
+    attempt = 0
+    while True:
+        attempt_timeout = max(min(timeout, deadline - time.monotonic()), claude_client.MIN_ATTEMPT_TIMEOUT_SECONDS)
+        response = None
+        error = None
+        started = time.monotonic()
+        with tracing.span("claude.attempt", attempt=attempt + 1) as span:
+            try:
+                async with session.post(url, headers=headers, json=payload,
+                                        timeout=aiohttp.ClientTimeout(total=attempt_timeout)) as response:
+                    await response.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                response, error = None, e
+            outcome = response.status if response is not None else type(error).__name__
+            if span is not None:
+                span.set_attribute("outcome", outcome)
+                if error is not None or response.status >= 400:
+                    span.record_error(error if error is not None else f"HTTP {outcome}")
+        latency_ms = (time.monotonic() - started) * 1000
+        claude_client._bump(attempts=1)
+        print(f"Claude API attempt {attempt + 1}/{claude_client.MAX_ATTEMPTS}: {outcome} in {latency_ms:.0f} ms")
+
+        if error is None and response.status not in claude_client.RETRYABLE_STATUS_CODES:
+            return response
+
+        delay = claude_client._backoff_seconds(attempt, response)
+        attempt += 1
+        if attempt >= claude_client.MAX_ATTEMPTS or time.monotonic() + delay >= deadline:
+            claude_client._bump(failures=1)
+            if error is not None:
+                raise error
+            return response
+
+        claude_client._bump(retries=1)
+        print(f"Retrying Claude API call in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+async def create_message(session: aiohttp.ClientSession, url: str, headers: dict, payload: dict, timeout: float = 180,
+                         use_cache: bool = True, user_id: str = None) -> dict:
+    """
+    claude_client.create_message() for asyncio. Raises ClaudeAPIError, aiohttp errors,
+    asyncio.TimeoutError or SchedulerTimeout.
+    """
+    cache = get_response_cache()
+    cache_key = make_cache_key(payload)
+    if use_cache:
+        # With CLAUDE_CACHE_DIR set the cache reads and writes files, so keep it off the loop
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            print(f"Claude response cache hit: {cache_key[:12]}")
+            tracing.set_attributes(claude_cache="hit")
+            return cached
+
+    scheduler = get_scheduler()
+    with tracing.span("claude.queue_wait"):
+        ticket = await scheduler.acquire_async(user_id, payload)
+    usage = None
+    try:
+        with metrics.stage_timer("claude_call"), tracing.span("claude.messages", model=payload.get("model")) as span:
+            response = await post_messages(session, url, headers, payload, timeout=timeout)
+            if response.status >= 400:
+                raise ClaudeAPIError(response.status, await response.text())
+            api_response_json = await response.json()
+            usage = api_response_json.get("usage") or {}
+            if span is not None:
+                span.set_attributes(**{f"usage.{field}": usage.get(field) for field in claude_client.USAGE_FIELDS})
+    finally:
+        scheduler.release(ticket, usage)
+    claude_client.record_usage(usage)
+    if api_response_json.get("content"):
+        await asyncio.to_thread(cache.put, cache_key, api_response_json)
+    return api_response_json
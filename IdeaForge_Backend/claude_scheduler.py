@@ -0,0 +1,225 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+# Process-wide admission control for Anthropic calls. A call proceeds only when an
+# in-flight slot is free and the input/output tokens-per-minute budgets can cover it;
+# otherwise it waits in a per-user FIFO, and users are served round-robin so one
+# heavy user cannot starve the rest. A call that waits longer than the max wait
+# fails fast with SchedulerTimeout instead of piling onto an overloaded API.
+
+CLAUDE_MAX_CONCURRENCY = int(os.getenv("CLAUDE_MAX_CONCURRENCY", "8"))
+# Token budgets per minute; 0 disables the limit
+CLAUDE_INPUT_TPM = int(os.getenv("CLAUDE_INPUT_TPM", "0"))
+CLAUDE_OUTPUT_TPM = int(os.getenv("CLAUDE_OUTPUT_TPM", "0"))
+CLAUDE_QUEUE_MAX_WAIT_SECONDS = float(os.getenv("CLAUDE_QUEUE_MAX_WAIT_SECONDS", "30"))
+
+ANONYMOUS_USER = "anonymous"
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a call could not be admitted within the maximum queue wait."""
+
+
+class TokenBucket:
+    """Refills continuously at limit_per_minute / 60 tokens per second up to limit_per_minute."""
+
+    def __init__(self, limit_per_minute: int):
+        self.capacity = float(limit_per_minute)
+        self.level = self.capacity
+        self._rate = self.capacity / 60.0
+        self._updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        """0 if amount can be taken now. A request larger than the whole budget only needs a full bucket."""
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self._rate)
+
+    def adjust(self, delta: float):
+        """Takes (positive) or returns (negative) tokens; the level may go below zero."""
+        if self.enabled:
+            self._refill()
+            self.level = min(self.capacity, self.level - delta)
+
+
+class Ticket:
+    __slots__ = ("user_id", "input_tokens", "output_tokens", "granted", "event", "enqueued_at", "on_grant")
+
+    def __init__(self, user_id: str, input_tokens: int, output_tokens: int):
+        self.user_id = user_id
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.granted = False
+        self.event = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.on_grant = None  # called under the scheduler lock when granted (async waiters)
+
+
+def estimate_request_tokens(payload: dict) -> tuple:
+    """(input, output) reservation for payload: ~4 characters per input token, max_tokens for output."""
+    input_tokens = len(json.dumps([payload.get("system"), payload.get("messages")])) // 4
+    return input_tokens, int(payload.get("max_tokens") or 0)
+
+
+class ClaudeScheduler:
+    def __init__(self, max_concurrency: int = CLAUDE_MAX_CONCURRENCY, input_tpm: int = CLAUDE_INPUT_TPM,
+                 output_tpm: int = CLAUDE_OUTPUT_TPM, max_wait_seconds: float = CLAUDE_QUEUE_MAX_WAIT_SECONDS):
+        self._max_concurrency = max_concurrency
+        self._max_wait = max_wait_seconds
+        self._input = TokenBucket(input_tpm)
+        self._output = TokenBucket(output_tpm)
+        self._queues = OrderedDict()  # user_id -> deque of tickets; first key is served next
+        self._in_flight = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "queued": 0, "timeouts": 0, "wait_seconds": 0.0}
+
+    def acquire(self, user_id: str, payload: dict, max_wait_seconds: float = None) -> Ticket:
+        """Blocks until the call may start; raises SchedulerTimeout after the max wait."""
+        ticket = Ticket(user_id or ANONYMOUS_USER, *estimate_request_tokens(payload))
+        max_wait = self._max_wait if max_wait_seconds is None else max_wait_seconds
+        with self._lock:
+            self._queues.setdefault(ticket.user_id, deque()).append(ticket)
+            self._dispatch_locked()
+            if not ticket.granted:
+                self._stats["queued"] += 1
+        if ticket.event.wait(max_wait):
+            return ticket
+        with self._lock:
+            if ticket.granted:
+                return ticket
+            self._remove_locked(ticket)
+            self._stats["timeouts"] += 1
+        raise SchedulerTimeout(f"Claude API request not admitted within {max_wait:g}s")
+
+    async def acquire_async(self, user_id: str, payload: dict, max_wait_seconds: float = None) -> Ticket:
+        """acquire() for asyncio callers: waits on a future instead of blocking a thread."""
+        ticket = Ticket(user_id or ANONYMOUS_USER, *estimate_request_tokens(payload))
+        max_wait = self._max_wait if max_wait_seconds is None else max_wait_seconds
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        ticket.on_grant = lambda: loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+        with self._lock:
+            self._queues.setdefault(ticket.user_id, deque()).append(ticket)
+            self._dispatch_locked()
+            if not ticket.granted:
+                self._stats["queued"] += 1
+        if ticket.granted:
+            return ticket
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), max_wait)
+            return ticket
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The caller will never release a ticket it did not receive: withdraw it, or hand back its slot
+            with self._lock:
+                was_granted = ticket.granted
+                if not was_granted:
+                    self._remove_locked(ticket)
+            if was_granted:
+                self.release(ticket, {"input_tokens": 0, "output_tokens": 0})
+            raise
+        with self._lock:
+            if ticket.granted:
+                return ticket
+            self._remove_locked(ticket)
+            self._stats["timeouts"] += 1
+        raise SchedulerTimeout(f"Claude API request not admitted within {max_wait:g}s")
+
+    def release(self, ticket: Ticket, usage: dict = None):
+        """Frees the slot and corrects the token reservation with the actual usage, when known."""
+        with self._lock:
+            self._in_flight -= 1
+            if usage:
+                # Prompt cache reads do not count against the input rate limit
+                actual_input = int(usage.get("input_tokens") or 0) + int(usage.get("cache_creation_input_tokens") or 0)
+                self._input.adjust(actual_input - ticket.input_tokens)
+                self._output.adjust(int(usage.get("output_tokens") or 0) - ticket.output_tokens)
+            self._dispatch_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+            stats["waiting"] = sum(len(queue) for queue in self._queues.values())
+            stats["input_tokens_available"] = self._input.level if self._input.enabled else None
+            stats["output_tokens_available"] = self._output.level if self._output.enabled else None
+            return stats
+
+    def _remove_locked(self, ticket: Ticket):
+        queue = self._queues.get(ticket.user_id)
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.user_id]
+
+    def _dispatch_locked(self):
+        while self._queues and self._in_flight < self._max_concurrency:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue[0]
+            delay = max(self._input.seconds_until(ticket.input_tokens), self._output.seconds_until(ticket.output_tokens))
+            if delay > 0:
+                # Keep the turn order; retry once the budgets have refilled enough
+                self._schedule_dispatch_locked(delay)
+                return
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._input.adjust(ticket.input_tokens)
+            self._output.adjust(ticket.output_tokens)
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            waited = time.monotonic() - ticket.enqueued_at
+            self._stats["wait_seconds"] += waited
+            metrics.observe_stage("claude_queue_wait", waited)
+            ticket.granted = True
+            ticket.event.set()
+            if ticket.on_grant is not None:
+                ticket.on_grant()
+
+    def _schedule_dispatch_locked(self, delay: float):
+        if self._timer is not None:
+            return
+
+        def redispatch():
+            with self._lock:
+                self._timer = None
+                self._dispatch_locked()
+
+        self._timer = threading.Timer(delay, redispatch)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> ClaudeScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ClaudeScheduler()
+                metrics.register_stats("ideaforge_claude_scheduler", _scheduler.stats,
+                                       counters=("admitted", "queued", "timeouts", "wait_seconds"))
+    return _scheduler
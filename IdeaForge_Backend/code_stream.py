@@ -0,0 +1,90 @@
+class IncrementalCodeParser:
+    """
+    Incrementally extracts fenced code blocks from streamed Claude output.
+    feed() accepts arbitrary text chunks and returns the (filename, content) pairs
+    whose closing fence arrived in that chunk, so main.dart and pubspec.yaml can be
+    handled before the whole response has been generated.
+
+    Filenames come either from a preceding "FILENAME: x" line or from a
+    ```lang:filename fence, matching the formats parse_generated_code() accepts.
+    Blocks that do not name a build file are kept verbatim, fences included, in snippets.
+    """
+
+    def __init__(self):
+        self._partial_line = ""
+        self._in_code_block = False
+        self._pending_filename = None
+        self._current_filename = None
+        self._current_fence = None
+        self._current_lines = []
+        self.files = {}
+        self.snippets = []
+
+    def feed(self, chunk: str) -> list:
+        completed = []
+        data = self._partial_line + chunk
+        lines = data.split("\n")
+        # The last element is an incomplete line until the next newline arrives
+        self._partial_line = lines.pop()
+        for line in lines:
+            result = self._process_line(line)
+            if result:
+                completed.append(result)
+        return completed
+
+    def close(self) -> list:
+        """Flushes the final line. A block still open at end of stream is discarded."""
+        completed = []
+        if self._partial_line:
+            result = self._process_line(self._partial_line)
+            self._partial_line = ""
+            if result:
+                completed.append(result)
+        return completed
+
+    def _process_line(self, line: str):
+        line = line.rstrip()
+        stripped = line.strip()
+
+        if stripped.startswith("```"):
+            if not self._in_code_block:
+                self._in_code_block = True
+                parts = stripped.lstrip("`").split(":", 1)
+                self._current_filename = parts[1].strip() if len(parts) > 1 else self._pending_filename
+                self._pending_filename = None
+                self._current_fence = line
+                self._current_lines = []
+                return None
+            self._in_code_block = False
+            filename = normalize_filename(self._current_filename)
+            block_lines = self._current_lines
+            content = "\n".join(block_lines)
+            self._current_filename = None
+            self._current_lines = []
+            if filename and content:
+                self.files[filename] = content
+                return filename, content
+            if not filename:
+                self.snippets.append("\n".join([self._current_fence] + block_lines + [line]))
+            return None
+
+        if self._in_code_block:
+            self._current_lines.append(line)
+        elif stripped.startswith("FILENAME:"):
+            self._pending_filename = stripped[len("FILENAME:"):].strip()
+        return None
+
+
+def normalize_filename(filename):
+    """Maps a generated filename onto the files the build accepts, or None to skip it."""
+    if not filename:
+        return None
+    if filename in ["main.dart", "pubspec.yaml"]:
+        return filename
+    if "main.dart" in filename:
+        return "main.dart"
+    if "pubspec.yaml" in filename:
+        return "pubspec.yaml"
+    if filename.startswith("assets/"):
+        return filename
+    return None
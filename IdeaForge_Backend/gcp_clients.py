@@ -0,0 +1,111 @@
+import threading
+
+# Process-wide GCP credentials and API clients, created lazily on first use.
+# All clients built from one key share a single credentials object, so the access
+# token is fetched once and refreshed in place by the client transports when it
+# expires, and each client keeps its gRPC channel / HTTP pool open between calls.
+#
+# key_path selects a service-account JSON file; None uses Application Default Credentials.
+# The google-cloud SDKs are imported inside the getters: they are slow to import and
+# most requests to a freshly started server never touch them.
+
+_lock = threading.Lock()
+_credentials = {}
+_cloud_build_clients = {}
+_storage_clients = {}
+_firestore_clients = {}
+
+
+def get_credentials(key_path: str = None):
+    """Returns cached credentials for key_path, or None if they cannot be loaded (retried on the next call)."""
+    credentials = _credentials.get(key_path)
+    if credentials is not None:
+        return credentials
+    with _lock:
+        credentials = _credentials.get(key_path)
+        if credentials is None:
+            try:
+                if key_path:
+                    from google.oauth2 import service_account
+                    credentials = service_account.Credentials.from_service_account_file(key_path)
+                else:
+                    import google.auth
+                    credentials, _ = google.auth.default()
+            except Exception as e:
+                print(f"Error loading GCP credentials: {e}")
+                return None
+            _credentials[key_path] = credentials
+    return credentials
+
+
+def get_cloud_build_client(key_path: str = None):
+    client = _cloud_build_clients.get(key_path)
+    if client is not None:
+        return client
+    credentials = get_credentials(key_path)
+    if credentials is None:
+        return None
+    with _lock:
+        client = _cloud_build_clients.get(key_path)
+        if client is None:
+            from google.cloud.devtools.cloudbuild_v1.services import cloud_build
+            client = cloud_build.CloudBuildClient(credentials=credentials)
+            _cloud_build_clients[key_path] = client
+    return client
+
+
+def create_cloud_build_async_client(key_path: str = None):
+    """
+    A CloudBuildAsyncClient for the running event loop. Its gRPC channel belongs to that
+    loop, so the caller keeps the client instead of it being cached here.
+    """
+    credentials = get_credentials(key_path)
+    if credentials is None:
+        return None
+    from google.cloud.devtools.cloudbuild_v1.services import cloud_build
+    return cloud_build.CloudBuildAsyncClient(credentials=credentials)
+
+
+def get_storage_client(key_path: str = None):
+    client = _storage_clients.get(key_path)
+    if client is not None:
+        return client
+    credentials = get_credentials(key_path)
+    if credentials is None:
+        return None
+    with _lock:
+        client = _storage_clients.get(key_path)
+        if client is None:
+            from google.cloud import storage
+            client = storage.Client(credentials=credentials)
+            _storage_clients[key_path] = client
+    return client
+
+
+def get_firestore_client(key_path: str = None, project_id: str = None):
+    client = _firestore_clients.get((key_path, project_id))
+    if client is not None:
+        return client
+    credentials = get_credentials(key_path)
+    if credentials is None:
+        return None
+    with _lock:
+        client = _firestore_clients.get((key_path, project_id))
+        if client is None:
+            from google.cloud import firestore
+            client = firestore.Client(project=project_id, credentials=credentials)
+            _firestore_clients[(key_path, project_id)] = client
+    return client
+
+
+def set_clients(key_path: str, credentials, cloud_build_client=None, storage_client=None):
+    """
+    Installs ready-made credentials and clients for key_path, bypassing the SDKs; the
+    offline load harness uses it to put local stand-ins behind the real code paths.
+    """
+    with _lock:
+        _credentials[key_path] = credentials
+        if cloud_build_client is not None:
+            _cloud_build_clients[key_path] = cloud_build_client
+        if storage_client is not None:
+            _storage_clients[key_path] = storage_client
@@ -0,0 +1,441 @@
+import asyncio
+import hashlib
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import metrics
+import tracing
+
+# Long-lived local mirror of the generated-app repository plus a pool of reusable
+# worktrees. Each push starts from an incrementally fetched mirror instead of a
+# fresh clone, so per-request clone time and network transfer drop to near zero.
+
+GIT_CACHE_DIR = os.getenv("IDEAFORGE_GIT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ideaforge_git"))
+WORKTREE_POOL_SIZE = int(os.getenv("IDEAFORGE_WORKTREE_POOL_SIZE", "4"))
+# Requests arriving within this window reuse the last fetch instead of fetching again
+FETCH_INTERVAL_SECONDS = float(os.getenv("IDEAFORGE_GIT_FETCH_INTERVAL_SECONDS", "10"))
+WORKTREE_WAIT_SECONDS = float(os.getenv("IDEAFORGE_WORKTREE_WAIT_SECONDS", "120"))
+# "plumbing" builds commits directly in the mirror's object store; "worktree" checks files out
+GIT_COMMIT_MODE = os.getenv("IDEAFORGE_GIT_COMMIT_MODE", "plumbing")
+GIT_AUTHOR_NAME = os.getenv("IDEAFORGE_GIT_AUTHOR_NAME", "Idea Forge")
+GIT_AUTHOR_EMAIL = os.getenv("IDEAFORGE_GIT_AUTHOR_EMAIL", "ideaforge@users.noreply.github.com")
+# Each fast-import writes its own ref under this prefix (a shared ref fails on the ref lock), deleted after the push
+STAGING_REF_PREFIX = "refs/ideaforge/imports/"
+# Every generation job pushes to its own branch so concurrent jobs never overwrite each other
+BUILD_BRANCH_PREFIX = "ideaforge/builds/"
+BUILD_BRANCH_TTL_SECONDS = int(os.getenv("IDEAFORGE_BUILD_BRANCH_TTL_SECONDS", str(6 * 3600)))
+BRANCH_PRUNE_INTERVAL_SECONDS = int(os.getenv("IDEAFORGE_BRANCH_PRUNE_INTERVAL_SECONDS", "600"))
+
+
+def run_git(args: list, cwd: str = None) -> subprocess.CompletedProcess:
+    # Only the subcommand is recorded: other arguments can carry credentials
+    with tracing.span(f"git {args[0]}"):
+        return subprocess.run(["git"] + args, cwd=cwd, check=True, capture_output=True, text=True)
+
+
+async def run_git_async(args: list, cwd: str = None, input: bytes = None) -> subprocess.CompletedProcess:
+    """run_git() for asyncio callers: the subprocess is awaited, not waited on by a thread."""
+    with tracing.span(f"git {args[0]}") as span:
+        process = await asyncio.create_subprocess_exec(
+            "git", *args, cwd=cwd, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = await process.communicate(input)
+        if span is not None and process.returncode:
+            span.record_error(f"exit status {process.returncode}")
+    stdout = stdout.decode("utf-8", errors="replace")
+    stderr = stderr.decode("utf-8", errors="replace")
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, ["git"] + args, stdout, stderr)
+    return subprocess.CompletedProcess(["git"] + args, process.returncode, stdout, stderr)
+
+
+def parse_ls_tree(output: str) -> dict:
+    """Parses `git ls-tree -r -z` output into {path: (mode, object_id)}."""
+    entries = {}
+    for record in output.split("\0"):
+        if not record:
+            continue
+        meta, path = record.split("\t", 1)
+        mode, _, object_id = meta.split(" ")
+        entries[path] = (mode, object_id)
+    return entries
+
+
+def build_branch_name(job_id: str) -> str:
+    return f"{BUILD_BRANCH_PREFIX}{job_id}"
+
+
+def new_staging_ref() -> str:
+    return f"{STAGING_REF_PREFIX}{uuid.uuid4().hex}"
+
+
+def git_blob_sha(content: bytes) -> str:
+    """The object id git assigns to a blob, computed without forking git."""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class GitMirror:
+    """
+    A bare mirror of one remote with remote-tracking refs under refs/remotes/origin,
+    and up to pool_size detached worktrees handed out one request at a time.
+    """
+
+    BASE_REF = "refs/remotes/origin/HEAD"
+
+    def __init__(self, remote_url: str, root_dir: str, pool_size: int = WORKTREE_POOL_SIZE):
+        self.remote_url = remote_url
+        self.root_dir = root_dir
+        self.mirror_dir = os.path.join(root_dir, "mirror.git")
+        self._pool_size = pool_size
+        self._free_worktrees = queue.Queue()
+        self._created_worktrees = 0
+        self._worktree_serial = 0  # names are never reused, even after a broken worktree is dropped
+        self._pool_lock = threading.Lock()
+        # Serializes mirror set-up, fetches and branch deletions, from threads and the event loop alike
+        self._fetch_lock = threading.Lock()
+        self._last_fetch = 0.0
+        self._prune_lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def ensure_mirror(self):
+        if os.path.exists(os.path.join(self.mirror_dir, "HEAD")):
+            return
+        os.makedirs(self.root_dir, exist_ok=True)
+        run_git(["init", "--bare", self.mirror_dir])
+        run_git(["remote", "add", "origin", self.remote_url], cwd=self.mirror_dir)
+        run_git(["config", "remote.origin.fetch", "+refs/heads/*:refs/remotes/origin/*"], cwd=self.mirror_dir)
+        # Worktrees are long-lived and created by this process, never pruned by gc
+        run_git(["config", "gc.worktreePruneExpire", "never"], cwd=self.mirror_dir)
+
+    @metrics.timed("git_fetch")
+    def fetch(self, force: bool = False):
+        """Incrementally fetches the remote, at most once per FETCH_INTERVAL_SECONDS unless forced."""
+        with self._fetch_lock:
+            self.ensure_mirror()
+            if not force and time.monotonic() - self._last_fetch < FETCH_INTERVAL_SECONDS:
+                return
+            started = time.monotonic()
+            run_git(["fetch", "--prune", "origin"], cwd=self.mirror_dir)
+            run_git(["remote", "set-head", "origin", "--auto"], cwd=self.mirror_dir)
+            self._last_fetch = time.monotonic()
+            print(f"Fetched git mirror in {(self._last_fetch - started) * 1000:.0f} ms")
+
+    def default_branch(self) -> str:
+        ref = run_git(["symbolic-ref", "refs/remotes/origin/HEAD"], cwd=self.mirror_dir).stdout.strip()
+        return ref[len("refs/remotes/origin/"):]
+
+    def list_tree(self, ref: str):
+        """Returns {path: (mode, object_id)} for every file at ref, or None if ref does not exist."""
+        try:
+            return parse_ls_tree(run_git(["ls-tree", "-r", "-z", ref], cwd=self.mirror_dir).stdout)
+        except subprocess.CalledProcessError:
+            return None
+
+    @metrics.timed("git_push")
+    def commit_files(self, files: dict, message: str, branch: str = None, replace_tree: bool = False,
+                     keep_paths: tuple = (), force: bool = True):
+        """
+        Commits files ({repo path: content}) on top of the default branch without a working tree
+        and pushes the commit to branch (default: the default branch). Blobs, tree and commit are written by a single
+        git fast-import; the push sends only the new objects.
+        With replace_tree, the commit contains only files plus keep_paths from the base.
+        Returns the pushed commit SHA, or None when branch already has exactly this content.
+        Unchanged content is detected against the mirror's remote-tracking refs before fetching,
+        so it costs no network round trip; only a differing tree fetches and is compared again.
+        """
+        plan = self._plan_push(files, branch, replace_tree, keep_paths) if self._has_remote_head() else None
+        if plan is None or not plan[3]:
+            self.fetch()
+            plan = self._plan_push(files, branch, replace_tree, keep_paths)
+        encoded, desired, branch, unchanged = plan
+        if unchanged:
+            print(f"No changes to push to {branch}.")
+            return None
+
+        staging_ref = new_staging_ref()
+        try:
+            commit_sha = self._fast_import(encoded, message, self.BASE_REF, replace_tree, desired, staging_ref)
+            run_git(self._push_args(commit_sha, branch, force), cwd=self.mirror_dir)
+        finally:
+            self._delete_ref(staging_ref)
+        print(f"Pushed {commit_sha[:12]} to {branch}")
+        return commit_sha
+
+    @metrics.timed("git_push")
+    async def commit_files_async(self, files: dict, message: str, branch: str = None, replace_tree: bool = False,
+                                 keep_paths: tuple = (), force: bool = True):
+        """commit_files() with every git subprocess awaited on the event loop."""
+        plan = await self._plan_push_async(files, branch, replace_tree, keep_paths) if self._has_remote_head() else None
+        if plan is None or not plan[3]:
+            await self.fetch_async()
+            plan = await self._plan_push_async(files, branch, replace_tree, keep_paths)
+        encoded, desired, branch, unchanged = plan
+        if unchanged:
+            print(f"No changes to push to {branch}.")
+            return None
+
+        staging_ref = new_staging_ref()
+        marks_fd, marks_path = tempfile.mkstemp(prefix="ideaforge_marks_")
+        os.close(marks_fd)
+        try:
+            await run_git_async(["fast-import", "--quiet", "--force", f"--export-marks={marks_path}"], cwd=self.mirror_dir,
+                                input=self._fast_import_stream(encoded, message, self.BASE_REF, replace_tree, desired,
+                                                               staging_ref))
+            with open(marks_path, "r") as f:
+                commit_sha = f.read().split()[1]
+            await run_git_async(self._push_args(commit_sha, branch, force), cwd=self.mirror_dir)
+        finally:
+            os.remove(marks_path)
+            try:
+                await run_git_async(["update-ref", "-d", staging_ref], cwd=self.mirror_dir)
+            except subprocess.CalledProcessError as e:
+                print(f"Failed to delete {staging_ref}: {e.stderr}")
+        print(f"Pushed {commit_sha[:12]} to {branch}")
+        return commit_sha
+
+    async def fetch_async(self, force: bool = False):
+        """
+        fetch() on a worker thread, so set-up and fetches share one path and one lock with
+        the threaded callers. Fetches are throttled, so this rarely holds a thread for long.
+        """
+        await asyncio.to_thread(self.fetch, force)
+
+    def _has_remote_head(self) -> bool:
+        """True once a fetch has recorded the remote's default branch in the mirror."""
+        return os.path.exists(os.path.join(self.mirror_dir, "refs", "remotes", "origin", "HEAD"))
+
+    def _plan_push(self, files: dict, branch: str, replace_tree: bool, keep_paths: tuple):
+        """
+        Returns (encoded files, desired tree, branch, unchanged) from the mirror's
+        remote-tracking refs as they stand, without fetching.
+        """
+        base_entries = self.list_tree(self.BASE_REF) or {}
+        encoded, desired = self._plan_commit(files, base_entries, replace_tree, keep_paths)
+        default_branch = self.default_branch()
+        branch = branch or default_branch
+        current = base_entries if branch == default_branch else self.list_tree(f"refs/remotes/origin/{branch}")
+        return encoded, desired, branch, current == desired
+
+    async def _plan_push_async(self, files: dict, branch: str, replace_tree: bool, keep_paths: tuple):
+        base_entries = await self._list_tree_async(self.BASE_REF) or {}
+        encoded, desired = self._plan_commit(files, base_entries, replace_tree, keep_paths)
+        ref = (await run_git_async(["symbolic-ref", "refs/remotes/origin/HEAD"], cwd=self.mirror_dir)).stdout.strip()
+        default_branch = ref[len("refs/remotes/origin/"):]
+        branch = branch or default_branch
+        current = base_entries if branch == default_branch else await self._list_tree_async(f"refs/remotes/origin/{branch}")
+        return encoded, desired, branch, current == desired
+
+    async def _list_tree_async(self, ref: str):
+        try:
+            return parse_ls_tree((await run_git_async(["ls-tree", "-r", "-z", ref], cwd=self.mirror_dir)).stdout)
+        except subprocess.CalledProcessError:
+            return None
+
+    @staticmethod
+    def _plan_commit(files: dict, base_entries: dict, replace_tree: bool, keep_paths: tuple):
+        """Returns (encoded files, desired tree {path: (mode, object_id)}) for a commit on base_entries."""
+        if replace_tree:
+            desired = {path: base_entries[path] for path in keep_paths if path in base_entries}
+        else:
+            desired = dict(base_entries)
+        encoded = {path: content.encode("utf-8") for path, content in files.items()}
+        for path, data in encoded.items():
+            desired[path] = ("100644", git_blob_sha(data))
+        return encoded, desired
+
+    @staticmethod
+    def _push_args(commit_sha: str, branch: str, force: bool) -> list:
+        return ["push"] + (["--force"] if force else []) + ["origin", f"{commit_sha}:refs/heads/{branch}"]
+
+    def delete_branches(self, branches: list):
+        """Deletes remote branches in one push. Failures are logged, never raised."""
+        if not branches:
+            return
+        try:
+            # Updates the same remote-tracking refs a concurrent fetch --prune rewrites
+            with self._fetch_lock:
+                run_git(["push", "origin", "--delete"] + list(branches), cwd=self.mirror_dir)
+            print(f"Deleted remote branches: {', '.join(branches)}")
+        except subprocess.CalledProcessError as e:
+            print(f"Failed to delete remote branches {branches}: {e.stderr}")
+
+    def prune_stale_branches(self, prefix: str = BUILD_BRANCH_PREFIX, max_age_seconds: int = BUILD_BRANCH_TTL_SECONDS):
+        """
+        Deletes per-job branches whose commit is older than max_age_seconds, in case the
+        normal cleanup after a finished build never ran. Runs at most once per
+        BRANCH_PRUNE_INTERVAL_SECONDS; call it from a background thread.
+        """
+        with self._prune_lock:
+            if time.monotonic() - self._last_prune < BRANCH_PRUNE_INTERVAL_SECONDS:
+                return
+            self._last_prune = time.monotonic()
+        try:
+            output = run_git(["for-each-ref", "--format=%(committerdate:unix) %(refname)",
+                              f"refs/remotes/origin/{prefix}"], cwd=self.mirror_dir).stdout
+        except subprocess.CalledProcessError as e:
+            print(f"Failed to list build branches: {e.stderr}")
+            return
+        cutoff = time.time() - max_age_seconds
+        stale = []
+        for line in output.splitlines():
+            timestamp, refname = line.split(" ", 1)
+            if int(timestamp) < cutoff:
+                stale.append(refname[len("refs/remotes/origin/"):])
+        self.delete_branches(stale)
+
+    def _delete_ref(self, ref: str):
+        """Drops a staging ref once its commit is pushed; a leftover ref only costs disk space."""
+        try:
+            run_git(["update-ref", "-d", ref], cwd=self.mirror_dir)
+        except subprocess.CalledProcessError as e:
+            print(f"Failed to delete {ref}: {e.stderr}")
+
+    def _fast_import(self, encoded: dict, message: str, base_ref: str, replace_tree: bool, desired: dict,
+                     staging_ref: str) -> str:
+        marks_fd, marks_path = tempfile.mkstemp(prefix="ideaforge_marks_")
+        os.close(marks_fd)
+        try:
+            # --force: the commit does not descend from whatever staging_ref held; commits are pushed by SHA
+            with tracing.span("git fast-import", files=len(encoded)):
+                subprocess.run(["git", "fast-import", "--quiet", "--force", f"--export-marks={marks_path}"],
+                               cwd=self.mirror_dir,
+                               input=self._fast_import_stream(encoded, message, base_ref, replace_tree, desired, staging_ref),
+                               check=True, capture_output=True)
+            with open(marks_path, "r") as f:
+                return f.read().split()[1]
+        except subprocess.CalledProcessError as e:
+            e.stderr = e.stderr.decode("utf-8", errors="replace")  # Match run_git's text output
+            raise
+        finally:
+            os.remove(marks_path)
+
+    @staticmethod
+    def _fast_import_stream(encoded: dict, message: str, base_ref: str, replace_tree: bool, desired: dict,
+                            staging_ref: str) -> bytes:
+        message_bytes = message.encode("utf-8")
+        identity = f"{GIT_AUTHOR_NAME} <{GIT_AUTHOR_EMAIL}> {int(time.time())} +0000".encode("utf-8")
+        stream = [
+            f"commit {staging_ref}\n".encode("utf-8"),
+            b"mark :1\n",
+            b"author " + identity + b"\n",
+            b"committer " + identity + b"\n",
+            b"data %d\n" % len(message_bytes), message_bytes, b"\n",
+            f"from {base_ref}\n".encode("utf-8"),
+        ]
+        if replace_tree:
+            stream.append(b"deleteall\n")
+            for path, (mode, object_id) in desired.items():
+                if path not in encoded:
+                    stream.append(f"M {mode} {object_id} {path}\n".encode("utf-8"))
+        for path, data in encoded.items():
+            stream.append(f"M 100644 inline {path}\n".encode("utf-8"))
+            stream.append(b"data %d\n" % len(data))
+            stream.append(data + b"\n")
+        return b"".join(stream)
+
+    @contextmanager
+    def worktree(self):
+        """
+        Yields the path of a clean worktree detached at the freshly fetched default branch.
+        The worktree goes back to the pool afterwards; a worktree that fails to reset is rebuilt,
+        and one that cannot be rebuilt, or whose reset fails any other way, is dropped from the pool.
+        """
+        self.fetch()
+        path = self._acquire()
+        try:
+            self._reset(path)
+        except subprocess.CalledProcessError as e:
+            print(f"Rebuilding worktree {path} after failed reset: {e.stderr}")
+            try:
+                self._remove(path)
+                self._add(path)
+            except Exception:
+                self._drop(path)
+                raise
+        except BaseException:
+            # Timeouts, OS errors: the slot is in an unknown state and must not leak from the pool
+            self._drop(path)
+            raise
+        try:
+            yield path
+        finally:
+            # Left dirty by the caller is fine: the next user resets it
+            self._free_worktrees.put(path)
+
+    def _acquire(self) -> str:
+        deadline = time.monotonic() + WORKTREE_WAIT_SECONDS
+        while True:
+            try:
+                return self._free_worktrees.get_nowait()
+            except queue.Empty:
+                pass
+            with self._pool_lock:
+                if self._created_worktrees < self._pool_size:
+                    self._created_worktrees += 1
+                    self._worktree_serial += 1
+                    path = os.path.join(self.root_dir, f"worktree-{self._worktree_serial}")
+                    try:
+                        self._add(path)
+                    except Exception:
+                        self._created_worktrees -= 1
+                        raise
+                    return path
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError("Timed out waiting for a free git worktree")
+            # Wake up now and then: a dropped worktree frees capacity without anything being queued
+            try:
+                return self._free_worktrees.get(timeout=min(remaining, 1.0))
+            except queue.Empty:
+                pass
+
+    def _drop(self, path: str):
+        """Takes a worktree that could not be rebuilt out of the pool, freeing its slot."""
+        print(f"Dropping broken worktree {path}")
+        with self._pool_lock:
+            self._created_worktrees -= 1
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            run_git(["worktree", "prune"], cwd=self.mirror_dir)
+        except subprocess.CalledProcessError as e:
+            print(f"Failed to prune worktrees: {e.stderr}")
+
+    def _add(self, path: str):
+        if os.path.exists(path):
+            self._remove(path)
+        run_git(["worktree", "add", "--detach", "--force", path, "origin/HEAD"], cwd=self.mirror_dir)
+
+    def _remove(self, path: str):
+        try:
+            run_git(["worktree", "remove", "--force", path], cwd=self.mirror_dir)
+        except subprocess.CalledProcessError:
+            shutil.rmtree(path, ignore_errors=True)
+            run_git(["worktree", "prune"], cwd=self.mirror_dir)
+
+    def _reset(self, path: str):
+        run_git(["checkout", "--detach", "--force", "origin/HEAD"], cwd=path)
+        run_git(["reset", "--hard", "origin/HEAD"], cwd=path)
+        run_git(["clean", "-ffdx"], cwd=path)
+
+
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_git_mirror(remote_url: str) -> GitMirror:
+    """Returns the process-wide mirror for remote_url (which may embed credentials)."""
+    with _mirrors_lock:
+        mirror = _mirrors.get(remote_url)
+        if mirror is None:
+            # Hash the URL so credentials never appear in directory names
+            key = hashlib.sha256(remote_url.encode("utf-8")).hexdigest()[:16]
+            mirror = GitMirror(remote_url, os.path.join(GIT_CACHE_DIR, key))
+            _mirrors[remote_url] = mirror
+        return mirror
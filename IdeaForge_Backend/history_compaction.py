@@ -0,0 +1,108 @@
+import os
+import re
+
+from code_stream import IncrementalCodeParser
+
+# Shrinks conversation history before it is sent back to Claude. Every assistant turn
+# is a complete app (up to ~4k tokens of main.dart), so resending raw history makes
+# each refinement more expensive than the last. In "compact" mode only the newest
+# version of each generated file is sent, once, in place of the latest reply; earlier
+# replies become one-line references and the user's instructions are kept as written.
+# Code blocks without a file name (snippets, commands) are never superseded, so they
+# are kept whole in every turn, including after the files of the same reply.
+
+HISTORY_MODE = os.getenv("CLAUDE_HISTORY_MODE", "compact")  # "compact" or "full"
+# Prose of other replies and user instructions in older turns is truncated to this
+MAX_HISTORY_TEXT_CHARS = int(os.getenv("CLAUDE_HISTORY_MAX_TEXT_CHARS", "2000"))
+
+_FENCE_LANGUAGES = {".dart": "dart", ".yaml": "yaml", ".yml": "yaml", ".json": "json"}
+_FENCED_BLOCK = re.compile(r"^[ \t]*```.*?^[ \t]*```[ \t]*$", re.MULTILINE | re.DOTALL)
+
+
+def extract_files(text: str) -> dict:
+    return _parse(text).files
+
+
+def _parse(text: str) -> IncrementalCodeParser:
+    parser = IncrementalCodeParser()
+    parser.feed(text)
+    parser.close()
+    return parser
+
+
+def render_files(files: dict) -> str:
+    """Formats files the way the system prompts ask Claude to answer."""
+    blocks = []
+    for filename in sorted(files, key=lambda name: (name != "main.dart", name)):
+        language = _FENCE_LANGUAGES.get(os.path.splitext(filename)[1], "")
+        blocks.append(f"FILENAME: {filename}\n```{language}\n{files[filename]}\n```")
+    return "\n\n".join(blocks)
+
+
+def _truncate(text: str) -> str:
+    """Cuts the prose of text to MAX_HISTORY_TEXT_CHARS; fenced code blocks are kept whole."""
+    if len(text) <= MAX_HISTORY_TEXT_CHARS:
+        return text
+    pieces = []
+    budget = MAX_HISTORY_TEXT_CHARS
+    position = 0
+    for match in list(_FENCED_BLOCK.finditer(text)) + [None]:
+        prose = text[position:match.start() if match else len(text)]
+        if len(prose) > budget:
+            prose = prose[:budget] + "\n[truncated]\n"
+        budget = max(0, budget - len(prose))
+        pieces.append(prose)
+        if match:
+            pieces.append(match.group())
+            position = match.end()
+    return "".join(pieces).rstrip("\n")
+
+
+def compact_messages(messages: list, mode: str = HISTORY_MODE) -> list:
+    """
+    Returns the history to send. In compact mode the last assistant message that contained
+    code carries the latest version of every file generated so far, and older code replies
+    are replaced by references naming the files they contained. messages is not modified.
+    """
+    if mode != "compact" or len(messages) < 2:
+        return messages
+
+    parsed_by_index = {
+        i: _parse(m["content"])
+        for i, m in enumerate(messages)
+        if m["role"] == "assistant" and isinstance(m["content"], str)
+    }
+    last_code_reply = max((i for i, parsed in parsed_by_index.items() if parsed.files), default=None)
+    latest_files = {}
+    compacted = []
+    for i, message in enumerate(messages):
+        content = message["content"]
+        parsed = parsed_by_index.get(i)
+        if parsed and parsed.files:
+            latest_files.update(parsed.files)
+            if i == last_code_reply:
+                content = render_files(latest_files)
+            else:
+                content = f"[Code for {', '.join(sorted(parsed.files))} omitted; superseded by a later version in this conversation.]"
+            # Unnamed blocks of a code reply are not part of any file, so they follow it whole
+            content = "\n\n".join([content] + parsed.snippets)
+        elif isinstance(content, str) and i < len(messages) - 1:
+            # Older instructions and non-code replies; the new prompt is always sent in full
+            content = _truncate(content)
+        compacted.append({"role": message["role"], "content": content})
+    return compacted
+
+
+def stable_prefix_length(messages: list, mode: str = HISTORY_MODE) -> int:
+    """
+    Number of leading history messages that will be sent unchanged on the next turn,
+    i.e. the prefix worth marking for prompt caching. In compact mode the reply holding
+    the latest file set becomes a reference next turn, so the prefix ends before it.
+    """
+    if mode != "compact":
+        return len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        content = messages[i]["content"]
+        if messages[i]["role"] == "assistant" and isinstance(content, str) and content.startswith("FILENAME: "):
+            return i
+    return len(messages)
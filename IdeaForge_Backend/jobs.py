@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+# Job lifecycle states
+JOB_QUEUED = "QUEUED"
+JOB_RUNNING = "RUNNING"
+JOB_SUCCEEDED = "SUCCEEDED"
+JOB_FAILED = "FAILED"
+TERMINAL_JOB_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+# Pipeline stages reported while a generation job runs
+JOB_STAGES = ["generate", "parse", "push", "build_queued", "build", "artifact"]
+
+JOB_WORKERS = int(os.getenv("IDEAFORGE_JOB_WORKERS", "8"))
+JOB_RETENTION_SECONDS = int(os.getenv("IDEAFORGE_JOB_RETENTION_SECONDS", "3600"))
+
+
+class Job:
+    """State of a single background job. Mutated only through JobEngine."""
+
+    def __init__(self, job_id: str, user_id: str = None):
+        self.id = job_id
+        self.user_id = user_id
+        self.status = JOB_QUEUED
+        self.stage = None
+        self.message = "Job queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.dedupe_key = None
+        self.callbacks = []
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "message": self.message,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobEngine:
+    """
+    Runs long pipelines (Claude call, git push, Cloud Build polling) on a
+    bounded thread pool so request handlers can return as soon as a job is queued.
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS, retention_seconds: int = JOB_RETENTION_SECONDS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ideaforge-job")
+        self._jobs = {}
+        self._active_by_key = {}  # dedupe_key -> queued/running Job
+        self._lock = threading.Lock()
+        self._retention_seconds = retention_seconds
+
+    def submit(self, fn, *args, user_id: str = None, **kwargs) -> Job:
+        """
+        Queue fn(job, *args, **kwargs). fn reports progress with set_stage() and
+        returns the job result dict; raising JobError (or any exception) fails the job.
+        """
+        job = Job(str(uuid.uuid4()), user_id=user_id)
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        self._executor.submit(tracing.bind(self._run), job, fn, args, kwargs)
+        return job
+
+    def submit_or_attach(self, fn, *args, dedupe_key: str, user_id: str = None, **kwargs):
+        """
+        Like submit(), but returns (job, attached): while a job with the same dedupe_key is
+        queued or running, that job is returned with attached=True instead of starting another.
+        """
+        with self._lock:
+            job = self._active_by_key.get(dedupe_key)
+            if job is not None:
+                print(f"Job {job.id}: attached identical request from {user_id}")
+                return job, True
+            self._prune_locked()
+            job = Job(str(uuid.uuid4()), user_id=user_id)
+            job.dedupe_key = dedupe_key
+            self._jobs[job.id] = job
+            self._active_by_key[dedupe_key] = job
+        self._executor.submit(tracing.bind(self._run), job, fn, args, kwargs)
+        return job, False
+
+    def add_done_callback(self, job: Job, callback):
+        """Calls callback(job) once the job has finished, immediately if it already has."""
+        with self._lock:
+            if job.status not in TERMINAL_JOB_STATES:
+                job.callbacks.append(callback)
+                return
+        callback(job)
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def set_stage(self, job: Job, stage: str, message: str = None):
+        with self._lock:
+            job.stage = stage
+            job.message = message or f"Running stage: {stage}"
+            job.updated_at = time.time()
+        print(f"Job {job.id}: stage={stage} {job.message}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_status = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            return {"jobs": by_status, "coalescing": len(self._active_by_key)}
+
+    def _run(self, job: Job, fn, args, kwargs):
+        with self._lock:
+            job.status = JOB_RUNNING
+            job.updated_at = time.time()
+        try:
+            # Child of the submitting request's span, so the pipeline shows up in its trace
+            with tracing.span("job", job_id=job.id):
+                result = fn(job, *args, **kwargs)
+            with self._lock:
+                job.status = JOB_SUCCEEDED
+                job.result = result
+                job.message = "Job completed"
+                job.updated_at = time.time()
+        except JobError as e:
+            self._fail(job, str(e), e.details)
+        except Exception as e:
+            self._fail(job, f"Unexpected error: {e}", None)
+        with self._lock:
+            if job.dedupe_key is not None:
+                self._active_by_key.pop(job.dedupe_key, None)
+            callbacks, job.callbacks = job.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                print(f"Job {job.id}: completion callback failed: {e}")
+
+    def _fail(self, job: Job, error: str, details):
+        print(f"Job {job.id} failed at stage {job.stage}: {error}")
+        with self._lock:
+            job.status = JOB_FAILED
+            job.error = error
+            job.result = details
+            job.message = "Job failed"
+            job.updated_at = time.time()
+
+    def _prune_locked(self):
+        cutoff = time.time() - self._retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status in TERMINAL_JOB_STATES and job.updated_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class JobError(Exception):
+    """Raised by a job function to fail the job with a client-facing error and optional details."""
+
+    def __init__(self, message: str, details: dict = None):
+        super().__init__(message)
+        self.details = details
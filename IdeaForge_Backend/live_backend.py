@@ -5,27 +5,35 @@ import time
 import random
 import subprocess
 import shutil
-import uuid # For unique temporary directory names
-import tempfile
+import threading
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
-from google.cloud import storage
-from google.cloud.devtools.cloudbuild_v1.services import cloud_build
-from google.cloud.devtools.cloudbuild_v1.types import Build, RepoSource, StorageSource, Source
-from google.oauth2 import service_account # For GCP authentication
-from google.auth import default
+import claude_client
+import gcp_clients
+import metrics
+import tracing
 import re
 from pathlib import Path
+from jobs import JobEngine, JobError
+from git_mirror import GIT_COMMIT_MODE, build_branch_name, get_git_mirror, run_git
+from artifact_cache import get_artifact_cache, hash_generated_files, resolve_cached_artifact
+from build_events import apk_blob_from_build_resource
+from session_store import get_session_store
+from history_compaction import compact_messages, stable_prefix_length
+from single_flight import make_request_key
+from build_scheduler import PRIORITY_INTERACTIVE, get_build_scheduler
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
+metrics.instrument_flask(app)
+tracing.instrument_flask(app)
 
 # Claude API Configuration
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 CLAUDE_MODEL = "claude-3.7-sonnet"
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+ANTHROPIC_API_URL = os.getenv("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
 
 # GitHub Configuration
 GITHUB_PAT = os.getenv("GITHUB_PAT")
@@ -36,21 +44,25 @@ GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID")
 GCP_SERVICE_ACCOUNT_KEY_PATH = os.getenv("GCP_SERVICE_ACCOUNT_KEY_PATH")
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
 
+# Background workers for the generate -> build pipeline
+job_engine = JobEngine()
+metrics.register_stats("ideaforge_jobs", job_engine.stats, label="status")
+# How often a job waiting for build capacity refreshes its queue position
+BUILD_QUEUE_STAGE_INTERVAL_SECONDS = 5
+
 # --- Helper: GCP Credentials ---
 def get_gcp_credentials():
-    credentials, project = default()
-    return credentials
+    # Application Default Credentials, loaded once per process and shared by every GCP client
+    return gcp_clients.get_credentials()
 
 # --- Helper: Claude API Call (existing, slightly modified for clarity) ---
-conversation_history = {}
-def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None):
+def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None, use_cache: bool = True):
     # ... (Keep existing Claude API call logic, ensure it returns generated_text clearly)
     if not ANTHROPIC_API_KEY:
         return {"error": "Anthropic API key not configured."}, 500, None
 
-    current_user_history = conversation_history.get(user_id, [])
-    messages_payload = list(current_user_history) # Make a copy
-    messages_payload.append({"role": "user", "content": user_prompt})
+    history = compact_messages(get_session_store().get_messages(user_id))
+    messages_payload = history + [{"role": "user", "content": user_prompt}]
     
     headers = {
         "x-api-key": ANTHROPIC_API_KEY,
@@ -83,19 +95,19 @@ def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None):
         "system": system_prompt if system_prompt else default_system_prompt,
         "temperature": 0.3 
     }
+    claude_client.apply_prompt_caching(payload, stable_prefix_length(history))
     try:
-        response = requests.post(ANTHROPIC_API_URL, headers=headers, json=payload, timeout=180)
-        response.raise_for_status()
-        api_response_json = response.json()
+        api_response_json = claude_client.create_message(ANTHROPIC_API_URL, headers, payload, timeout=180, use_cache=use_cache, user_id=user_id)
         generated_text = ""
         if api_response_json.get("content") and isinstance(api_response_json["content"], list) and len(api_response_json["content"]) > 0:
             generated_text = api_response_json["content"][0].get("text", "")
         
         # Update history
-        current_user_history.append({"role": "user", "content": user_prompt})
-        current_user_history.append({"role": "assistant", "content": generated_text})
-        conversation_history[user_id] = current_user_history[-10:]
+        get_session_store().append_turn(user_id, user_prompt, generated_text)
         return api_response_json, 200, generated_text
+    except claude_client.SchedulerTimeout as e:
+        # Too many calls queued ahead of this one; the client should retry later
+        return {"error": f"Claude API is busy: {e}"}, 503, None
     except requests.exceptions.RequestException as e:
         # ... (existing error handling) ...
         return {"error": f"Error calling Claude API: {e}"}, 500, None
@@ -103,6 +115,8 @@ def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None):
         return {"error": f"An unexpected error occurred: {e}"}, 500, None
 
 # --- Helper: Parse AI Generated Code ---
+@metrics.timed("parse")
+@tracing.traced("parse")
 def parse_generated_code(generated_text: str):
     # Simple parser: assumes main.dart and optionally pubspec.yaml
     # A more robust parser would handle more complex project structures or zipped files.
@@ -194,87 +208,124 @@ flutter:
         }
 
 # --- Helper: Git Operations ---
-def update_github_repository(generated_files: dict, repo_url: str, pat: str, commit_message: str):
+def update_github_repository(generated_files: dict, repo_url: str, pat: str, commit_message: str, branch_name: str):
+    """Pushes generated files to branch_name. Returns (success, message, commit_sha)."""
     if not pat or not repo_url:
-        return False, "GitHub PAT or Repository URL not configured."
+        return False, "GitHub PAT or Repository URL not configured.", None
+    if GIT_COMMIT_MODE == "worktree":
+        return update_github_repository_worktree(generated_files, repo_url, pat, commit_message, branch_name)
     
-    temp_dir = os.path.join(tempfile.gettempdir(), f"ideaforge_repo_{uuid.uuid4()}")
     try:
-        # Clone the repo
         # Construct the authenticated URL
         auth_repo_url = repo_url.replace("https://", f"https://oauth2:{pat}@")
-        subprocess.run(["git", "clone", "--depth=1", auth_repo_url, temp_dir], check=True, capture_output=True, text=True)
-        
-        # Clear existing files (except .git and cloudbuild.yaml)
-        for item in os.listdir(temp_dir):
-            item_path = os.path.join(temp_dir, item)
-            if item == ".git" or item == "cloudbuild.yaml":
-                continue
-            if os.path.isfile(item_path) or os.path.islink(item_path):
-                os.unlink(item_path)
-            elif os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-        
-        # Create lib directory if it doesn_t exist for main.dart
-        lib_dir = os.path.join(temp_dir, "lib")
-        if not os.path.exists(lib_dir):
-            os.makedirs(lib_dir)
-
-        # Write new files
+        mirror = get_git_mirror(auth_repo_url)
+        repo_files = {}
         for filename, content in generated_files.items():
-            file_path = ""
             if filename == "main.dart":
-                file_path = os.path.join(lib_dir, filename)
+                repo_files["lib/main.dart"] = content
             else: # pubspec.yaml
-                file_path = os.path.join(temp_dir, filename)
-            with open(file_path, "w") as f:
-                f.write(content)
+                repo_files[filename] = content
         
-        # Git commit and push
-        subprocess.run(["git", "add", "."], cwd=temp_dir, check=True, capture_output=True, text=True)
-        # Check if there are changes to commit
-        status_result = subprocess.run(["git", "status", "--porcelain"], cwd=temp_dir, check=True, capture_output=True, text=True)
-        if not status_result.stdout.strip():
-            print("No changes to commit.")
-            # If no changes, we can assume the build doesn_t need to run, or handle as needed
-            # For now, let_s proceed as if a build is still desired if code was generated.
-        else:
-            subprocess.run(["git", "commit", "-m", commit_message], cwd=temp_dir, check=True, capture_output=True, text=True)
-        subprocess.run(["git", "push"], cwd=temp_dir, check=True, capture_output=True, text=True)
+        # The commit holds only the generated files and cloudbuild.yaml, built without a checkout
+        commit_sha = mirror.commit_files(repo_files, commit_message, branch_name, replace_tree=True,
+                                         keep_paths=("cloudbuild.yaml",))
+        threading.Thread(target=tracing.bind(mirror.prune_stale_branches), daemon=True).start()
+        return True, "Successfully pushed to GitHub.", commit_sha
+    except subprocess.CalledProcessError as e:
+        error_message = f"Git operation failed: {e.stderr}"
+        print(error_message)
+        return False, error_message, None
+    except Exception as e:
+        error_message = f"Error updating GitHub repository: {e}"
+        print(error_message)
+        return False, error_message, None
+
+def update_github_repository_worktree(generated_files: dict, repo_url: str, pat: str, commit_message: str, branch_name: str):
+    """Fallback commit path (IDEAFORGE_GIT_COMMIT_MODE=worktree): check files out, commit and push."""
+    try:
+        # Construct the authenticated URL
+        auth_repo_url = repo_url.replace("https://", f"https://oauth2:{pat}@")
+        mirror = get_git_mirror(auth_repo_url)
+        # A pooled worktree, reset to a freshly fetched default branch, replaces a full clone
+        with mirror.worktree() as temp_dir:
+            # Clear existing files (except .git and cloudbuild.yaml)
+            for item in os.listdir(temp_dir):
+                item_path = os.path.join(temp_dir, item)
+                if item == ".git" or item == "cloudbuild.yaml":
+                    continue
+                if os.path.isfile(item_path) or os.path.islink(item_path):
+                    os.unlink(item_path)
+                elif os.path.isdir(item_path):
+                    shutil.rmtree(item_path)
+            
+            # Create lib directory if it doesn_t exist for main.dart
+            lib_dir = os.path.join(temp_dir, "lib")
+            if not os.path.exists(lib_dir):
+                os.makedirs(lib_dir)
+
+            # Write new files
+            for filename, content in generated_files.items():
+                file_path = ""
+                if filename == "main.dart":
+                    file_path = os.path.join(lib_dir, filename)
+                else: # pubspec.yaml
+                    file_path = os.path.join(temp_dir, filename)
+                with open(file_path, "w") as f:
+                    f.write(content)
+            
+            # Git commit and push
+            run_git(["add", "."], cwd=temp_dir)
+            # Check if there are changes to commit
+            status_result = run_git(["status", "--porcelain"], cwd=temp_dir)
+            if not status_result.stdout.strip():
+                print("No changes to commit.")
+                # If no changes, we can assume the build doesn_t need to run, or handle as needed
+                # For now, let_s proceed as if a build is still desired if code was generated.
+            else:
+                run_git(["commit", "-m", commit_message], cwd=temp_dir)
+            # Worktrees are detached, so name the branch being updated explicitly
+            run_git(["push", "--force", "origin", f"HEAD:refs/heads/{branch_name}"], cwd=temp_dir)
+            commit_sha = run_git(["rev-parse", "HEAD"], cwd=temp_dir).stdout.strip()
         
-        return True, "Successfully pushed to GitHub."
+        threading.Thread(target=tracing.bind(mirror.prune_stale_branches), daemon=True).start()
+        return True, "Successfully pushed to GitHub.", commit_sha
     except subprocess.CalledProcessError as e:
         error_message = f"Git operation failed: {e.stderr}"
         print(error_message)
-        return False, error_message
+        return False, error_message, None
     except Exception as e:
         error_message = f"Error updating GitHub repository: {e}"
         print(error_message)
-        return False, error_message
-    finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        return False, error_message, None
+
+def delete_build_branch(branch_name: str):
+    mirror = get_git_mirror(GITHUB_REPO_URL.replace("https://", f"https://oauth2:{GITHUB_PAT}@"))
+    mirror.delete_branches([branch_name])
 
 # --- Helper: Google Cloud Build Operations ---
-def trigger_cloud_build(project_id: str, repo_url: str, branch_name: str = "generated-app"):
+@metrics.timed("create_build")
+@tracing.traced("cloud_build.create_build")
+def trigger_cloud_build(project_id: str, repo_url: str, branch_name: str = "generated-app", commit_sha: str = None):
+    """Builds commit_sha when given, so the build cannot pick up a later push; otherwise branch_name."""
+    from google.cloud.devtools.cloudbuild_v1.types import Build, RepoSource, Source
     credentials = get_gcp_credentials()
     if not credentials:
         return None, "Failed to get GCP credentials."
 
-    client = cloud_build.CloudBuildClient(credentials=credentials)
+    client = gcp_clients.get_cloud_build_client()
 
     # Extract repo name from URL
     repo_name = repo_url.split("/")[-1].replace(".git", "")
 
+    repo_source = RepoSource(project_id=project_id, repo_name=repo_name)
+    if commit_sha:
+        repo_source.commit_sha = commit_sha
+    else:
+        repo_source.branch_name = branch_name
+
     # Use Build and RepoSource objects instead of a plain dict
     build = Build(
-        source=Source(
-            repo_source=RepoSource(
-                project_id=project_id,
-                repo_name=repo_name,
-                branch_name=branch_name
-            )
-        )
+        source=Source(repo_source=repo_source)
         # Add more fields as needed
     )
 
@@ -282,49 +333,50 @@ def trigger_cloud_build(project_id: str, repo_url: str, branch_name: str = "gene
         operation = client.create_build(project_id=project_id, build=build)
         print(f"Triggered Cloud Build. Operation: {operation.name}")
         build_id = operation.metadata.build.id
+        tracing.set_attributes(build_id=build_id)
         return build_id, f"Build triggered successfully. Build ID: {build_id}"
     except Exception as e:
         error_message = f"Error triggering Cloud Build: {e}"
         print(error_message)
+        metrics.record_failure("create_build")
+        tracing.record_error(e)
         return None, error_message
 
+@metrics.timed("build_lookup")
+@tracing.traced("cloud_build.get_build")
 def get_cloud_build_status_and_apk_url(project_id: str, build_id: str, gcs_bucket_name: str):
+    """
+    Returns (status, log_url, apk_url, apk_blob_name). apk_blob_name is only set when the
+    APK is this build's own per-commit object, not from the latest-in-bucket fallback.
+    """
+    from google.cloud.devtools.cloudbuild_v1.types import Build
     credentials = get_gcp_credentials()
     if not credentials:
-        return "ERROR", "Failed to get GCP credentials.", None
+        return "ERROR", "Failed to get GCP credentials.", None, None
 
-    client = cloud_build.CloudBuildClient(credentials=credentials)
-    storage_client = storage.Client(credentials=credentials)
+    client = gcp_clients.get_cloud_build_client()
+    storage_client = gcp_clients.get_storage_client()
 
     try:
         build_info = client.get_build(project_id=project_id, id=build_id)
         status = Build.Status(build_info.status).name
         print(f"Build ID {build_id} status: {status}")
+        tracing.set_attributes(build_id=build_id, status=status)
 
         apk_url = None
+        apk_blob_name = None
         if status == "SUCCESS":
-            # Construct the expected APK path based on cloudbuild.yaml
-            # Example: gs://ideaforge-apks-aaron/ideaforge-builds/${SHORT_SHA}_app-release.apk
-            # We need to list objects or know the exact name. For now, let_s assume a convention or find the latest.
-            # This part is tricky without knowing the exact commit SHA used by the build.
-            # A more robust way is to have cloudbuild.yaml output a manifest or a fixed name, or use build tags.
-            
-            # Let_s try to find the artifact from build_info if available
-            if build_info.results and build_info.results.artifacts and build_info.results.artifacts.objects:
-                apk_path_in_gcs = build_info.results.artifacts.objects.location
-                # This location is like gs://bucket/path/to/object
-                # We need to parse it to get bucket and object name
-                if apk_path_in_gcs.startswith(f"gs://{gcs_bucket_name}/"):
-                    blob_name = apk_path_in_gcs[len(f"gs://{gcs_bucket_name}/"):]
-                    bucket = storage_client.bucket(gcs_bucket_name)
-                    blob = bucket.blob(blob_name)
-                    # Generate a signed URL for download (valid for 1 hour)
-                    apk_url = blob.generate_signed_url(version="v4", expiration=3600) # 1 hour
-                    print(f"Generated signed URL for APK: {apk_url}")
-                else:
-                    print(f"Artifact path {apk_path_in_gcs} does not match expected bucket {gcs_bucket_name}")
+            # cloudbuild.yaml copies the APK to gs://<bucket>/ideaforge-builds/${SHORT_SHA}_app-release.apk.
+            # Only that per-commit object is used: the shared artifacts object may be another build's.
+            blob_name = apk_blob_from_build_resource(build_info)
+            blob = storage_client.bucket(gcs_bucket_name).blob(blob_name) if blob_name else None
+            if blob is not None and blob.exists():
+                # Generate a signed URL for download (valid for 1 hour)
+                apk_url = blob.generate_signed_url(version="v4", expiration=3600) # 1 hour
+                apk_blob_name = blob_name
+                print(f"Generated signed URL for APK: {apk_url}")
             else:
-                 print(f"Build {build_id} successful, but no artifact objects found in build results. Check cloudbuild.yaml artifacts section.")
+                 print(f"Build {build_id} successful, but its per-commit APK was not found. Check cloudbuild.yaml's copy step.")
                  # Fallback: try listing the bucket (less ideal)
                  # This is a simplified fallback and might not get the correct APK
                  # It assumes the APK is the latest in the /ideaforge-builds/ prefix
@@ -343,13 +395,16 @@ def get_cloud_build_status_and_apk_url(project_id: str, build_id: str, gcs_bucke
                  else:
                      print(f"No APKs found in gs://{gcs_bucket_name}/{prefix_to_list}")
 
-        return status, build_info.log_url, apk_url
+        return status, build_info.log_url, apk_url, apk_blob_name
 
     except Exception as e:
         error_message = f"Error getting build status: {e}"
         print(error_message)
-        return "ERROR", None, None
+        tracing.record_error(e)
+        return "ERROR", None, None, None
 
+@metrics.timed("extract")
+@tracing.traced("extract")
 def extract_and_write_flutter_code(ai_response: str, project_path: str) -> tuple[bool, str]:
     """
     Extract code blocks from AI response and write them to Flutter project files.
@@ -432,73 +487,104 @@ def extract_and_write_flutter_code(ai_response: str, project_path: str) -> tuple
     except Exception as e:
         return False, f"Error processing code blocks: {str(e)}"
 
-@app.route("/api/v1/generate-app-real-build", methods=["POST"])
-def generate_app_real_build():
-    data = request.get_json()
-    if not data or "prompt" not in data:
-        return jsonify({"error": "No prompt provided"}), 400
-
-    user_prompt = data["prompt"]
-    user_id = data.get("user_id", "default_user") # For conversation history
-
-    # --- Validate configurations ---
-    if not all([ANTHROPIC_API_KEY, GITHUB_PAT, GITHUB_REPO_URL, GCP_PROJECT_ID, GCP_SERVICE_ACCOUNT_KEY_PATH, GCS_BUCKET_NAME]):
-        missing_configs = []
-        if not ANTHROPIC_API_KEY: missing_configs.append("ANTHROPIC_API_KEY")
-        if not GITHUB_PAT: missing_configs.append("GITHUB_PAT")
-        if not GITHUB_REPO_URL: missing_configs.append("GITHUB_REPO_URL")
-        if not GCP_PROJECT_ID: missing_configs.append("GCP_PROJECT_ID")
-        if not GCP_SERVICE_ACCOUNT_KEY_PATH: missing_configs.append("GCP_SERVICE_ACCOUNT_KEY_PATH")
-        if not GCS_BUCKET_NAME: missing_configs.append("GCS_BUCKET_NAME")
-        return jsonify({"error": f"Server configuration incomplete. Missing: {', '.join(missing_configs)}"}), 500
-    
+def run_generation_pipeline(job, user_prompt: str, user_id: str, use_cache: bool = True,
+                            priority: str = PRIORITY_INTERACTIVE):
+    """Background job: generate -> parse -> push -> build -> artifact."""
     # 1. Call Claude API to generate code
+    job_engine.set_stage(job, "generate", "Generating code with Claude")
     print(f"Calling Claude for prompt: {user_prompt[:50]}...")
-    claude_response_json, status_code, generated_text = call_claude_api(user_prompt, user_id)
+    claude_response_json, status_code, generated_text = call_claude_api(user_prompt, user_id, use_cache=use_cache)
     if status_code != 200 or not generated_text:
-        return jsonify(claude_response_json if claude_response_json else {"error": "Failed to get valid response from Claude"}), status_code
+        raise JobError((claude_response_json or {}).get("error", "Failed to get valid response from Claude"))
     print("Claude API call successful.")
 
     # 2. Parse generated code (expecting main.dart and pubspec.yaml)
+    job_engine.set_stage(job, "parse", "Extracting generated files")
     parsed_files = parse_generated_code(generated_text)
     if "main.dart" not in parsed_files:
-        return jsonify({"error": "AI did not generate main.dart content as expected.", "generated_code": generated_text}), 500
+        raise JobError("AI did not generate main.dart content as expected.", {"generated_code": generated_text})
     print(f"Parsed generated code. Files: {list(parsed_files.keys())}")
 
+    # Identical source was built before: skip git and Cloud Build entirely
+    source_hash = hash_generated_files(parsed_files)
+    storage_client = gcp_clients.get_storage_client()
+    with metrics.stage_timer("artifact_lookup"), tracing.span("artifact.lookup", source_hash=source_hash) as span:
+        cached = resolve_cached_artifact(get_artifact_cache(), source_hash, storage_client) if storage_client else None
+        if span is not None:
+            span.set_attributes(hit=cached is not None, build_id=cached and cached["build_id"])
+    if cached:
+        job_engine.set_stage(job, "artifact", "Reusing APK from a previous build of identical source")
+        return {
+            "status": "success_real_build",
+            "message": "App generated and ready for download (reused identical build).",
+            "generated_code_from_claude": generated_text,
+            "apk_download_url": cached["download_url"],
+            "build_id": cached["build_id"],
+            "build_log_url": cached.get("log_url"),
+            "model_used": CLAUDE_MODEL,
+            "cached": True
+        }
+
     # 3. Update GitHub Repository
+    job_engine.set_stage(job, "push", "Pushing generated code to GitHub")
     commit_msg = f"AI generated app for prompt: {user_prompt[:100]}"
-    print(f"Pushing to GitHub repo: {GITHUB_REPO_URL}")
-    push_success, push_message = update_github_repository(parsed_files, GITHUB_REPO_URL, GITHUB_PAT, commit_msg)
+    # Each job gets its own branch so concurrent generations never overwrite each other
+    branch_name = build_branch_name(job.id)
+    print(f"Pushing to GitHub repo: {GITHUB_REPO_URL} (branch {branch_name})")
+    push_success, push_message, commit_sha = update_github_repository(parsed_files, GITHUB_REPO_URL, GITHUB_PAT, commit_msg, branch_name)
     if not push_success:
-        return jsonify({"error": f"Failed to update GitHub repository: {push_message}", "generated_code": generated_text}), 500
+        raise JobError(f"Failed to update GitHub repository: {push_message}", {"generated_code": generated_text})
     print("Successfully pushed code to GitHub.")
 
-    # 4. Trigger Google Cloud Build
+    # 4. Trigger Google Cloud Build, once the build scheduler has a free slot
     print(f"Triggering Google Cloud Build for project: {GCP_PROJECT_ID}")
     # Ensure GITHUB_REPO_URL is the plain https URL for GCB connection, not the PAT authenticated one.
     plain_github_repo_url = GITHUB_REPO_URL
-    build_id, build_message = trigger_cloud_build(GCP_PROJECT_ID, plain_github_repo_url, branch_name="generated-app")
+    scheduler = get_build_scheduler()
+    build_request = scheduler.submit(job.id, user_id, lambda _: trigger_cloud_build(
+        GCP_PROJECT_ID, plain_github_repo_url, branch_name=branch_name, commit_sha=commit_sha), priority)
+    while not build_request.done.wait(BUILD_QUEUE_STAGE_INTERVAL_SECONDS):
+        job_engine.set_stage(job, "build_queued", f"Waiting for build capacity (position {scheduler.position(job.id)})")
+    job_engine.set_stage(job, "build", "Building APK with Google Cloud Build")
+    build_id, build_message = build_request.build_id, build_request.error
     if not build_id:
-        return jsonify({"error": f"Failed to trigger Cloud Build: {build_message}", "generated_code": generated_text}), 500
-    print(f"Cloud Build triggered. Build ID: {build_id}. Message: {build_message}")
+        delete_build_branch(branch_name)
+        raise JobError(f"Failed to trigger Cloud Build: {build_message}", {"generated_code": generated_text})
+    print(f"Cloud Build triggered. Build ID: {build_id}")
+    tracing.set_attributes(build_id=build_id)
+    build_started = time.time()
 
-    # 5. Poll for build status
+    # 5. Poll for build status. This runs on a job worker, not a request worker.
     max_polls = 20  # Poll for up to 10 minutes (20 * 30s)
     poll_interval = 30  # seconds
     build_status = "WORKING" # Initial status
     log_url = None
     apk_download_url = None
+    apk_blob_name = None
 
-    for i in range(max_polls):
-        print(f"Polling build status for {build_id} (Attempt {i+1}/{max_polls})...")
-        time.sleep(poll_interval)
-        build_status, log_url, apk_download_url = get_cloud_build_status_and_apk_url(GCP_PROJECT_ID, build_id, GCS_BUCKET_NAME)
-        if build_status not in ["PENDING", "QUEUED", "WORKING"]:
-            break
-    
+    try:
+        for i in range(max_polls):
+            print(f"Polling build status for {build_id} (Attempt {i+1}/{max_polls})...")
+            time.sleep(poll_interval)
+            build_status, log_url, apk_download_url, apk_blob_name = get_cloud_build_status_and_apk_url(GCP_PROJECT_ID, build_id, GCS_BUCKET_NAME)
+            if build_status not in ["PENDING", "QUEUED", "WORKING"]:
+                break
+    finally:
+        # No webhook reaches this backend, so the job frees its branch and build slot itself,
+        # also when polling gives up on a build that is still running
+        delete_build_branch(branch_name)
+        scheduler.release(build_id)
+        metrics.observe_stage("build", time.time() - build_started)
+        metrics.BUILD_RESULTS.inc(status=build_status if build_status not in ["PENDING", "QUEUED", "WORKING"]
+                                  else "POLL_TIMEOUT")
+
+    # 6. Resolve the APK artifact
+    job_engine.set_stage(job, "artifact", f"Build finished with status {build_status}")
     print(f"Final build status for {build_id}: {build_status}")
     if build_status == "SUCCESS" and apk_download_url:
-        return jsonify({
+        if apk_blob_name:
+            get_artifact_cache().put(source_hash, GCS_BUCKET_NAME, apk_blob_name, build_id, log_url)
+        return {
             "status": "success_real_build",
             "message": "App generated, built, and ready for download!",
             "generated_code_from_claude": generated_text,
@@ -506,15 +592,64 @@ def generate_app_real_build():
             "build_id": build_id,
             "build_log_url": log_url,
             "model_used": CLAUDE_MODEL
-        }), 200
-    else:
-        return jsonify({
-            "error": f"Build failed or timed out. Status: {build_status}",
-            "generated_code_from_claude": generated_text,
-            "build_id": build_id,
-            "build_log_url": log_url,
-            "details": "Check the build logs for more information."
-        }), 500
+        }
+    raise JobError(f"Build failed or timed out. Status: {build_status}", {
+        "generated_code_from_claude": generated_text,
+        "build_id": build_id,
+        "build_log_url": log_url,
+        "details": "Check the build logs for more information."
+    })
+
+@app.route("/api/v1/generate-app-real-build", methods=["POST"])
+def generate_app_real_build():
+    data = request.get_json()
+    if not data or "prompt" not in data:
+        return jsonify({"error": "No prompt provided"}), 400
+
+    user_prompt = data["prompt"]
+    user_id = data.get("user_id", "default_user") # For conversation history
+    use_cache = not data.get("bypass_cache", False)
+
+    # --- Validate configurations ---
+    if not all([ANTHROPIC_API_KEY, GITHUB_PAT, GITHUB_REPO_URL, GCP_PROJECT_ID, GCP_SERVICE_ACCOUNT_KEY_PATH, GCS_BUCKET_NAME]):
+        missing_configs = []
+        if not ANTHROPIC_API_KEY: missing_configs.append("ANTHROPIC_API_KEY")
+        if not GITHUB_PAT: missing_configs.append("GITHUB_PAT")
+        if not GITHUB_REPO_URL: missing_configs.append("GITHUB_REPO_URL")
+        if not GCP_PROJECT_ID: missing_configs.append("GCP_PROJECT_ID")
+        if not GCP_SERVICE_ACCOUNT_KEY_PATH: missing_configs.append("GCP_SERVICE_ACCOUNT_KEY_PATH")
+        if not GCS_BUCKET_NAME: missing_configs.append("GCS_BUCKET_NAME")
+        return jsonify({"error": f"Server configuration incomplete. Missing: {', '.join(missing_configs)}"}), 500
+
+    # The pipeline takes minutes; hand it to the job engine and return immediately.
+    # An identical request (same prompt, history and cache setting) already in flight is joined instead of repeated.
+    dedupe_key = make_request_key(user_prompt, get_session_store().get_messages(user_id), use_cache=use_cache)
+    priority = data.get("priority", PRIORITY_INTERACTIVE)  # "interactive" or "batch"
+    job, attached = job_engine.submit_or_attach(run_generation_pipeline, user_prompt, user_id, use_cache, priority,
+                                                dedupe_key=dedupe_key, user_id=user_id)
+    if attached and job.user_id != user_id:
+        # The shared job only records the turn in its own user's history
+        job_engine.add_done_callback(job, lambda finished: record_shared_generation(finished, user_id, user_prompt))
+    tracing.set_attributes(job_id=job.id, coalesced=attached)
+    return jsonify({
+        "status": "accepted",
+        "job_id": job.id,
+        "status_url": f"/api/v1/jobs/{job.id}",
+        "coalesced": attached,
+        "message": "Generation job queued. Poll the status URL for progress."
+    }), 202
+
+def record_shared_generation(job, user_id: str, user_prompt: str):
+    generated_text = (job.result or {}).get("generated_code_from_claude") or (job.result or {}).get("generated_code")
+    if generated_text:
+        get_session_store().append_turn(user_id, user_prompt, generated_text)
+
+@app.route("/api/v1/jobs/<job_id>", methods=["GET"])
+def get_job_status(job_id):
+    job = job_engine.get(job_id)
+    if not job:
+        return jsonify({"error": "Job ID not found", "job_id": job_id}), 404
+    return jsonify(job), 200
 
 if __name__ == "__main__":
     # Check essential startup configurations
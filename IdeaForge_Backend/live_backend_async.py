@@ -0,0 +1,410 @@
+import asyncio
+import base64
+import json
+import subprocess
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+import claude_client_async
+import gcp_clients
+import live_backend_real_build as backend
+import metrics
+import tracing
+from build_events import apk_blob_from_build, apk_blob_from_build_resource, pubsub_message_id
+from build_scheduler import PRIORITY_INTERACTIVE, get_build_scheduler
+from build_status_store import TERMINAL_BUILD_STATUSES, get_build_status_store
+from claude_scheduler import SchedulerTimeout
+from git_mirror import build_branch_name, get_git_mirror
+from session_store import get_session_store
+from single_flight import AsyncSingleFlight, make_request_key
+
+# asyncio serving mode for the real-build backend:  python live_backend_async.py
+# Same routes and responses as live_backend_real_build.py for generate, build status,
+# the Cloud Build webhook and APK listing, but slow upstream calls are awaited: Claude
+# over aiohttp, Cloud Build over its async gRPC client, git as async subprocesses, and
+# the blocking GCS SDK on the default executor. Long-polls and in-flight generations
+# are suspended coroutines, so one instance holds thousands of them without a thread
+# each. Prompts, parsing, the status store and the schedulers are shared with the
+# Flask backend.
+
+PORT = backend.PORT
+CLAUDE_SESSION = web.AppKey("claude_session", aiohttp.ClientSession)
+
+generation_flight = AsyncSingleFlight()
+build_flight = AsyncSingleFlight()
+# Replace the Flask backend's flights: this server coalesces through its own
+metrics.register_stats("ideaforge_generation_flight", generation_flight.stats, counters=("leaders", "followers"))
+metrics.register_stats("ideaforge_build_flight", build_flight.stats, counters=("leaders", "followers"))
+resolving_builds = set()
+# The event loop only keeps weak references to tasks; these are kept until they finish
+background_tasks = set()
+_cloud_build_client = None
+
+
+def spawn(coroutine) -> asyncio.Future:
+    """Runs coroutine in the background, referenced until it is done."""
+    task = asyncio.ensure_future(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def get_cloud_build_client():
+    """The loop's CloudBuildAsyncClient, created on first use (None without credentials)."""
+    global _cloud_build_client
+    if _cloud_build_client is None:
+        _cloud_build_client = await asyncio.to_thread(
+            gcp_clients.create_cloud_build_async_client, backend.GCP_SERVICE_ACCOUNT_KEY_PATH)
+    return _cloud_build_client
+
+
+# --- Upstream calls ---
+async def call_claude_api(session, user_prompt: str, user_id: str, use_cache: bool = True):
+    """Async call_claude_api(): returns (api_response, status_code, generated_text)."""
+    # Secrets may need a Secret Manager round trip; keep it off the event loop
+    if not await asyncio.to_thread(backend.get_anthropic_api_key):
+        return {"error": "Anthropic API key not configured."}, 500, None
+    api_url = await asyncio.to_thread(backend.get_anthropic_api_url)
+    headers, payload = await asyncio.to_thread(backend.build_claude_request, user_prompt, user_id)
+    try:
+        api_response_json = await claude_client_async.create_message(
+            session, api_url, headers, payload, timeout=180, use_cache=use_cache, user_id=user_id)
+    except SchedulerTimeout as e:
+        return {"error": f"Claude API is busy: {e}"}, 503, None
+    except (claude_client_async.ClaudeAPIError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error calling Claude API at {api_url}: {e}")
+        return {"error": f"Error calling Claude API: {e}"}, 500, None
+    content = api_response_json.get("content")
+    generated_text = content[0].get("text", "") if isinstance(content, list) and content else ""
+    await asyncio.to_thread(backend.record_conversation_turn, user_id, user_prompt, generated_text)
+    return api_response_json, 200, generated_text
+
+
+async def update_github_repository(generated_files: dict, commit_message: str, branch_name: str):
+    """Async update_github_repository() on the shared mirror. Returns (success, message, commit_sha)."""
+    if not backend.GITHUB_PAT or not backend.GITHUB_REPO_URL:
+        return False, "GitHub PAT or Repository URL not configured.", None
+    try:
+        mirror = get_git_mirror(backend.GITHUB_REPO_URL.replace("https://", f"https://oauth2:{backend.GITHUB_PAT}@"))
+        commit_sha = await mirror.commit_files_async(backend.to_repo_files(generated_files), commit_message, branch_name)
+        backend.schedule_branch_pruning(mirror)
+        if not commit_sha:
+            return True, "No changes to commit.", None
+        return True, "Successfully updated files in GitHub repository.", commit_sha
+    except subprocess.CalledProcessError as e:
+        error_message = f"Git operation failed: {e.stderr}"
+        print(error_message)
+        return False, error_message, None
+    except Exception as e:
+        error_message = f"Error updating GitHub repository: {e}"
+        print(error_message)
+        return False, error_message, None
+
+
+@metrics.timed("create_build")
+@tracing.traced("cloud_build.create_build")
+async def trigger_cloud_build(branch_name: str, commit_sha: str = None):
+    """Async trigger_cloud_build(). Returns (build_id, message)."""
+    from google.cloud.devtools.cloudbuild_v1.types import Build, RepoSource, Source
+    client = await get_cloud_build_client()
+    if client is None:
+        return None, "Failed to get GCP credentials."
+    repo_source = RepoSource(
+        project_id=backend.GCP_PROJECT_ID,
+        repo_name=backend.GITHUB_REPO_URL.split("/")[-1].replace(".git", ""),
+    )
+    if commit_sha:
+        repo_source.commit_sha = commit_sha
+    else:
+        repo_source.branch_name = branch_name
+    try:
+        operation = await client.create_build(project_id=backend.GCP_PROJECT_ID, build=Build(source=Source(repo_source=repo_source)))
+        build_id = operation.metadata.build.id
+        print(f"Triggered Cloud Build {build_id}")
+        tracing.set_attributes(build_id=build_id)
+        return build_id, f"Build triggered successfully. Build ID: {build_id}"
+    except Exception as e:
+        error_message = f"Error triggering Cloud Build: {e}"
+        print(error_message)
+        metrics.record_failure("create_build")
+        tracing.record_error(e)
+        return None, error_message
+
+
+async def push_and_trigger_build(files: dict, job_id: str, source_hash: str = None, user_id: str = None,
+                                 priority: str = PRIORITY_INTERACTIVE):
+    """Async push_and_trigger_build(). Returns (build_id, error_message, queued)."""
+    branch_name = build_branch_name(job_id)
+    success, message, commit_sha = await update_github_repository(files, "Update Flutter app files", branch_name)
+    if not success:
+        return None, message, False
+
+    loop = asyncio.get_running_loop()
+
+    def start(build_request):
+        # Runs on a scheduler or executor thread, never on the loop itself
+        future = asyncio.run_coroutine_threadsafe(trigger_cloud_build(branch_name, commit_sha), loop)
+        build_id, build_message = future.result()
+        return backend.record_build_start(build_request, build_id, build_message, branch_name, commit_sha, source_hash)
+
+    build_request = await asyncio.to_thread(get_build_scheduler().submit, job_id, user_id, start, priority)
+    return await asyncio.to_thread(backend.scheduled_build_result, build_request)
+
+
+async def trigger_build_for_source(files: dict, source_hash: str, user_id: str = None, priority: str = PRIORITY_INTERACTIVE):
+    """Async trigger_build_for_source(). Returns (build_id, job_id, error_message, queued)."""
+    async def trigger():
+        job_id = str(uuid.uuid4())
+        build_id, error_message, queued = await push_and_trigger_build(files, job_id, source_hash, user_id, priority)
+        return build_id, job_id, error_message, queued
+    result, _ = await build_flight.do(source_hash, trigger)
+    return result
+
+
+async def run_generation(session, user_prompt: str, user_id: str, use_cache: bool = True,
+                         priority: str = PRIORITY_INTERACTIVE):
+    """Async run_generation(): returns (response_body, status_code, generated_text)."""
+    api_response, status_code, generated_text = await call_claude_api(session, user_prompt, user_id, use_cache)
+    if status_code != 200:
+        return {"error": api_response.get("error", "Failed to generate code")}, status_code, None
+
+    files, error_message = backend.prepare_generated_files(generated_text)
+    if error_message:
+        return {"error": error_message}, 400, generated_text
+
+    # Identical source was built before: skip git and Cloud Build entirely
+    source_hash, cached = await asyncio.to_thread(backend.find_cached_build, files)
+    if cached:
+        return {
+            "status": "success",
+            "build_id": cached["build_id"],
+            "download_url": cached["download_url"],
+            "cached": True,
+            "message": "Reused APK from a previous build of identical source"
+        }, 200, generated_text
+
+    build_id, job_id, error_message, queued = await trigger_build_for_source(files, source_hash, user_id, priority)
+    if queued:
+        return backend.queued_build_body(job_id), 202, generated_text
+    if not build_id:
+        return {"error": error_message}, 500, generated_text
+    return {
+        "status": "success",
+        "build_id": build_id,
+        "job_id": job_id,
+        "message": "Build triggered successfully"
+    }, 200, generated_text
+
+
+@tracing.traced("artifact.resolve")
+async def resolve_build_artifact(build_id: str, apk_blob_name: str = None):
+    """Async resolve_build_artifact(): signs the APK named in the notification, else looks the build up."""
+    tracing.set_attributes(build_id=build_id)
+    try:
+        apk_url = None
+        log_url = None
+        if apk_blob_name:
+            apk_url = await asyncio.to_thread(sign_blob, apk_blob_name)
+        if not apk_url:
+            log_url, apk_url, apk_blob_name = await get_build_apk(build_id)
+        if not apk_url:
+            await asyncio.to_thread(backend.transition_build_status, build_id, "SUCCESS",
+                                    {"error": "APK not found in build artifacts"})
+            return
+        _, build_info = await asyncio.to_thread(backend.transition_build_status, build_id, "SUCCESS", {"download_url": apk_url})
+        if apk_blob_name and build_info.get("source_hash"):
+            await asyncio.to_thread(backend.get_artifact_cache().put, build_info["source_hash"], backend.GCS_BUCKET_NAME,
+                                    apk_blob_name, build_id, log_url)
+    except Exception as e:
+        print(f"Error resolving APK for build {build_id}: {e}")
+    finally:
+        resolving_builds.discard(build_id)
+
+
+@metrics.timed("sign_url")
+@tracing.traced("gcs.sign_url")
+def sign_blob(blob_name: str):
+    storage_client = gcp_clients.get_storage_client(backend.GCP_SERVICE_ACCOUNT_KEY_PATH)
+    if storage_client is None:
+        return None
+    try:
+        return storage_client.bucket(backend.GCS_BUCKET_NAME).blob(blob_name).generate_signed_url(version="v4", expiration=3600)
+    except Exception as e:
+        print(f"Error signing APK {blob_name}: {e}")
+        return None
+
+
+def blob_exists(blob_name: str) -> bool:
+    storage_client = gcp_clients.get_storage_client(backend.GCP_SERVICE_ACCOUNT_KEY_PATH)
+    if storage_client is None:
+        return False
+    try:
+        return storage_client.bucket(backend.GCS_BUCKET_NAME).blob(blob_name).exists()
+    except Exception as e:
+        print(f"Error checking APK {blob_name}: {e}")
+        return False
+
+
+@metrics.timed("build_lookup")
+@tracing.traced("cloud_build.get_build")
+async def get_build_apk(build_id: str):
+    """
+    Returns (log_url, apk_url, apk_blob_name) for the build's per-commit APK, falling back
+    to the newest APK in the bucket (then apk_blob_name is None).
+    """
+    tracing.set_attributes(build_id=build_id)
+    client = await get_cloud_build_client()
+    if client is None:
+        return None, None, None
+    try:
+        build = await client.get_build(project_id=backend.GCP_PROJECT_ID, id=build_id)
+    except Exception as e:
+        print(f"Error getting build {build_id}: {e}")
+        tracing.record_error(e)
+        return None, None, None
+    blob_name = apk_blob_from_build_resource(build)
+    if blob_name and await asyncio.to_thread(blob_exists, blob_name):
+        return build.log_url, await asyncio.to_thread(sign_blob, blob_name), blob_name
+    apks = await asyncio.to_thread(backend.list_latest_apks, backend.GCS_BUCKET_NAME)
+    return build.log_url, apks[0][1] if apks else None, None
+
+
+# --- Routes ---
+async def generate_app_real_build(request: web.Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.json_response({"error": "Invalid JSON body"}, status=400)
+    user_prompt = data.get("prompt")
+    if not user_prompt:
+        return web.json_response({"error": "No prompt provided"}, status=400)
+    user_id = data.get("user_id")
+    use_cache = not data.get("bypass_cache", False)
+    priority = data.get("priority", PRIORITY_INTERACTIVE)
+    try:
+        # Requests with the same normalized prompt and history share one in-flight generation
+        history = await asyncio.to_thread(lambda: get_session_store().get_messages(user_id))
+        key = make_request_key(user_prompt, history, use_cache=use_cache)
+        session = request.app[CLAUDE_SESSION]
+
+        async def generate():
+            return user_id, await run_generation(session, user_prompt, user_id, use_cache, priority)
+
+        (leader_id, (body, status_code, generated_text)), shared = await generation_flight.do(key, generate)
+        tracing.set_attributes(build_id=body.get("build_id"), job_id=body.get("job_id"), coalesced=shared)
+        if shared:
+            body = dict(body, coalesced=True)
+            # The leader recorded the turn in its own history; a different user needs it in theirs
+            if generated_text and status_code in (200, 202) and leader_id != user_id:
+                await asyncio.to_thread(backend.record_conversation_turn, user_id, user_prompt, generated_text)
+        return web.json_response(body, status=status_code)
+    except Exception as e:
+        print(f"Error in generate_app_real_build: {e}")
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def get_build_status(request: web.Request):
+    """Same contract as the Flask endpoint: version/ETag, If-None-Match or ?version=, and ?wait= long-poll."""
+    build_id = request.match_info["build_id"]
+    store = get_build_status_store()
+    build_info = await asyncio.to_thread(store.get, build_id)
+    if build_info is None:
+        return web.json_response({"error": "Build ID not found", "build_id": build_id}, status=404)
+
+    known_version = backend.parse_status_version(request.headers.get("If-None-Match") or request.query.get("version"))
+    try:
+        wait_seconds = min(float(request.query.get("wait", 0)), backend.BUILD_STATUS_MAX_WAIT_SECONDS)
+    except ValueError:
+        wait_seconds = 0
+    if known_version == build_info["version"] and wait_seconds > 0 and not backend.build_status_is_final(build_info):
+        build_info = await store.wait_for_change_async(build_id, known_version, wait_seconds) or build_info
+    etag = f'"{build_info["version"]}"'
+    if known_version == build_info["version"]:
+        return web.Response(status=304, headers={"ETag": etag})
+    return web.json_response(backend.build_status_body(build_id, build_info), headers={"ETag": etag})
+
+
+async def cloud_build_webhook(request: web.Request):
+    """Pub/Sub push endpoint; acks once the status is recorded and resolves the APK URL in a background task."""
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    if not payload or "message" not in payload:
+        return web.json_response({"error": "Invalid payload format"}, status=400)
+
+    message_id = pubsub_message_id(payload)
+    if message_id in backend.seen_webhook_messages:
+        return web.json_response({"status": "duplicate", "message_id": message_id})
+    try:
+        build_data = json.loads(base64.b64decode(payload["message"]["data"]).decode("utf-8"))
+    except (KeyError, TypeError, ValueError) as e:
+        return web.json_response({"error": f"Invalid message data: {e}"}, status=400)
+    build_id = build_data.get("id")
+    status = build_data.get("status")
+    if not build_id or not status:
+        return web.json_response({"error": "Missing build ID or status"}, status=400)
+
+    previous = await asyncio.to_thread(get_build_status_store().get, build_id) or {}
+    terminal = status in TERMINAL_BUILD_STATUSES
+    tracing.set_attributes(build_id=build_id, status=status)
+    # Recorded in the trace of the request that triggered the build
+    with tracing.span("cloud_build.notification", previous.get("traceparent"), build_id=build_id, status=status):
+        changed, build_info = await asyncio.to_thread(
+            backend.transition_build_status, build_id, status, None, ("branch",) if terminal else ())
+        backend.seen_webhook_messages.add(message_id)
+
+        # The job's branch is only needed until Cloud Build has finished with it,
+        # and its build slot can go to the next queued build
+        if changed and terminal:
+            backend.delete_build_branch(previous.get("branch"))
+            await asyncio.to_thread(get_build_scheduler().release, build_id)
+            backend.observe_build_finished(build_info)
+
+        if build_info["status"] == "SUCCESS" and not backend.build_status_is_final(build_info) and build_id not in resolving_builds:
+            resolving_builds.add(build_id)
+            spawn(resolve_build_artifact(build_id, apk_blob_from_build(build_data)))
+
+    return web.json_response({
+        "status": build_info["status"],
+        "build_id": build_id,
+        "version": build_info["version"],
+        "changed": changed
+    })
+
+
+async def list_apks(request: web.Request):
+    try:
+        apks = await asyncio.to_thread(backend.list_latest_apks, backend.GCS_BUCKET_NAME)
+        return web.json_response({"status": "success", "apks": [{"name": name, "url": url} for name, url in apks]})
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=500)
+
+
+# --- App ---
+async def on_startup(app: web.Application):
+    app[CLAUDE_SESSION] = claude_client_async.create_session()
+    if backend.WARMUP_ON_START:
+        spawn(asyncio.to_thread(backend.warm_up))
+
+
+async def on_cleanup(app: web.Application):
+    await app[CLAUDE_SESSION].close()
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_post("/api/v1/generate-app-real-build", generate_app_real_build)
+    app.router.add_get("/api/build-status/{build_id}", get_build_status)
+    app.router.add_post("/api/cloud-build-webhook", cloud_build_webhook)
+    app.router.add_get("/api/list-apks", list_apks)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return metrics.instrument_aiohttp(tracing.instrument_aiohttp(app))
+
+
+if __name__ == "__main__":
+    print(f"Starting asyncio server on 0.0.0.0:{PORT}")
+    web.run_app(create_app(), host="0.0.0.0", port=PORT, print=None)
@@ -4,23 +4,39 @@ import json
 import time
 import random
 import subprocess
-import shutil
 import uuid # For unique temporary directory names
 import base64
 import tempfile
-from flask import Flask, request, jsonify
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, stream_with_context
 from dotenv import load_dotenv
-from google.cloud import storage
-from google.cloud.devtools.cloudbuild_v1.services import cloud_build
-from google.cloud.devtools.cloudbuild_v1.types import Build, RepoSource, StorageSource
-from google.oauth2 import service_account # For GCP authentication
-from google.cloud import secretmanager
+import cassette
+import claude_client
+import gcp_clients
+import metrics
+import tracing
+from code_stream import IncrementalCodeParser
+from git_mirror import GIT_COMMIT_MODE, build_branch_name, get_git_mirror, run_git
+from artifact_cache import get_artifact_cache, hash_generated_files, resolve_cached_artifact
+from secret_config import get_secret
+from build_status_store import TERMINAL_BUILD_STATUSES, get_build_status_store
+from build_events import SeenMessages, apk_blob_from_build, apk_blob_from_build_resource, pubsub_message_id
+from session_store import get_session_store
+from history_compaction import compact_messages, stable_prefix_length
+from single_flight import SingleFlight, make_request_key
+from build_scheduler import PRIORITY_INTERACTIVE, get_build_scheduler
+# The google-cloud SDKs are imported where they are used so a cold start only pays for Flask
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Initialize Flask app at the top
 app = Flask(__name__)
+# Per-route latency and GET /metrics (Prometheus text format)
+metrics.instrument_flask(app)
+# Root span per request when IDEAFORGE_TRACE_FILE is set (see tracing.py)
+tracing.instrument_flask(app)
 
 # Load configuration from environment variables
 PORT = int(os.getenv("PORT", "8080"))
@@ -31,56 +47,64 @@ GITHUB_REPO_URL = os.getenv("GITHUB_REPO_URL")
 GCP_SERVICE_ACCOUNT_KEY_PATH = os.getenv("GCP_SERVICE_ACCOUNT_KEY_PATH")
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
 
-def get_secret(secret_id, version_id="latest"):
-    project_id = os.environ.get("GCP_PROJECT_ID")
-    client = secretmanager.SecretManagerServiceClient()
-    name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
-    response = client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
+DEFAULT_ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+# Set to 1 to resolve secrets and open API connections in the background right after startup
+WARMUP_ON_START = os.getenv("IDEAFORGE_WARMUP") == "1"
 
-# Get API key from Secret Manager
-ANTHROPIC_API_KEY = get_secret("anthropic-api-key")
-print(f"ANTHROPIC_API_KEY loaded from Secret Manager: {'Present' if ANTHROPIC_API_KEY else 'Missing'} (Length: {len(ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else 0})")
+# Anthropic settings come from Secret Manager on first use (cached, refreshed after a TTL)
+# ANTHROPIC_API_KEY / ANTHROPIC_API_URL in the environment take precedence, e.g. to point at a local stand-in
+def get_anthropic_api_key():
+    return os.getenv("ANTHROPIC_API_KEY") or get_secret("anthropic-api-key")
 
-# Get API URL from Secret Manager
-ANTHROPIC_API_URL = get_secret("anthropic-api-url")
-if not ANTHROPIC_API_URL:
-    ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
-print(f"ANTHROPIC_API_URL loaded from Secret Manager: {ANTHROPIC_API_URL}")
+def get_anthropic_api_url():
+    return os.getenv("ANTHROPIC_API_URL") or get_secret("anthropic-api-url") or DEFAULT_ANTHROPIC_API_URL
 
 # Claude API Configuration
 CLAUDE_MODEL = "claude-3.7-sonnet"
+# Minimum spacing between progress events on the streaming endpoint
+STREAM_PROGRESS_INTERVAL_SECONDS = 0.25
+# Upper bound for ?wait= on the status endpoint, kept below typical proxy/load balancer timeouts
+BUILD_STATUS_MAX_WAIT_SECONDS = int(os.getenv("BUILD_STATUS_MAX_WAIT_SECONDS", "55"))
+# Status streams send a keep-alive comment this often and close after the max duration
+BUILD_STATUS_KEEPALIVE_SECONDS = 15
+BUILD_STATUS_STREAM_MAX_SECONDS = int(os.getenv("BUILD_STATUS_STREAM_MAX_SECONDS", "1800"))
+# Threads that resolve APK download URLs after the webhook has acked
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
 
 # GitHub Configuration
 
 # GCP Configuration
 
-# In-memory storage for build statuses and APK links
-build_statuses = {}
+# Build statuses and APK links live in build_status_store (SQLite by default)
+
+# Webhook deliveries already handled, and builds whose APK URL is being resolved
+seen_webhook_messages = SeenMessages()
+artifact_executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix="ideaforge-artifact")
+resolving_builds = set()
+resolving_builds_lock = threading.Lock()
+
+# Identical requests already in flight share one Claude call, and identical source one build
+generation_flight = SingleFlight()
+build_flight = SingleFlight()
+metrics.register_stats("ideaforge_generation_flight", generation_flight.stats, counters=("leaders", "followers"))
+metrics.register_stats("ideaforge_build_flight", build_flight.stats, counters=("leaders", "followers"))
 
 # --- Helper: GCP Credentials ---
 def get_gcp_credentials():
     if not GCP_SERVICE_ACCOUNT_KEY_PATH:
         print("Error: GCP_SERVICE_ACCOUNT_KEY_PATH not set in .env")
         return None
-    try:
-        return service_account.Credentials.from_service_account_file(GCP_SERVICE_ACCOUNT_KEY_PATH)
-    except Exception as e:
-        print(f"Error loading GCP service account credentials: {e}")
-        return None
+    # Loaded once per process and shared by every GCP client
+    return gcp_clients.get_credentials(GCP_SERVICE_ACCOUNT_KEY_PATH)
 
 # --- Helper: Claude API Call (existing, slightly modified for clarity) ---
-conversation_history = {}
-def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None):
-    if not ANTHROPIC_API_KEY:
-        return {"error": "Anthropic API key not configured."}, 500, None
-
-    current_user_history = conversation_history.get(user_id, [])
-    messages_payload = list(current_user_history) # Make a copy
-    messages_payload.append({"role": "user", "content": user_prompt})
+def build_claude_request(user_prompt: str, user_id: str, system_prompt: str = None):
+    """Returns (headers, payload) for a Messages API call including the user's history (none when user_id is None)."""
+    history = compact_messages(get_session_store().get_messages(user_id))
+    messages_payload = history + [{"role": "user", "content": user_prompt}]
     
     headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
+        "x-api-key": get_anthropic_api_key(),
         "anthropic-version": "2023-06-01",
         "content-type": "application/json"
     }
@@ -116,22 +140,38 @@ def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None):
         "system": system_prompt if system_prompt else default_system_prompt,
         "temperature": 0.3 
     }
+    # The system prompt and stable history prefix are served from Anthropic's prompt cache
+    return headers, claude_client.apply_prompt_caching(payload, stable_prefix_length(history))
+
+def record_conversation_turn(user_id: str, user_prompt: str, generated_text: str):
+    # Anonymous requests (no user_id) are not remembered
+    get_session_store().append_turn(user_id, user_prompt, generated_text)
+
+# A replayed call still adds the turn to the user's history, as the real call does
+@cassette.recorded("claude", on_miss=lambda *args, **kwargs: ({"error": "Claude call not in cassette"}, 500, None),
+                   on_replay=lambda result, user_prompt, user_id, *args, **kwargs:
+                   result[1] == 200 and record_conversation_turn(user_id, user_prompt, result[2]))
+def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None, use_cache: bool = True):
+    if not get_anthropic_api_key():
+        return {"error": "Anthropic API key not configured."}, 500, None
+
+    api_url = get_anthropic_api_url()
+    headers, payload = build_claude_request(user_prompt, user_id, system_prompt)
     try:
-        response = requests.post(ANTHROPIC_API_URL, headers=headers, json=payload, timeout=180)
-        response.raise_for_status()
-        api_response_json = response.json()
+        api_response_json = claude_client.create_message(api_url, headers, payload, timeout=180, use_cache=use_cache, user_id=user_id)
         generated_text = ""
         if api_response_json.get("content") and isinstance(api_response_json["content"], list) and len(api_response_json["content"]) > 0:
             generated_text = api_response_json["content"][0].get("text", "")
         
         # Update history
-        current_user_history.append({"role": "user", "content": user_prompt})
-        current_user_history.append({"role": "assistant", "content": generated_text})
-        conversation_history[user_id] = current_user_history[-10:]
+        record_conversation_turn(user_id, user_prompt, generated_text)
         return api_response_json, 200, generated_text
+    except claude_client.SchedulerTimeout as e:
+        # Too many calls queued ahead of this one; the client should retry later
+        return {"error": f"Claude API is busy: {e}"}, 503, None
     except requests.exceptions.RequestException as e:
         error_details = {
-            "url": ANTHROPIC_API_URL,
+            "url": api_url,
             "status_code": getattr(e.response, 'status_code', None) if hasattr(e, 'response') else None,
             "response_body": getattr(e.response, 'text', None) if hasattr(e, 'response') else None,
             "error": str(e)
@@ -139,10 +179,28 @@ def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None):
         print(f"Error calling Claude API: {json.dumps(error_details, indent=2)}")
         return {"error": f"Error calling Claude API: {e}"}, 500, None
     except Exception as e:
-        print(f"Unexpected error calling Claude API at {ANTHROPIC_API_URL}: {str(e)}")
+        print(f"Unexpected error calling Claude API at {api_url}: {str(e)}")
         return {"error": f"An unexpected error occurred: {e}"}, 500, None
 
+def call_claude_api_stream(user_prompt: str, user_id: str, system_prompt: str = None, usage: dict = None):
+    """
+    Streaming variant of call_claude_api: yields text deltas as Claude generates them
+    and records the conversation turn once the stream completes. Raises on failure.
+    """
+    if not get_anthropic_api_key():
+        raise RuntimeError("Anthropic API key not configured.")
+
+    headers, payload = build_claude_request(user_prompt, user_id, system_prompt)
+    chunks = []
+    for delta in claude_client.stream_message(get_anthropic_api_url(), headers, payload, timeout=180,
+                                              user_id=user_id, usage=usage):
+        chunks.append(delta)
+        yield delta
+    record_conversation_turn(user_id, user_prompt, "".join(chunks))
+
 # --- Helper: Parse AI Generated Code ---
+@metrics.timed("parse")
+@tracing.traced("parse")
 def parse_generated_code(generated_text: str):
     files = {}
     ignored_text = []
@@ -191,8 +249,11 @@ def parse_generated_code(generated_text: str):
         if in_code_block:
             current_text.append(line)
         else:
-            # Collect non-code text for logging
-            if line.strip() and not line.strip().startswith('FILENAME:'):
+            if line.strip().startswith('FILENAME:'):
+                # Label for the next code block, the format the system prompt asks for
+                current_filename = line.strip()[len('FILENAME:'):].strip()
+            elif line.strip():
+                # Collect non-code text for logging
                 ignored_text.append(line.strip())
     
     # Log ignored text if any
@@ -217,14 +278,13 @@ def parse_generated_code(generated_text: str):
         
         # Validate pubspec.yaml format
         if filename == "pubspec.yaml":
-            try:
-                import yaml
-                yaml.safe_load(content)  # Validate YAML syntax
-            except yaml.YAMLError as e:
-                return {"error": f"Invalid YAML syntax in pubspec.yaml: {str(e)}"}
+            yaml_error = validate_pubspec_syntax(content)
+            if yaml_error:
+                return {"error": yaml_error}
             
             # Check for asset references
             try:
+                import yaml
                 yaml_content = yaml.safe_load(content)
                 if 'flutter' in yaml_content and 'assets' in yaml_content['flutter']:
                     assets = yaml_content['flutter']['assets']
@@ -254,85 +314,145 @@ def parse_generated_code(generated_text: str):
     
     return files
 
+def validate_pubspec_syntax(content: str):
+    """Returns an error message if pubspec.yaml is not valid YAML, otherwise None."""
+    import yaml
+    try:
+        yaml.safe_load(content)
+    except yaml.YAMLError as e:
+        return f"Invalid YAML syntax in pubspec.yaml: {str(e)}"
+    return None
+
 # --- Helper: Git Operations ---
-def update_github_repository(generated_files: dict, repo_url: str, pat: str, commit_message: str):
+def to_repo_files(generated_files: dict) -> dict:
+    """Maps generated files to their paths in the app repository; only specific files are updated."""
+    repo_files = {}
+    for filename, content in generated_files.items():
+        if filename == "main.dart":
+            repo_files["lib/main.dart"] = content
+        elif filename == "pubspec.yaml" or filename.startswith("assets/"):
+            repo_files[filename] = content
+        else:
+            print(f"Skipping non-standard file: {filename}")
+    return repo_files
+
+def update_github_repository(generated_files: dict, repo_url: str, pat: str, commit_message: str, branch_name: str = "generated-app"):
+    """Pushes generated files to branch_name. Returns (success, message, commit_sha)."""
     if not pat or not repo_url:
-        return False, "GitHub PAT or Repository URL not configured."
+        return False, "GitHub PAT or Repository URL not configured.", None
+    if GIT_COMMIT_MODE == "worktree":
+        return update_github_repository_worktree(generated_files, repo_url, pat, commit_message, branch_name)
     
-    temp_dir = f"/tmp/ideaforge_repo_{uuid.uuid4()}"
     try:
-        # Clone the repo
         auth_repo_url = repo_url.replace("https://", f"https://oauth2:{pat}@")
-        subprocess.run(["git", "clone", "--depth=1", auth_repo_url, temp_dir], check=True, capture_output=True, text=True)
-        
-        # Switch to generated-app branch or create it if it doesn't exist
-        subprocess.run(["git", "checkout", "-b", "generated-app"], cwd=temp_dir, check=True, capture_output=True, text=True)
-        
-        # Only update specific files
-        for filename, content in generated_files.items():
-            file_path = ""
-            if filename == "main.dart":
-                file_path = os.path.join(temp_dir, "lib", filename)
-                # Ensure lib directory exists
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            elif filename == "pubspec.yaml":
-                file_path = os.path.join(temp_dir, filename)
-            else:
-                # Handle asset files
-                if filename.startswith("assets/"):
-                    file_path = os.path.join(temp_dir, filename)
+        mirror = get_git_mirror(auth_repo_url)
+        # Blobs, tree and commit go straight into the mirror's object store; no checkout
+        commit_sha = mirror.commit_files(to_repo_files(generated_files), commit_message, branch_name)
+        schedule_branch_pruning(mirror)
+        if not commit_sha:
+            return True, "No changes to commit.", None
+        return True, "Successfully updated files in GitHub repository.", commit_sha
+    except subprocess.CalledProcessError as e:
+        error_message = f"Git operation failed: {e.stderr}"
+        print(error_message)
+        return False, error_message, None
+    except Exception as e:
+        error_message = f"Error updating GitHub repository: {e}"
+        print(error_message)
+        return False, error_message, None
+
+def update_github_repository_worktree(generated_files: dict, repo_url: str, pat: str, commit_message: str, branch_name: str = "generated-app"):
+    """Fallback commit path (IDEAFORGE_GIT_COMMIT_MODE=worktree): check files out, commit and push."""
+    try:
+        auth_repo_url = repo_url.replace("https://", f"https://oauth2:{pat}@")
+        mirror = get_git_mirror(auth_repo_url)
+        # A pooled worktree, reset to a freshly fetched default branch, replaces a full clone
+        with mirror.worktree() as temp_dir:
+            # Only update specific files
+            for filename, content in generated_files.items():
+                file_path = ""
+                if filename == "main.dart":
+                    file_path = os.path.join(temp_dir, "lib", filename)
+                    # Ensure lib directory exists
                     os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                elif filename == "pubspec.yaml":
+                    file_path = os.path.join(temp_dir, filename)
                 else:
-                    print(f"Skipping non-standard file: {filename}")
-                    continue
+                    # Handle asset files
+                    if filename.startswith("assets/"):
+                        file_path = os.path.join(temp_dir, filename)
+                        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    else:
+                        print(f"Skipping non-standard file: {filename}")
+                        continue
+                
+                # Write the file with proper line endings
+                with open(file_path, "w", newline='\n') as f:
+                    f.write(content)
             
-            # Write the file with proper line endings
-            with open(file_path, "w", newline='\n') as f:
-                f.write(content)
-        
-        # Git commit and push
-        subprocess.run(["git", "add", "."], cwd=temp_dir, check=True, capture_output=True, text=True)
-        
-        # Check if there are changes to commit
-        status_result = subprocess.run(["git", "status", "--porcelain"], cwd=temp_dir, check=True, capture_output=True, text=True)
-        if not status_result.stdout.strip():
-            print("No changes to commit.")
-            return True, "No changes to commit."
-        
-        # Commit and push changes
-        subprocess.run(["git", "commit", "-m", commit_message], cwd=temp_dir, check=True, capture_output=True, text=True)
-        subprocess.run(["git", "push", "-u", "origin", "generated-app", "--force"], cwd=temp_dir, check=True, capture_output=True, text=True)
+            # Git commit and push
+            run_git(["add", "."], cwd=temp_dir)
+            
+            # Check if there are changes to commit
+            status_result = run_git(["status", "--porcelain"], cwd=temp_dir)
+            if not status_result.stdout.strip():
+                print("No changes to commit.")
+            else:
+                run_git(["commit", "-m", commit_message], cwd=temp_dir)
+            
+            # Push the detached worktree HEAD so the job's branch exists even without changes
+            run_git(["push", "--force", "origin", f"HEAD:refs/heads/{branch_name}"], cwd=temp_dir)
+            commit_sha = run_git(["rev-parse", "HEAD"], cwd=temp_dir).stdout.strip()
         
-        return True, "Successfully updated files in GitHub repository."
+        schedule_branch_pruning(mirror)
+        return True, "Successfully updated files in GitHub repository.", commit_sha
     except subprocess.CalledProcessError as e:
         error_message = f"Git operation failed: {e.stderr}"
         print(error_message)
-        return False, error_message
+        return False, error_message, None
     except Exception as e:
         error_message = f"Error updating GitHub repository: {e}"
         print(error_message)
-        return False, error_message
-    finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        return False, error_message, None
+
+def schedule_branch_pruning(mirror):
+    """Removes leftover per-job branches in the background; the mirror throttles how often."""
+    threading.Thread(target=tracing.bind(mirror.prune_stale_branches), daemon=True).start()
+
+def delete_build_branch(branch_name: str):
+    """Deletes a finished build's branch in the background."""
+    if not branch_name or not GITHUB_PAT or not GITHUB_REPO_URL:
+        return
+    mirror = get_git_mirror(GITHUB_REPO_URL.replace("https://", f"https://oauth2:{GITHUB_PAT}@"))
+    threading.Thread(target=tracing.bind(mirror.delete_branches), args=([branch_name],), daemon=True).start()
 
 # --- Helper: Google Cloud Build Operations ---
-def trigger_cloud_build(project_id: str, repo_url: str, branch_name: str = "generated-app"):
+@metrics.timed("create_build")
+@tracing.traced("cloud_build.create_build")
+# Branch and commit differ on every run; builds of one repository replay in recorded order
+@cassette.recorded("cloud_build.create_build", key_args=("project_id", "repo_url"),
+                   on_miss=lambda *args, **kwargs: (None, "Cloud Build call not in cassette"))
+def trigger_cloud_build(project_id: str, repo_url: str, branch_name: str = "generated-app", commit_sha: str = None):
+    """Builds commit_sha when given, so the build cannot pick up a later push; otherwise branch_name."""
+    from google.cloud.devtools.cloudbuild_v1.types import Build, RepoSource, Source
     credentials = get_gcp_credentials()
     if not credentials:
         return None, "Failed to get GCP credentials."
     
-    client = cloud_build.CloudBuildClient(credentials=credentials)
+    client = gcp_clients.get_cloud_build_client(GCP_SERVICE_ACCOUNT_KEY_PATH)
     
     # Assuming the cloudbuild.yaml is in the root of the repository
-    source = RepoSource(
+    repo_source = RepoSource(
         project_id=project_id,
         repo_name=repo_url.split("/")[-1].replace(".git", ""),
-        branch_name=branch_name,
     )
+    if commit_sha:
+        repo_source.commit_sha = commit_sha
+    else:
+        repo_source.branch_name = branch_name
 
     build = Build(
-        source=source,
+        source=Source(repo_source=repo_source),
     )
     
     try:
@@ -341,13 +461,18 @@ def trigger_cloud_build(project_id: str, repo_url: str, branch_name: str = "gene
         # For simplicity, we return the operation name. Client might need to poll for completion.
         # Or, the backend can poll here.
         build_id = operation.metadata.build.id
+        tracing.set_attributes(build_id=build_id)
         return build_id, f"Build triggered successfully. Build ID: {build_id}"
     except Exception as e:
         error_message = f"Error triggering Cloud Build: {e}"
         print(error_message)
+        metrics.record_failure("create_build")
+        tracing.record_error(e)
         return None, error_message
 
 # --- Helper: List Latest APKs in GCS ---
+@tracing.traced("gcs.list_apks")
+@cassette.recorded("gcs.list_apks", on_miss=lambda *args, **kwargs: [])
 def list_latest_apks(bucket_name: str, prefix: str = "ideaforge-builds/") -> list:
     """
     Lists the latest APK files in the specified GCS bucket.
@@ -357,7 +482,7 @@ def list_latest_apks(bucket_name: str, prefix: str = "ideaforge-builds/") -> lis
     if not credentials:
         return []
     
-    storage_client = storage.Client(credentials=credentials)
+    storage_client = gcp_clients.get_storage_client(GCP_SERVICE_ACCOUNT_KEY_PATH)
     bucket = storage_client.bucket(bucket_name)
     
     try:
@@ -369,31 +494,39 @@ def list_latest_apks(bucket_name: str, prefix: str = "ideaforge-builds/") -> lis
         print(f"Error listing APKs: {e}")
         return []
 
+@metrics.timed("build_lookup")
+@tracing.traced("cloud_build.get_build")
+@cassette.recorded("cloud_build.get_build", on_miss=lambda *args, **kwargs: ("ERROR", None, None, None))
 def get_cloud_build_status_and_apk_url(project_id: str, build_id: str, gcs_bucket_name: str):
+    """
+    Returns (status, log_url, apk_url, apk_blob_name). apk_blob_name is only set when the
+    APK is this build's own per-commit object, not from the latest-in-bucket fallback.
+    """
+    from google.cloud.devtools.cloudbuild_v1.types import Build
     credentials = get_gcp_credentials()
     if not credentials:
-        return "ERROR", "Failed to get GCP credentials.", None
+        return "ERROR", "Failed to get GCP credentials.", None, None
 
-    client = cloud_build.CloudBuildClient(credentials=credentials)
-    storage_client = storage.Client(credentials=credentials)
+    client = gcp_clients.get_cloud_build_client(GCP_SERVICE_ACCOUNT_KEY_PATH)
+    storage_client = gcp_clients.get_storage_client(GCP_SERVICE_ACCOUNT_KEY_PATH)
 
     try:
         build_info = client.get_build(project_id=project_id, id=build_id)
         status = Build.Status(build_info.status).name
         print(f"Build ID {build_id} status: {status}")
+        tracing.set_attributes(build_id=build_id, status=status)
 
         apk_url = None
+        apk_blob_name = None
         if status == "SUCCESS":
-            # Look for APK artifacts in the build results
-            if build_info.results and build_info.results.artifacts:
-                for artifact in build_info.results.artifacts.objects:
-                    if artifact.location.startswith(f"gs://{gcs_bucket_name}/") and artifact.location.endswith(".apk"):
-                        blob_name = artifact.location[len(f"gs://{gcs_bucket_name}/"):]
-                        bucket = storage_client.bucket(gcs_bucket_name)
-                        blob = bucket.blob(blob_name)
-                        apk_url = blob.generate_signed_url(version="v4", expiration=3600)
-                        print(f"Found APK artifact: {blob_name}")
-                        break
+            # The APK uploaded under this build's commit; the shared artifacts object may be another build's
+            blob_name = apk_blob_from_build_resource(build_info)
+            if blob_name:
+                blob = storage_client.bucket(gcs_bucket_name).blob(blob_name)
+                if blob.exists():
+                    apk_url = blob.generate_signed_url(version="v4", expiration=3600)
+                    apk_blob_name = blob_name
+                    print(f"Found APK artifact: {blob_name}")
             
             # If no artifact found in build results, try listing the bucket
             if not apk_url:
@@ -402,14 +535,17 @@ def get_cloud_build_status_and_apk_url(project_id: str, build_id: str, gcs_bucke
                     apk_url = apks[0][1]  # Get the signed URL of the latest APK
                     print(f"Found latest APK via bucket listing")
 
-        return status, build_info.log_url, apk_url
+        return status, build_info.log_url, apk_url, apk_blob_name
 
     except Exception as e:
         error_message = f"Error getting build status: {e}"
         print(error_message)
-        return "ERROR", None, None
+        tracing.record_error(e)
+        return "ERROR", None, None, None
 
 # --- Helper: Validate and Fix Dart Null Safety ---
+@metrics.timed("validate")
+@tracing.traced("validate")
 def validate_and_fix_dart_null_safety(content: str) -> tuple[bool, str, str]:
     """
     Validates and attempts to fix non-nullable fields in Dart code.
@@ -451,90 +587,422 @@ def validate_and_fix_dart_null_safety(content: str) -> tuple[bool, str, str]:
     
     return True, '\n'.join(fixed_lines), ""
 
+def prepare_generated_files(generated_text: str):
+    """Parses Claude output and applies null-safety validation. Returns (files, error_message)."""
+    # Parse generated code
+    files = parse_generated_code(generated_text)
+    if "error" in files:
+        return None, files["error"]
+    
+    # Validate and fix Dart null safety
+    if "main.dart" in files:
+        success, fixed_content, error_message = validate_and_fix_dart_null_safety(files["main.dart"])
+        if not success:
+            return None, error_message
+        files["main.dart"] = fixed_content
+    
+    # Log successful extraction
+    print(f"Successfully extracted files: {list(files.keys())}")
+    return files, None
+
+def find_cached_build(files: dict):
+    """
+    Looks up a previous successful build of identical source.
+    Returns (source_hash, cache_entry); cache_entry carries a fresh download_url on a hit.
+    """
+    source_hash = hash_generated_files(files)
+    credentials = get_gcp_credentials()
+    if not credentials:
+        return source_hash, None
+    storage_client = gcp_clients.get_storage_client(GCP_SERVICE_ACCOUNT_KEY_PATH)
+    with metrics.stage_timer("artifact_lookup"), tracing.span("artifact.lookup", source_hash=source_hash) as span:
+        cached = resolve_cached_artifact(get_artifact_cache(), source_hash, storage_client)
+        if span is not None:
+            span.set_attributes(hit=cached is not None, build_id=cached and cached["build_id"])
+    if cached:
+        get_build_status_store().transition(cached["build_id"], "SUCCESS", {
+            "download_url": cached["download_url"],
+            "source_hash": source_hash
+        })
+    return source_hash, cached
+
+def push_and_trigger_build(files: dict, job_id: str, source_hash: str = None, user_id: str = None,
+                           priority: str = PRIORITY_INTERACTIVE):
+    """
+    Pushes generated files to the job's own branch and builds that exact commit,
+    so concurrent jobs never overwrite each other. Returns (build_id, error_message, queued).
+    When the build scheduler has no free capacity, queued is True and build_id is None:
+    the build starts later and its status is tracked under job_id until then.
+    """
+    # Update GitHub repository
+    branch_name = build_branch_name(job_id)
+    success, message, commit_sha = update_github_repository(files, GITHUB_REPO_URL, GITHUB_PAT, "Update Flutter app files", branch_name)
+    if not success:
+        return None, message, False
+
+    def start(build_request):
+        build_id, build_message = trigger_cloud_build(GCP_PROJECT_ID, GITHUB_REPO_URL, branch_name, commit_sha)
+        return record_build_start(build_request, build_id, build_message, branch_name, commit_sha, source_hash)
+
+    build_request = get_build_scheduler().submit(job_id, user_id, start, priority)
+    return scheduled_build_result(build_request)
+
+def record_build_start(build_request, build_id: str, build_message: str, branch_name: str, commit_sha: str,
+                       source_hash: str = None):
+    """Stores the outcome of a scheduler-started create_build; returns (build_id, error_message) for the scheduler."""
+    store = get_build_status_store()
+    job_id, user_id = build_request.job_id, build_request.user_id
+    if not build_id:
+        delete_build_branch(branch_name)
+        if build_request.queued:
+            store.transition(job_id, "FAILURE", {"error": build_message}, user_id=user_id)
+        return None, build_message
+
+    # Store initial build status; webhook and artifact spans continue the trace that started the build
+    tracing.set_attributes(build_id=build_id, job_id=job_id)
+    fields = {
+        "message": "Build triggered successfully",
+        "source_hash": source_hash,
+        "job_id": job_id,
+        "branch": branch_name,
+        "commit_sha": commit_sha
+    }
+    if tracing.current_traceparent():
+        fields["traceparent"] = tracing.current_traceparent()
+    if build_request.queued:
+        # Clients already hold the job id; later statuses are copied to that record too
+        fields["scheduled_as"] = job_id
+    store.transition(build_id, "PENDING", fields, user_id=user_id)
+    if build_request.queued:
+        store.transition(job_id, "PENDING", {"message": "Build triggered successfully", "cloud_build_id": build_id},
+                         user_id=user_id)
+    return build_id, None
+
+def scheduled_build_result(build_request):
+    """(build_id, error_message, queued) for a submitted build; a queued build is tracked under its job id."""
+    if build_request.queued:
+        get_build_status_store().transition(build_request.job_id, "SCHEDULED", {
+            "message": "Waiting for build capacity",
+            "job_id": build_request.job_id,
+            "priority": build_request.priority
+        }, user_id=build_request.user_id)
+        return None, None, True
+    return build_request.build_id, build_request.error, False
+
+def trigger_build_for_source(files: dict, source_hash: str, user_id: str = None, priority: str = PRIORITY_INTERACTIVE):
+    """
+    push_and_trigger_build on a fresh job branch, shared by concurrent callers with the
+    same source hash so identical source is only pushed and built once.
+    Returns (build_id, job_id, error_message, queued).
+    """
+    def trigger():
+        job_id = str(uuid.uuid4())
+        build_id, error_message, queued = push_and_trigger_build(files, job_id, source_hash, user_id, priority)
+        return build_id, job_id, error_message, queued
+    result, _ = build_flight.do(source_hash, trigger)
+    return result
+
+def queued_build_body(job_id: str) -> dict:
+    return {
+        "status": "queued",
+        "build_id": None,
+        "job_id": job_id,
+        "queue_position": get_build_scheduler().position(job_id),
+        "status_url": f"/api/build-status/{job_id}",
+        "message": "Waiting for build capacity"
+    }
+
+def observe_build_finished(build_info: dict):
+    """Build time from trigger (record creation) to terminal status, and the outcome."""
+    metrics.observe_stage("build", time.time() - build_info["created_at"])
+    metrics.BUILD_RESULTS.inc(status=build_info["status"])
+
+def transition_build_status(build_id: str, status: str, fields: dict = None, drop_fields=()):
+    """store.transition(), repeated on the job-id record of a build that had to wait for capacity."""
+    store = get_build_status_store()
+    changed, build_info = store.transition(build_id, status, fields, drop_fields)
+    if changed and build_info.get("scheduled_as"):
+        store.transition(build_info["scheduled_as"], status, fields, drop_fields)
+    return changed, build_info
+
+def run_generation(user_prompt: str, user_id: str, use_cache: bool = True, priority: str = PRIORITY_INTERACTIVE):
+    """
+    Claude call, file preparation and build trigger for one request.
+    Returns (response_body, status_code, generated_text).
+    """
+    api_response, status_code, generated_text = call_claude_api(user_prompt, user_id, use_cache=use_cache)
+    if status_code != 200:
+        return {"error": api_response.get("error", "Failed to generate code")}, status_code, None
+
+    files, error_message = prepare_generated_files(generated_text)
+    if error_message:
+        return {"error": error_message}, 400, generated_text
+
+    # Identical source was built before: skip git and Cloud Build entirely
+    source_hash, cached = find_cached_build(files)
+    if cached:
+        return {
+            "status": "success",
+            "build_id": cached["build_id"],
+            "download_url": cached["download_url"],
+            "cached": True,
+            "message": "Reused APK from a previous build of identical source"
+        }, 200, generated_text
+
+    build_id, job_id, error_message, queued = trigger_build_for_source(files, source_hash, user_id, priority)
+    if queued:
+        return queued_build_body(job_id), 202, generated_text
+    if not build_id:
+        return {"error": error_message}, 500, generated_text
+
+    return {
+        "status": "success",
+        "build_id": build_id,
+        "job_id": job_id,
+        "message": "Build triggered successfully"
+    }, 200, generated_text
+
 @app.route("/api/v1/generate-app-real-build", methods=["POST"])
 def generate_app_real_build():
     try:
         data = request.get_json()
         user_prompt = data.get("prompt")
-        user_id = data.get("user_id", str(uuid.uuid4()))
-        
-        # Call Claude API
-        api_response, status_code, generated_text = call_claude_api(user_prompt, user_id)
-        if status_code != 200:
-            return jsonify({"error": api_response.get("error", "Failed to generate code")}), status_code
-        
-        # Parse generated code
-        files = parse_generated_code(generated_text)
-        if "error" in files:
-            return jsonify({"error": files["error"]}), 400
-        
-        # Validate and fix Dart null safety
-        if "main.dart" in files:
-            success, fixed_content, error_message = validate_and_fix_dart_null_safety(files["main.dart"])
-            if not success:
-                return jsonify({"error": error_message}), 400
-            files["main.dart"] = fixed_content
-        
-        # Log successful extraction
-        print(f"Successfully extracted files: {list(files.keys())}")
+        user_id = data.get("user_id")
+        use_cache = not data.get("bypass_cache", False)
+        priority = data.get("priority", PRIORITY_INTERACTIVE)  # "interactive" or "batch"
         
-        # Update GitHub repository
-        success, message = update_github_repository(files, GITHUB_REPO_URL, GITHUB_PAT, "Update Flutter app files")
-        if not success:
-            return jsonify({"error": message}), 500
-        
-        # Trigger Cloud Build
-        build_id, build_message = trigger_cloud_build(GCP_PROJECT_ID, GITHUB_REPO_URL)
-        if not build_id:
-            return jsonify({"error": build_message}), 500
-        
-        # Store initial build status
-        build_statuses[build_id] = {
-            "status": "PENDING",
-            "message": "Build triggered successfully"
-        }
-        
-        return jsonify({
-            "status": "success",
-            "build_id": build_id,
-            "message": "Build triggered successfully"
-        })
+        # Requests with the same normalized prompt and history share one in-flight generation
+        key = make_request_key(user_prompt, get_session_store().get_messages(user_id), use_cache=use_cache)
+        (leader_id, (body, status_code, generated_text)), shared = generation_flight.do(
+            key, lambda: (user_id, run_generation(user_prompt, user_id, use_cache, priority)))
+        tracing.set_attributes(build_id=body.get("build_id"), job_id=body.get("job_id"), coalesced=shared)
+        if shared:
+            body = dict(body, coalesced=True)
+            # The leader recorded the turn in its own history; a different user needs it in theirs
+            if generated_text and status_code in (200, 202) and leader_id != user_id:
+                record_conversation_turn(user_id, user_prompt, generated_text)
+        return jsonify(body), status_code
         
     except Exception as e:
         print(f"Error in generate_app_real_build: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/api/v1/generate-app-stream", methods=["POST"])
+def generate_app_stream():
+    """
+    Same pipeline as /api/v1/generate-app-real-build, reported as server-sent events.
+    Events: started, progress, file, pubspec, generated, build_triggered, error.
+    Each file is emitted as soon as its code block closes in Claude's stream.
+    """
+    data = request.get_json()
+    if not data or not data.get("prompt"):
+        return jsonify({"error": "No prompt provided"}), 400
+    user_prompt = data["prompt"]
+    user_id = data.get("user_id")
+    priority = data.get("priority", PRIORITY_INTERACTIVE)
+
+    def events():
+        parser = IncrementalCodeParser()
+        chunks = []
+        received_chars = 0
+        last_progress = 0.0
+        yield format_sse("started", {"user_id": user_id})
+        try:
+            for delta in call_claude_api_stream(user_prompt, user_id):
+                chunks.append(delta)
+                received_chars += len(delta)
+                now = time.monotonic()
+                if now - last_progress >= STREAM_PROGRESS_INTERVAL_SECONDS:
+                    last_progress = now
+                    yield format_sse("progress", {"chars": received_chars})
+                for filename, content in parser.feed(delta):
+                    yield format_sse("file", {"filename": filename, "content": content})
+                    if filename == "pubspec.yaml":
+                        # Validate early, while main.dart may still be generating
+                        yaml_error = validate_pubspec_syntax(content)
+                        yield format_sse("pubspec", {"valid": yaml_error is None, "error": yaml_error})
+            for filename, content in parser.close():
+                yield format_sse("file", {"filename": filename, "content": content})
+
+            files, error_message = prepare_generated_files("".join(chunks))
+            if error_message:
+                yield format_sse("error", {"error": error_message})
+                return
+            yield format_sse("generated", {"files": list(files.keys()), "chars": received_chars})
+
+            source_hash, cached = find_cached_build(files)
+            if cached:
+                yield format_sse("build_cached", {
+                    "status": "success",
+                    "build_id": cached["build_id"],
+                    "download_url": cached["download_url"]
+                })
+                return
+
+            build_id, job_id, error_message, queued = trigger_build_for_source(files, source_hash, user_id, priority)
+            if queued:
+                yield format_sse("build_queued", queued_build_body(job_id))
+                return
+            if not build_id:
+                yield format_sse("error", {"error": error_message})
+                return
+            yield format_sse("build_triggered", {
+                "status": "success",
+                "build_id": build_id,
+                "job_id": job_id,
+                "message": "Build triggered successfully"
+            })
+        except Exception as e:
+            print(f"Error in generate_app_stream: {str(e)}")
+            yield format_sse("error", {"error": str(e)})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def build_status_body(build_id: str, build_info: dict) -> dict:
+    # If build is complete and we have a download URL
+    if build_info["status"] == "SUCCESS" and "download_url" in build_info:
+        body = {
+            "status": "success",
+            "build_id": build_id,
+            "download_url": build_info["download_url"],
+            "version": build_info["version"]
+        }
+    else:
+        # For builds in progress or failed
+        body = {
+            "status": build_info["status"],
+            "build_id": build_id,
+            "version": build_info["version"]
+        }
+        if build_info.get("error"):
+            body["error"] = build_info["error"]
+        if build_info["status"] == "SCHEDULED":
+            body["queue_position"] = get_build_scheduler().position(build_id)
+    # Builds that waited for capacity are looked up by job id; name the Cloud Build they became
+    if build_info.get("cloud_build_id"):
+        body["cloud_build_id"] = build_info["cloud_build_id"]
+    return body
+
+def build_status_is_final(build_info: dict) -> bool:
+    """Terminal, and for SUCCESS also carrying the download URL (or why it has none), so nothing further will change."""
+    if build_info["status"] == "SUCCESS":
+        return "download_url" in build_info or "error" in build_info
+    return build_info["status"] in TERMINAL_BUILD_STATUSES
+
+def parse_status_version(value):
+    """Accepts a version as sent in ?version= or an ETag such as W/"3"."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        return None
+
 @app.route("/api/build-status/<build_id>", methods=["GET"])
 def get_build_status(build_id):
+    """
+    Returns the build status with its version, also sent as the ETag.
+    Long-poll: with If-None-Match (or ?version=) set to the last seen version and ?wait=<seconds>,
+    the request is held until the status changes; 304 means nothing changed within the wait.
+    """
     try:
         # Check if we have stored status for this build
-        if build_id not in build_statuses:
+        store = get_build_status_store()
+        build_info = store.get(build_id)
+        if build_info is None:
             return jsonify({
                 "error": "Build ID not found",
                 "build_id": build_id
             }), 404
 
-        build_info = build_statuses[build_id]
-        
-        # If build is complete and we have a download URL
-        if build_info["status"] == "SUCCESS" and "download_url" in build_info:
-            return jsonify({
-                "status": "success",
-                "build_id": build_id,
-                "download_url": build_info["download_url"]
-            })
-        
-        # For builds in progress or failed
-        return jsonify({
-            "status": build_info["status"],
-            "build_id": build_id
-        })
+        known_version = parse_status_version(request.headers.get("If-None-Match") or request.args.get("version"))
+        wait_seconds = min(request.args.get("wait", 0, type=float), BUILD_STATUS_MAX_WAIT_SECONDS)
+        if known_version == build_info["version"] and wait_seconds > 0 and not build_status_is_final(build_info):
+            build_info = store.wait_for_change(build_id, known_version, wait_seconds) or build_info
+        if known_version == build_info["version"]:
+            return Response(status=304, headers={"ETag": f'"{build_info["version"]}"'})
+
+        response = jsonify(build_status_body(build_id, build_info))
+        response.headers["ETag"] = f'"{build_info["version"]}"'
+        return response
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/build-status/<build_id>/stream", methods=["GET"])
+def stream_build_status(build_id):
+    """
+    Server-sent events: a "status" event now and on every change, ending once the status is final.
+    Reconnecting clients send Last-Event-ID (the version) and only get changes they have not seen.
+    """
+    store = get_build_status_store()
+    build_info = store.get(build_id)
+    if build_info is None:
+        return jsonify({"error": "Build ID not found", "build_id": build_id}), 404
+    last_version = parse_status_version(request.headers.get("Last-Event-ID"))
+
+    def events():
+        nonlocal build_info, last_version
+        deadline = time.monotonic() + BUILD_STATUS_STREAM_MAX_SECONDS
+        while True:
+            if build_info["version"] != last_version:
+                last_version = build_info["version"]
+                yield f"id: {last_version}\n" + format_sse("status", build_status_body(build_id, build_info))
+            if build_status_is_final(build_info) or time.monotonic() >= deadline:
+                return
+            build_info = store.wait_for_change(build_id, last_version, BUILD_STATUS_KEEPALIVE_SECONDS) or build_info
+            if build_info["version"] == last_version:
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@tracing.traced("artifact.resolve")
+def resolve_build_artifact(build_id: str, apk_blob_name: str = None):
+    """
+    Runs on artifact_executor after the webhook has acked: signs the APK named in the
+    notification, falling back to a get_build lookup, and records the download URL.
+    """
+    tracing.set_attributes(build_id=build_id)
+    try:
+        apk_url = None
+        log_url = None
+        if apk_blob_name and get_gcp_credentials():
+            storage_client = gcp_clients.get_storage_client(GCP_SERVICE_ACCOUNT_KEY_PATH)
+            try:
+                with metrics.stage_timer("sign_url"):
+                    apk_url = storage_client.bucket(GCS_BUCKET_NAME).blob(apk_blob_name).generate_signed_url(version="v4", expiration=3600)
+            except Exception as e:
+                print(f"Error signing APK {apk_blob_name} for build {build_id}: {e}")
+        if not apk_url:
+            _, log_url, apk_url, apk_blob_name = get_cloud_build_status_and_apk_url(GCP_PROJECT_ID, build_id, GCS_BUCKET_NAME)
+
+        if not apk_url:
+            transition_build_status(build_id, "SUCCESS", {"error": "APK not found in build artifacts"})
+            return
+        _, build_info = transition_build_status(build_id, "SUCCESS", {"download_url": apk_url})
+        if apk_blob_name and build_info.get("source_hash"):
+            get_artifact_cache().put(build_info["source_hash"], GCS_BUCKET_NAME, apk_blob_name, build_id, log_url)
+    except Exception as e:
+        print(f"Error resolving APK for build {build_id}: {e}")
+    finally:
+        with resolving_builds_lock:
+            resolving_builds.discard(build_id)
+
 @app.route("/api/cloud-build-webhook", methods=["POST"])
 def cloud_build_webhook():
+    """
+    Pub/Sub push endpoint for Cloud Build notifications. Acks as soon as the status is
+    recorded; the APK URL is resolved in the background. Redelivered messages and
+    repeated or out-of-order statuses are acknowledged without doing any work.
+    """
     try:
         # Get the JSON payload from the request
         payload = request.get_json()
@@ -542,6 +1010,10 @@ def cloud_build_webhook():
         # Extract the message data from Pub/Sub format
         if not payload or 'message' not in payload:
             return jsonify({"error": "Invalid payload format"}), 400
+
+        message_id = pubsub_message_id(payload)
+        if message_id in seen_webhook_messages:
+            return jsonify({"status": "duplicate", "message_id": message_id})
             
         # Decode the base64-encoded message data
         message_data = base64.b64decode(payload['message']['data']).decode('utf-8')
@@ -554,32 +1026,39 @@ def cloud_build_webhook():
         if not build_id or not status:
             return jsonify({"error": "Missing build ID or status"}), 400
             
-        # Store the build status
-        build_statuses[build_id] = {"status": status}
-            
-        # If build was successful, get the APK download URL
-        if status == "SUCCESS":
-            status, log_url, apk_url = get_cloud_build_status_and_apk_url(GCP_PROJECT_ID, build_id, GCS_BUCKET_NAME)
-            if apk_url:
-                # Store the download URL
-                build_statuses[build_id]["download_url"] = apk_url
-                return jsonify({
-                    "status": "success",
-                    "build_id": build_id,
-                    "download_url": apk_url
-                })
-            else:
-                return jsonify({
-                    "status": "error",
-                    "build_id": build_id,
-                    "error": "APK not found in build artifacts"
-                }), 500
-        else:
-            # For non-success statuses, return the status and build ID
-            return jsonify({
-                "status": status,
-                "build_id": build_id
-            })
+        # Store the build status, keeping fields recorded when the build was triggered.
+        # Out-of-order or repeated notifications leave the stored status unchanged.
+        store = get_build_status_store()
+        previous = store.get(build_id) or {}
+        terminal = status in TERMINAL_BUILD_STATUSES
+        tracing.set_attributes(build_id=build_id, status=status)
+        # Recorded in the trace of the request that triggered the build
+        with tracing.span("cloud_build.notification", previous.get("traceparent"), build_id=build_id, status=status):
+            changed, build_info = transition_build_status(build_id, status, drop_fields=("branch",) if terminal else ())
+            seen_webhook_messages.add(message_id)
+
+            # The job's branch is only needed until Cloud Build has finished with it,
+            # and its build slot can go to the next queued build
+            if changed and terminal:
+                delete_build_branch(previous.get("branch"))
+                get_build_scheduler().release(build_id)
+                observe_build_finished(build_info)
+
+            # If build was successful, resolve the APK download URL off the request path
+            if build_info["status"] == "SUCCESS" and not build_status_is_final(build_info):
+                with resolving_builds_lock:
+                    submit = build_id not in resolving_builds
+                    resolving_builds.add(build_id)
+                if submit:
+                    artifact_executor.submit(tracing.bind(resolve_build_artifact), build_id,
+                                             apk_blob_from_build(build_data))
+
+        return jsonify({
+            "status": build_info["status"],
+            "build_id": build_id,
+            "version": build_info["version"],
+            "changed": changed
+        })
             
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -596,19 +1075,39 @@ def list_apks():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# --- Startup ---
+def warm_up():
+    """Resolves secrets and opens the Anthropic and GCP connections so the first request does not pay for them."""
+    started = time.time()
+    api_key = get_anthropic_api_key()
+    api_url = get_anthropic_api_url()
+    print(f"ANTHROPIC_API_KEY: {'Present' if api_key else 'Missing'} (Length: {len(api_key) if api_key else 0})")
+    print(f"ANTHROPIC_API_URL: {api_url}")
+    claude_client.warm_up(api_url)
+    if GCP_SERVICE_ACCOUNT_KEY_PATH:
+        gcp_clients.get_cloud_build_client(GCP_SERVICE_ACCOUNT_KEY_PATH)
+        gcp_clients.get_storage_client(GCP_SERVICE_ACCOUNT_KEY_PATH)
+    print(f"Warm-up finished in {time.time() - started:.2f}s")
+
+def create_app(warm_up_on_start: bool = WARMUP_ON_START):
+    """
+    Returns the Flask app without touching Secret Manager or the GCP SDKs, so the port
+    opens immediately. Optionally warms up in a background thread.
+    """
+    if warm_up_on_start:
+        threading.Thread(target=warm_up, daemon=True).start()
+    return app
+
 if __name__ == "__main__":
     # Log startup information
     print(f"Starting Flask app on 0.0.0.0:{PORT}")
     print(f"Environment: {'Production' if os.getenv('FLASK_ENV') == 'production' else 'Development'}")
     print(f"Debug mode: {'Enabled' if os.getenv('FLASK_DEBUG') == '1' else 'Disabled'}")
     
-    # Start the app immediately
-    app.run(host="0.0.0.0", port=PORT, debug=False)  # debug=False for production
-    print(f"ANTHROPIC_API_KEY status at startup: {'Present' if ANTHROPIC_API_KEY else 'Missing'} (Length: {len(ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else 0})")
-    print(f"ANTHROPIC_API_URL: {ANTHROPIC_API_URL} (Valid: {ANTHROPIC_API_URL == 'https://api.anthropic.com/v1/messages'})")
+    # Start the app immediately; secrets are resolved on first use or by the warm-up thread
+    create_app().run(host="0.0.0.0", port=PORT, debug=False)  # debug=False for production
 else:
     # For Cloud Run, we need to ensure the app is created
+    create_app()
     print(f"App created for Cloud Run on port {PORT}")
-    print(f"ANTHROPIC_API_KEY status at startup: {'Present' if ANTHROPIC_API_KEY else 'Missing'} (Length: {len(ANTHROPIC_API_KEY) if ANTHROPIC_API_KEY else 0})")
-    print(f"ANTHROPIC_API_URL: {ANTHROPIC_API_URL} (Valid: {ANTHROPIC_API_URL == 'https://api.anthropic.com/v1/messages'})")
 
@@ -5,6 +5,9 @@ import time # Added for simulating build delay
 import random # Added for simulating build delay
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
+import claude_client
+from session_store import get_session_store
+from history_compaction import compact_messages, stable_prefix_length
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,10 +16,9 @@ app = Flask(__name__)
 
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 CLAUDE_MODEL = "claude-3-opus-20240229" # Or "claude-3-5-sonnet-20240620"
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+ANTHROPIC_API_URL = os.getenv("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
 
-# Store conversation history in memory for simplicity in this version
-conversation_history = {}
+# Conversation history lives in session_store (bounded, in memory by default)
 
 # Predefined sample APKs for the simulated build service
 SAMPLE_APKS = {
@@ -27,18 +29,12 @@ SAMPLE_APKS = {
     "default": "https://example.com/apks/live_sample_generic_app.apk"
 }
 
-def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None):
+def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None, use_cache: bool = True):
     if not ANTHROPIC_API_KEY:
         return {"error": "Anthropic API key not configured."}, 500
 
-    current_user_history = conversation_history.get(user_id, [])
-    messages_payload = []
-    if not current_user_history:
-        pass 
-        messages_payload.append({"role": "user", "content": user_prompt})
-    else:
-        messages_payload.extend(current_user_history)
-        messages_payload.append({"role": "user", "content": user_prompt})
+    history = compact_messages(get_session_store().get_messages(user_id))
+    messages_payload = history + [{"role": "user", "content": user_prompt}]
 
     headers = {
         "x-api-key": ANTHROPIC_API_KEY,
@@ -64,19 +60,19 @@ def call_claude_api(user_prompt: str, user_id: str, system_prompt: str = None):
         "system": system_prompt if system_prompt else default_system_prompt,
         "temperature": 0.3 
     }
+    claude_client.apply_prompt_caching(payload, stable_prefix_length(history))
 
     try:
-        response = requests.post(ANTHROPIC_API_URL, headers=headers, json=payload, timeout=180) 
-        response.raise_for_status()  
-        api_response_json = response.json()
+        api_response_json = claude_client.create_message(ANTHROPIC_API_URL, headers, payload, timeout=180, use_cache=use_cache, user_id=user_id)
 
-        current_user_history.append({"role": "user", "content": user_prompt})
         if api_response_json.get("content") and isinstance(api_response_json["content"], list) and len(api_response_json["content"]) > 0:
             assistant_response_text = api_response_json["content"][0].get("text", "")
-            current_user_history.append({"role": "assistant", "content": assistant_response_text})
-        conversation_history[user_id] = current_user_history[-10:] 
+            get_session_store().append_turn(user_id, user_prompt, assistant_response_text)
 
         return api_response_json, 200
+    except claude_client.SchedulerTimeout as e:
+        # Too many calls queued ahead of this one; the client should retry later
+        return {"error": f"Claude API is busy: {e}"}, 503
     except requests.exceptions.RequestException as e:
         print(f"Error calling Claude API: {e}")
         error_message = f"Error calling Claude API: {e}"
@@ -100,9 +96,10 @@ def generate_app_live():
     user_prompt = data["prompt"]
     user_id = data.get("user_id", "default_user")
     system_prompt_override = data.get("system_prompt", None)
+    use_cache = not data.get("bypass_cache", False)
 
     # 1. Call Claude API to generate code
-    claude_response, status_code = call_claude_api(user_prompt, user_id, system_prompt_override)
+    claude_response, status_code = call_claude_api(user_prompt, user_id, system_prompt_override, use_cache=use_cache)
     
     if status_code != 200:
         return jsonify(claude_response), status_code
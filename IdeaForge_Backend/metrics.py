@@ -0,0 +1,308 @@
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics with a Prometheus text exposition, no client library needed.
+# Recording is a dict lookup and an increment under a per-metric lock (a couple of
+# microseconds), so stages are timed on every request. Components that already keep
+# stats dicts (schedulers, single-flight, the Claude client) are read at scrape time
+# through register_stats() instead of being instrumented twice.
+
+METRICS_ENABLED = os.getenv("IDEAFORGE_METRICS", "1") == "1"
+# Seconds; covers sub-millisecond parsing up to a 20 minute build
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(float(bound))
+                bucket_labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._stats_sources = {}  # prefix -> (stats function, counter keys, label name)
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_stats(self, prefix: str, stats_fn, counters=(), label: str = "kind"):
+        """
+        Exposes a component's stats() dict at scrape time: numeric entries become
+        <prefix>_<key> gauges, or <prefix>_<key>_total counters for keys in counters;
+        dict entries become one series per item, labelled with label. None is skipped.
+        Registering the same prefix again replaces the source.
+        """
+        with self._lock:
+            self._stats_sources[prefix] = (stats_fn, frozenset(counters), label)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            sources = sorted(self._stats_sources.items())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, (stats_fn, counters, label) in sources:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                print(f"Metrics: reading {prefix} stats failed: {e}")
+                continue
+            for key in sorted(stats):
+                value = stats[key]
+                if value is None or isinstance(value, bool):
+                    continue
+                name = f"{prefix}_{key}_total" if key in counters else f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} {'counter' if key in counters else 'gauge'}")
+                if isinstance(value, dict):
+                    for item, item_value in sorted(value.items()):
+                        lines.append(f"{name}{_format_labels((label,), (item,))} {_format_value(item_value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Shared metrics; label values are small fixed sets, never ids
+STAGE_SECONDS = REGISTRY.histogram(
+    "ideaforge_stage_seconds", "Duration of each generation pipeline stage.", ("stage",))
+STAGE_FAILURES = REGISTRY.counter(
+    "ideaforge_stage_failures_total", "Pipeline stages that ended in an error.", ("stage",))
+BUILD_RESULTS = REGISTRY.counter(
+    "ideaforge_build_results_total", "Cloud Builds by terminal status (POLL_TIMEOUT: polling gave up).", ("status",))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "ideaforge_http_request_seconds", "HTTP request latency by route.", ("route", "method", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "ideaforge_http_requests_in_flight", "HTTP requests currently being served.")
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Times a block as stage; an exception escaping the block also counts as a stage failure."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def timed(stage: str):
+    """Decorator form of stage_timer(), for functions and coroutine functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_failure(stage: str):
+    """For stages that report errors by return value instead of raising."""
+    STAGE_FAILURES.inc(stage=stage)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def register_stats(prefix: str, stats_fn, counters=(), label: str = "kind"):
+    REGISTRY.register_stats(prefix, stats_fn, counters, label)
+
+
+def instrument_flask(app):
+    """Times every request of a Flask app by route and serves the registry at /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _observe_request(response):
+        # Streaming responses are measured to their first byte
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method,
+                                         status=str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def _end_request(_):
+        HTTP_IN_FLIGHT.dec()
+
+    app.add_url_rule("/metrics", "metrics", lambda: Response(render(), headers={"Content-Type": CONTENT_TYPE}))
+    return app
+
+
+def instrument_aiohttp(app):
+    """instrument_flask() for an aiohttp web.Application (call before it starts)."""
+    from aiohttp import web
+
+    @web.middleware
+    async def observe_request(request, handler):
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            resource = request.match_info.route.resource
+            route = resource.canonical if resource is not None else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method,
+                                         status=str(status))
+
+    async def metrics_handler(request):
+        return web.Response(body=render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    app.middlewares.append(observe_request)
+    app.router.add_get("/metrics", metrics_handler)
+    return app
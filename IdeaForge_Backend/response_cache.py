@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Content-addressed cache for Claude Messages API responses.
+# Keys hash everything that determines the generation, so identical prompts with
+# identical history are answered from memory (or disk) instead of a fresh API call.
+
+CACHE_MAX_BYTES = int(os.getenv("CLAUDE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Optional directory for a second tier that survives restarts; unset disables it
+CACHE_DIR = os.getenv("CLAUDE_CACHE_DIR")
+
+# Payload fields that affect the generated output
+KEY_FIELDS = ("model", "system", "messages", "temperature", "max_tokens")
+
+
+def make_cache_key(payload: dict) -> str:
+    keyed = {field: payload.get(field) for field in KEY_FIELDS}
+    canonical = json.dumps(keyed, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache: an in-memory LRU bounded by total serialized bytes, and an
+    optional on-disk tier with one JSON file per key. Thread-safe.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, disk_dir: str = None):
+        self._max_bytes = max_bytes
+        self._disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key: str):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return json.loads(data)
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._insert_locked(key, data)
+        return json.loads(data)
+
+    def put(self, key: str, response_json: dict):
+        data = json.dumps(response_json, separators=(",", ":"))
+        with self._lock:
+            self._stats["stores"] += 1
+            self._insert_locked(key, data)
+        self._write_disk(key, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._current_bytes
+            return stats
+
+    def _insert_locked(self, key: str, data: str):
+        size = len(data)
+        if size > self._max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._current_bytes -= len(previous)
+        self._entries[key] = data
+        self._current_bytes += size
+        while self._current_bytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._current_bytes -= len(evicted)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self._disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str):
+        if not self._disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Error reading response cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, data: str):
+        if not self._disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Atomic, so readers never see a partial entry
+        except OSError as e:
+            print(f"Error writing response cache entry {key}: {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide cache, configured from CLAUDE_CACHE_* environment variables."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(CACHE_MAX_BYTES, CACHE_DIR)
+                metrics.register_stats("ideaforge_response_cache", _cache.stats,
+                                       counters=("memory_hits", "disk_hits", "misses", "stores", "evictions"))
+    return _cache
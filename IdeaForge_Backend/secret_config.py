@@ -0,0 +1,50 @@
+import os
+import threading
+import time
+
+# Lazily resolved, TTL-cached Secret Manager values. Nothing is fetched at import
+# time, so the server can accept requests before any secret has been read, and
+# rotated secrets are picked up once the TTL expires.
+
+SECRET_TTL_SECONDS = int(os.getenv("SECRET_TTL_SECONDS", "300"))
+# Failed lookups are remembered briefly so an absent optional secret is not re-fetched per request
+SECRET_MISS_TTL_SECONDS = int(os.getenv("SECRET_MISS_TTL_SECONDS", "30"))
+
+_client = None
+_lock = threading.Lock()
+_cache = {}  # (secret_id, version_id) -> (value, expires_at)
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                # Deferred: the Secret Manager SDK is slow to import
+                from google.cloud import secretmanager
+                _client = secretmanager.SecretManagerServiceClient()
+    return _client
+
+
+def get_secret(secret_id: str, version_id: str = "latest", ttl_seconds: int = SECRET_TTL_SECONDS):
+    """
+    Returns the secret value, fetching it on first use and again after ttl_seconds.
+    If a refresh fails, the previous value (or None) is served and the lookup retried after SECRET_MISS_TTL_SECONDS.
+    """
+    key = (secret_id, version_id)
+    cached = _cache.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    project_id = os.environ.get("GCP_PROJECT_ID")
+    name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
+    try:
+        response = _get_client().access_secret_version(request={"name": name})
+        value = response.payload.data.decode("UTF-8")
+    except Exception as e:
+        print(f"Error loading secret {secret_id}: {e}")
+        value = cached[0] if cached else None
+        _cache[key] = (value, time.monotonic() + SECRET_MISS_TTL_SECONDS)
+        return value
+    _cache[key] = (value, time.monotonic() + ttl_seconds)
+    return value
@@ -0,0 +1,286 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import metrics
+
+# Per-user conversation history sent back to Claude on follow-up requests.
+# Memory stays bounded under any traffic: sessions are evicted least-recently-used
+# once the global byte budget is exceeded or after SESSION_IDLE_TTL_SECONDS without
+# use, each session keeps at most SESSION_MAX_TURNS turns, and turn text is stored
+# zlib-compressed (generated Dart code compresses several times over).
+#
+# SESSION_STORE_BACKEND=sqlite keeps sessions in a SQLite file instead, so they survive
+# restarts and are shared by the server processes on one host. SQLite's WAL mode needs
+# shared memory, so separate Cloud Run instances or a network filesystem cannot share it.
+
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")  # "memory" or "sqlite"
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "/tmp/ideaforge_sessions.db")
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "5"))  # One turn = user prompt + assistant reply
+SESSION_IDLE_TTL_SECONDS = int(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+SESSION_SWEEP_INTERVAL_SECONDS = 60
+
+# Rough fixed cost of a session and of a turn on top of the compressed text
+_SESSION_OVERHEAD_BYTES = 256
+_TURN_OVERHEAD_BYTES = 128
+
+
+def pack_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def unpack_text(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+
+def turns_to_messages(turns) -> list:
+    """Expands packed (user_prompt, assistant_text) turns into Messages API messages."""
+    messages = []
+    for packed_prompt, packed_reply in turns:
+        messages.append({"role": "user", "content": unpack_text(packed_prompt)})
+        messages.append({"role": "assistant", "content": unpack_text(packed_reply)})
+    return messages
+
+
+def _turns_size(turns) -> int:
+    return _SESSION_OVERHEAD_BYTES + sum(len(p) + len(r) + _TURN_OVERHEAD_BYTES for p, r in turns)
+
+
+class SessionStore:
+    """Interface for conversation history backends. A falsy user_id never has history."""
+
+    def get_messages(self, user_id: str) -> list:
+        raise NotImplementedError
+
+    def append_turn(self, user_id: str, user_prompt: str, assistant_text: str):
+        raise NotImplementedError
+
+    def clear(self, user_id: str):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class _Session:
+    __slots__ = ("turns", "size", "last_used")
+
+    def __init__(self):
+        self.turns = []
+        self.size = _SESSION_OVERHEAD_BYTES
+        self.last_used = time.monotonic()
+
+
+class MemorySessionStore(SessionStore):
+    """Process-local LRU of compressed sessions under a global byte budget."""
+
+    def __init__(self, max_bytes: int = SESSION_MAX_BYTES, max_turns: int = SESSION_MAX_TURNS,
+                 idle_ttl_seconds: int = SESSION_IDLE_TTL_SECONDS):
+        self._max_bytes = max_bytes
+        self._max_turns = max_turns
+        self._idle_ttl = idle_ttl_seconds
+        self._sessions = OrderedDict()  # least recently used first
+        self._bytes = 0
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {"evicted_lru": 0, "evicted_idle": 0}
+
+    def get_messages(self, user_id: str) -> list:
+        if not user_id:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return []
+            if now - session.last_used > self._idle_ttl:
+                self._remove_locked(user_id)
+                self._stats["evicted_idle"] += 1
+                return []
+            session.last_used = now
+            self._sessions.move_to_end(user_id)
+            turns = list(session.turns)
+        return turns_to_messages(turns)
+
+    def append_turn(self, user_id: str, user_prompt: str, assistant_text: str):
+        if not user_id:
+            return
+        turn = (pack_text(user_prompt), pack_text(assistant_text or ""))
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = self._sessions[user_id] = _Session()
+                self._bytes += session.size
+            session.turns.append(turn)
+            del session.turns[:-self._max_turns]
+            new_size = _turns_size(session.turns)
+            self._bytes += new_size - session.size
+            session.size = new_size
+            session.last_used = now
+            self._sessions.move_to_end(user_id)
+            if now - self._last_sweep >= SESSION_SWEEP_INTERVAL_SECONDS:
+                self._last_sweep = now
+                self._sweep_idle_locked(now)
+            while self._bytes > self._max_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                self._remove_locked(oldest)
+                self._stats["evicted_lru"] += 1
+
+    def clear(self, user_id: str):
+        with self._lock:
+            if user_id in self._sessions:
+                self._remove_locked(user_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+            stats["bytes"] = self._bytes
+            return stats
+
+    def _remove_locked(self, user_id: str):
+        self._bytes -= self._sessions.pop(user_id).size
+
+    def _sweep_idle_locked(self, now: float):
+        # LRU order is also last-use order, so idle sessions are all at the front
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self._idle_ttl:
+                break
+            self._remove_locked(user_id)
+            self._stats["evicted_idle"] += 1
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Shared backend: one row per user holding the packed turns, indexed by last use.
+    Idle and over-budget sessions are deleted oldest-first at most once per sweep interval.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, max_bytes: int = SESSION_MAX_BYTES,
+                 max_turns: int = SESSION_MAX_TURNS, idle_ttl_seconds: int = SESSION_IDLE_TTL_SECONDS):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._max_turns = max_turns
+        self._idle_ttl = idle_ttl_seconds
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " user_id TEXT PRIMARY KEY,"
+            " updated_at REAL NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " turns BLOB NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _decode_turns(blob: bytes) -> list:
+        # Row blob: the [user_prompt, assistant_text] pairs as JSON, compressed as a whole
+        return json.loads(unpack_text(blob))
+
+    @staticmethod
+    def _encode_turns(turns) -> bytes:
+        return pack_text(json.dumps(turns))
+
+    def get_messages(self, user_id: str) -> list:
+        if not user_id:
+            return []
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT turns FROM sessions WHERE user_id = ? AND updated_at >= ?",
+            (user_id, time.time() - self._idle_ttl),
+        ).fetchone()
+        if row is None:
+            return []
+        conn.execute("UPDATE sessions SET updated_at = ? WHERE user_id = ?", (time.time(), user_id))
+        messages = []
+        for user_prompt, assistant_text in self._decode_turns(row[0]):
+            messages.append({"role": "user", "content": user_prompt})
+            messages.append({"role": "assistant", "content": assistant_text})
+        return messages
+
+    def append_turn(self, user_id: str, user_prompt: str, assistant_text: str):
+        if not user_id:
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT turns FROM sessions WHERE user_id = ? AND updated_at >= ?",
+                (user_id, time.time() - self._idle_ttl),
+            ).fetchone()
+            turns = self._decode_turns(row[0]) if row else []
+            turns.append([user_prompt, assistant_text or ""])
+            turns = turns[-self._max_turns:]
+            blob = self._encode_turns(turns)
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, updated_at, size, turns) VALUES (?, ?, ?, ?)",
+                (user_id, time.time(), len(blob) + _SESSION_OVERHEAD_BYTES, blob),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._maybe_sweep()
+
+    def clear(self, user_id: str):
+        self._connection().execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def stats(self) -> dict:
+        count, total = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        return {"sessions": count, "bytes": total}
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < SESSION_SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        conn = self._connection()
+        try:
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self._idle_ttl,))
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM sessions").fetchone()[0] - self._max_bytes
+            if excess <= 0:
+                return
+            evict = []
+            for user_id, size in conn.execute("SELECT user_id, size FROM sessions ORDER BY updated_at"):
+                evict.append((user_id,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM sessions WHERE user_id = ?", evict)
+        except sqlite3.Error as e:
+            print(f"Error sweeping session store: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if SESSION_STORE_BACKEND == "sqlite":
+                    _store = SQLiteSessionStore(SESSION_DB_PATH)
+                else:
+                    _store = MemorySessionStore()
+                metrics.register_stats("ideaforge_sessions", _store.stats, counters=("evicted_lru", "evicted_idle"))
+    return _store
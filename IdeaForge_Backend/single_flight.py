@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import json
+import threading
+
+# Coalesces identical work that is already in flight: the first caller for a key
+# runs the function, and callers arriving before it finishes wait for and share
+# its result instead of repeating the Claude call, git push and Cloud Build.
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Prompts differing only in case or whitespace ask for the same app."""
+    return " ".join((prompt or "").split()).casefold()
+
+
+def make_request_key(prompt: str, history: list = None, **extra) -> str:
+    """Key for a generation request: the normalized prompt plus everything else that shapes the answer."""
+    canonical = json.dumps({"prompt": normalize_prompt(prompt), "history": history or [], "extra": extra},
+                           sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def do(self, key: str, fn, *args, **kwargs):
+        """
+        Returns (result, shared). shared is True when the result came from another
+        caller's in-flight run; an exception raised by that run is re-raised here too.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self._stats["followers"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.followers:
+                print(f"Single-flight {key[:12]}: result shared with {call.followers} identical request(s)")
+        return call.result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+            return stats
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop."""
+
+    def __init__(self):
+        self._tasks = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    async def do(self, key: str, coro_fn, *args, **kwargs):
+        """
+        Returns (result, shared). The shared run is shielded, so a caller that goes away
+        (e.g. a disconnected client) does not cancel it for the others.
+        """
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self._stats["followers"] += 1
+        else:
+            self._stats["leaders"] += 1
+            task = self._tasks[key] = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._tasks)
+        return stats
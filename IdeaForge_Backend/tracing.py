@@ -0,0 +1,433 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Request-scoped trace spans for following one request end to end: HTTP handler,
+# Claude attempts, git subprocesses, Cloud Build RPCs and polls, artifact lookups.
+# The current span lives in a context variable, so asyncio tasks inherit it; work
+# handed to other threads carries it with bind(). Finished spans go onto a bounded
+# queue drained by a background thread that writes them to the exporter in
+# batches; a full queue drops spans rather than blocking the request.
+# Sampling is decided once per trace, at its root span.
+
+# JSON-lines file that finished spans are appended to; unset disables tracing
+TRACE_FILE = os.getenv("IDEAFORGE_TRACE_FILE")
+# Fraction of new traces recorded; an incoming sampled traceparent is always honoured
+TRACE_SAMPLE_RATE = float(os.getenv("IDEAFORGE_TRACE_SAMPLE_RATE", "0.1"))
+TRACE_QUEUE_SIZE = int(os.getenv("IDEAFORGE_TRACE_QUEUE_SIZE", "10000"))
+TRACE_BATCH_SIZE = int(os.getenv("IDEAFORGE_TRACE_BATCH_SIZE", "256"))
+TRACE_FLUSH_INTERVAL_SECONDS = float(os.getenv("IDEAFORGE_TRACE_FLUSH_INTERVAL_SECONDS", "2"))
+
+# Copied from a parent span to every child, so any span of a build can be found by id
+PROPAGATED_ATTRIBUTES = ("job_id", "build_id")
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "sampled", "start", "end", "attributes", "status",
+                 "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str, sampled: bool, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start = time.time()
+        self.end = None
+        self.attributes = {}
+        self.status = "ok"
+        self.error = None
+        if attributes:
+            self.set_attributes(**attributes)
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent header value, used to continue this trace elsewhere."""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value):
+        if self.sampled and value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error):
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter:
+    """Receives finished spans in batches on the processor thread."""
+
+    def export(self, spans: list):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class JsonLinesExporter(SpanExporter):
+    """Appends one JSON object per span to a file, for offline analysis."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: list):
+        self._file.write("".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans))
+        self._file.flush()
+
+    def shutdown(self):
+        self._file.close()
+
+
+class BatchSpanProcessor:
+    """Queues finished spans and exports them in batches from a daemon thread."""
+
+    def __init__(self, exporter: SpanExporter, max_queue_size: int = TRACE_QUEUE_SIZE,
+                 batch_size: int = TRACE_BATCH_SIZE, flush_interval: float = TRACE_FLUSH_INTERVAL_SECONDS):
+        self.exporter = exporter
+        self._queue = queue.Queue(max_queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"exported": 0, "dropped": 0, "export_errors": 0}
+
+    def on_end(self, span: Span):
+        if self._thread is None:
+            self._start_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self._bump(dropped=1)
+
+    def force_flush(self, timeout: float = 5):
+        """Blocks until the spans queued so far have been exported (or timeout)."""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        if self._thread is None:
+            self._start_thread()
+        return done.wait(timeout)
+
+    def shutdown(self):
+        self.force_flush()
+        self.exporter.shutdown()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+    def _bump(self, **deltas):
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def _start_thread(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="ideaforge-trace-export", daemon=True)
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            batch, flushes = [], []
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    flushes.append(item)
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self.exporter.export(batch)
+                    self._bump(exported=len(batch))
+                except Exception as e:
+                    self._bump(export_errors=1)
+                    print(f"Tracing: exporting {len(batch)} spans failed: {e}")
+            for flushed in flushes:
+                flushed.set()
+
+
+_current_span = contextvars.ContextVar("ideaforge_current_span", default=None)
+_processor = None
+_sample_rate = TRACE_SAMPLE_RATE
+_stats_lock = threading.Lock()
+_stats = {"traces_started": 0, "traces_sampled": 0}
+
+
+def configure(exporter: SpanExporter = None, sample_rate: float = None):
+    """Replaces the exporter (None disables tracing) and optionally the sample rate."""
+    global _processor, _sample_rate
+    previous = _processor
+    _processor = BatchSpanProcessor(exporter) if exporter is not None else None
+    if sample_rate is not None:
+        _sample_rate = sample_rate
+    if previous is not None:
+        previous.shutdown()
+
+
+def enabled() -> bool:
+    return _processor is not None
+
+
+def stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    if _processor is not None:
+        stats.update(_processor.stats())
+    return stats
+
+
+def parse_traceparent(value: str):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent, or None if it is malformed."""
+    parts = (value or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_traceparent():
+    """traceparent of the current span, for storing alongside work that finishes later; None when not tracing."""
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+
+def set_attributes(**attributes):
+    """Sets attributes (None values are skipped) on the current span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attributes(**attributes)
+
+
+def record_error(error):
+    """Marks the current span as failed, for code that reports errors by return value."""
+    span = _current_span.get()
+    if span is not None:
+        span.record_error(error)
+
+
+def start_span(name: str, parent=None, **attributes):
+    """
+    Starts a span under parent (a Span or traceparent string), or under the current span.
+    Returns None when tracing is disabled. The caller activates and ends it; prefer span().
+    """
+    if _processor is None:
+        return None
+    if parent is None:
+        parent = _current_span.get()
+    if isinstance(parent, Span):
+        inherited = {key: parent.attributes[key] for key in PROPAGATED_ATTRIBUTES if key in parent.attributes}
+        inherited.update(attributes)
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, inherited)
+    remote = parse_traceparent(parent) if isinstance(parent, str) else None
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+        return Span(name, trace_id, parent_id, sampled, attributes)
+    sampled = random.random() < _sample_rate
+    with _stats_lock:
+        _stats["traces_started"] += 1
+        _stats["traces_sampled"] += sampled
+    return Span(name, "%032x" % random.getrandbits(128), None, sampled, attributes)
+
+
+def end_span(span):
+    if span is None or span.end is not None:
+        return
+    span.end = time.time()
+    processor = _processor
+    if span.sampled and processor is not None:
+        processor.on_end(span)
+
+
+@contextmanager
+def span(name: str, parent=None, **attributes):
+    """Runs a block as a child of parent (default: the current span); an escaping exception marks it as failed."""
+    current = start_span(name, parent, **attributes)
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        end_span(current)
+
+
+def traced(name: str):
+    """Decorator form of span(), for functions and coroutine functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(fn):
+    """Wraps fn to run under the current span, for handing work to another thread."""
+    parent = _current_span.get()
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return bound
+
+
+@contextmanager
+def activate(parent):
+    """Makes parent (a Span or None) the current span for a block, e.g. on a worker thread."""
+    token = _current_span.set(parent)
+    try:
+        yield parent
+    finally:
+        _current_span.reset(token)
+
+
+def instrument_flask(app):
+    """Opens a root span per request (continuing an incoming traceparent) and returns X-Trace-Id."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_span():
+        if _processor is None:
+            return
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        current = start_span(f"{request.method} {rule}", request.headers.get("traceparent"),
+                             **{"http.method": request.method, "http.route": rule})
+        g.trace_span = current
+        g.trace_token = _current_span.set(current)
+
+    @app.after_request
+    def _tag_response(response):
+        current = g.get("trace_span")
+        if current is not None:
+            current.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                current.status = "error"
+            if current.sampled:
+                response.headers["X-Trace-Id"] = current.trace_id
+        return response
+
+    @app.teardown_request
+    def _end_request_span(error):
+        current = g.pop("trace_span", None)
+        token = g.pop("trace_token", None)
+        if current is None:
+            return
+        if error is not None:
+            current.record_error(error)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Streamed responses finish in a different context than they started in
+            pass
+        end_span(current)
+
+    return app
+
+
+def instrument_aiohttp(app):
+    """instrument_flask() for an aiohttp web.Application (call before it starts)."""
+    from aiohttp import web
+
+    @web.middleware
+    async def trace_request(request, handler):
+        if _processor is None:
+            return await handler(request)
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        with span(f"{request.method} {route}", request.headers.get("traceparent"),
+                  **{"http.method": request.method, "http.route": route}) as current:
+            try:
+                response = await handler(request)
+            except web.HTTPException as e:
+                current.set_attribute("http.status_code", e.status)
+                raise
+            current.set_attribute("http.status_code", response.status)
+            if response.status >= 500:
+                current.status = "error"
+            if current.sampled and not response.prepared:
+                response.headers["X-Trace-Id"] = current.trace_id
+            return response
+
+    app.middlewares.append(trace_request)
+    return app
+
+
+def shutdown():
+    if _processor is not None:
+        _processor.shutdown()
+
+
+metrics.register_stats("ideaforge_tracing", stats,
+                       counters=("traces_started", "traces_sampled", "exported", "dropped", "export_errors"))
+if TRACE_FILE:
+    configure(JsonLinesExporter(TRACE_FILE))
+atexit.register(shutdown)